@@ -0,0 +1,145 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+import app.metrics as metrics
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+QUEUE_DEPTH = metrics.gauge(
+    "inference_queue_depth",
+    "Number of inputs waiting to be batched",
+    ["batcher"]
+)
+BATCH_SIZE = metrics.histogram(
+    "inference_batch_size",
+    "Number of inputs run together in one forward pass",
+    ["batcher"],
+    buckets=BATCH_SIZE_BUCKETS
+)
+WAIT_SECONDS = metrics.histogram(
+    "inference_wait_seconds",
+    "Time an input waited in the queue before its batch started",
+    ["batcher"]
+)
+BATCH_SECONDS = metrics.histogram(
+    "inference_batch_seconds",
+    "Time taken to run one batch",
+    ["batcher"]
+)
+
+
+class MicroBatcher:
+    """
+    Gathers concurrent single-item calls into batches.
+
+    Items submitted from any thread are queued. A worker thread takes the
+    first waiting item, then keeps collecting items until either
+    max_batch_size is reached or max_wait_ms has passed since that first
+    item arrived. batch_fn is called once with the list of items and must
+    return one result per item, in order.
+    """
+
+    def __init__(self, name, batch_fn, max_batch_size=32, max_wait_ms=5):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        QUEUE_DEPTH.labels(batcher=name).set_function(self._queue.qsize)
+
+    def submit(self, item):
+        """Queue an item. Returns a Future resolving to its result."""
+
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future, monotonic()))
+        return future
+
+    def __call__(self, item):
+        """Run one item through the batcher and wait for its result."""
+
+        return self.submit(item).result()
+
+    def _ensure_worker(self):
+        """Start the worker thread on first use."""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name=f"{self.name}-batcher",
+                    daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self):
+        """Block for the first item then gather a batch around it."""
+
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _deliver(self, futures, results):
+        results = list(results)
+        if len(results) != len(futures):
+            raise ValueError(
+                f"{self.name} batch_fn returned {len(results)} results "
+                f"for {len(futures)} items"
+            )
+
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = monotonic()
+
+            BATCH_SIZE.labels(batcher=self.name).observe(len(batch))
+            for _, _, enqueued in batch:
+                WAIT_SECONDS.labels(batcher=self.name).observe(
+                    started - enqueued
+                )
+
+            # Items whose caller cancelled them while queued aren't run.
+            # The rest can no longer be cancelled, so always take a result.
+            batch = [
+                (item, future, enqueued) for item, future, enqueued in batch
+                if future.set_running_or_notify_cancel()
+            ]
+            items = [item for item, _, _ in batch]
+            futures = [future for _, future, _ in batch]
+
+            try:
+                if items:
+                    self._deliver(futures, self.batch_fn(items))
+            except Exception as e:
+                logging.error(e)
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+            BATCH_SECONDS.labels(batcher=self.name).observe(
+                monotonic() - started
+            )
@@ -2,9 +2,13 @@ import os
 
 from dotenv import load_dotenv
 import boto3
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 import logging
 
+import app.executors as executors
+
 load_dotenv()
 
 
@@ -12,6 +16,14 @@ AWS_ACCESS_KEY = os.environ['AWS_ACCESS_KEY']
 AWS_SECRET_ACCESS_KEY = os.environ['AWS_SECRET_ACCESS_KEY']
 REGION = os.environ['REGION']
 BUCKET_NAME = os.environ['BUCKET_NAME']
+# Streamed uploads are sent in parts of S3_PART_SIZE bytes (S3's minimum is
+# 5 MiB), S3_UPLOAD_CONCURRENCY at a time, which bounds how much of a file
+# is buffered.
+S3_PART_SIZE = int(os.environ.get("S3_PART_SIZE", 8 * 1024 * 1024))
+S3_UPLOAD_CONCURRENCY = int(os.environ.get("S3_UPLOAD_CONCURRENCY", 4))
+# S3-compatible server to use instead of AWS, e.g. MinIO or moto. Object
+# URLs become path-style URLs on it.
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None
 
 
 class Bucket:
@@ -21,15 +33,18 @@ class Bucket:
             aws_access_key=AWS_ACCESS_KEY,
             aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
             region=REGION,
-            bucket_name=BUCKET_NAME):
+            bucket_name=BUCKET_NAME,
+            endpoint_url=S3_ENDPOINT_URL):
 
         self.bucket_name = bucket_name
         self.region = region
+        self.endpoint_url = endpoint_url
         self.client = boto3.client(
             "s3",
             region,
             aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret_access_key
+            aws_secret_access_key=aws_secret_access_key,
+            endpoint_url=endpoint_url
         )
 
     def upload_file(self, image_binary, file_name, content_type='image/jpeg'):
@@ -48,8 +63,7 @@ class Bucket:
                 ContentType=content_type
             )
 
-            aws_image_src = (f'https://{self.bucket_name}'
-                             f'.s3.{self.region}.amazonaws.com/{file_name}')
+            aws_image_src = self.url(file_name)
 
         except ClientError as e:
             logging.error(e)
@@ -57,6 +71,53 @@ class Bucket:
 
         return aws_image_src
 
+    def upload_fileobj(self, file, file_name, content_type='image/jpeg'):
+        """
+        Stream a file-like object to an S3 bucket from its current position,
+        as a multipart upload if it's larger than S3_PART_SIZE.
+        returns: aws_image_src: URL to image in S3
+        """
+
+        config = TransferConfig(
+            multipart_threshold=S3_PART_SIZE,
+            multipart_chunksize=S3_PART_SIZE,
+            max_concurrency=S3_UPLOAD_CONCURRENCY
+        )
+
+        try:
+            self.client.upload_fileobj(
+                file,
+                self.bucket_name,
+                file_name,
+                ExtraArgs={"ContentType": content_type},
+                Config=config
+            )
+
+        except (ClientError, S3UploadFailedError) as e:
+            logging.error(e)
+            return
+
+        return self.url(file_name)
+
+    def url(self, file_name):
+        """URL of the object with key file_name."""
+
+        if self.endpoint_url:
+            return (f'{self.endpoint_url.rstrip("/")}'
+                    f'/{self.bucket_name}/{file_name}')
+
+        return (f'https://{self.bucket_name}'
+                f'.s3.{self.region}.amazonaws.com/{file_name}')
+
+    def key(self, url):
+        """Object key of a URL returned by upload_file."""
+
+        prefix = self.url("")
+        if not url.startswith(prefix):
+            raise ValueError(f"{url} isn't in bucket {self.bucket_name}")
+
+        return url[len(prefix):]
+
     def get_file(self, file_name):
         """Takes in a file name , returns response"""
 
@@ -76,3 +137,38 @@ class Bucket:
         except ClientError as e:
             logging.error(e)
             return
+
+
+class AsyncBucket:
+    """
+    Awaitable wrapper around a Bucket. The blocking boto3 calls run on the
+    bounded S3 executor instead of the event loop.
+    """
+
+    def __init__(self, bucket, executor=executors.s3):
+        self.bucket = bucket
+        self.executor = executor
+
+    async def upload_file(self, image_binary, file_name, content_type='image/jpeg'):
+        """Upload a file to an S3 bucket. Returns the URL to the image."""
+
+        return await self.executor.run(
+            self.bucket.upload_file, image_binary, file_name, content_type
+        )
+
+    async def upload_fileobj(self, file, file_name, content_type='image/jpeg'):
+        """Stream a file-like object to an S3 bucket. Returns the URL."""
+
+        return await self.executor.run(
+            self.bucket.upload_fileobj, file, file_name, content_type
+        )
+
+    async def get_file(self, file_name):
+        """Takes in a file name , returns response"""
+
+        return await self.executor.run(self.bucket.get_file, file_name)
+
+    async def delete_file(self, file_name):
+        """Delete an image from an S3 bucket"""
+
+        return await self.executor.run(self.bucket.delete_file, file_name)
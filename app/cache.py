@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+import app.metrics as metrics
+
+HITS = metrics.counter(
+    "cache_hits_total",
+    "Number of cache lookups that found a live entry",
+    ["cache"]
+)
+MISSES = metrics.counter(
+    "cache_misses_total",
+    "Number of cache lookups that found nothing or an expired entry",
+    ["cache"]
+)
+EVICTIONS = metrics.counter(
+    "cache_evictions_total",
+    "Number of entries dropped to stay within the size limit",
+    ["cache"]
+)
+SIZE = metrics.gauge(
+    "cache_size",
+    "Number of entries currently held",
+    ["cache"]
+)
+
+
+def normalize_query(text):
+    """
+    Fold case and collapse whitespace in a search query.
+    The CLIP tokenizer does the same, so equal keys give equal embeddings.
+    """
+
+    return " ".join(text.lower().split())
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded least-recently-used cache whose entries
+    expire ttl seconds after they were stored. A ttl of None never expires.
+    """
+
+    def __init__(self, name, max_size=1024, ttl=None, clock=monotonic):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = HITS.labels(cache=name)
+        self.misses = MISSES.labels(cache=name)
+        self.evictions = EVICTIONS.labels(cache=name)
+        SIZE.labels(cache=name).set_function(lambda: len(self._entries))
+
+    def get(self, key, default=None):
+        """Return the live value for key, or default."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits.inc()
+                    return value
+                del self._entries[key]
+
+        self.misses.inc()
+        return default
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entries."""
+
+        expires_at = None if self.ttl is None else self.clock() + self.ttl
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions.inc()
+
+    def clear(self):
+        """Drop every entry."""
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
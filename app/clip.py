@@ -1,43 +1,285 @@
-import requests
+import os
+import asyncio
+import logging
+import threading
 
+import requests
+import torch
+from dotenv import load_dotenv
 from PIL import Image
 from torch.linalg import vector_norm
-from torch import div, flatten
-from transformers import CLIPProcessor, CLIPModel
+from transformers import (
+    AutoTokenizer,
+    CLIPImageProcessor,
+    CLIPTextModelWithProjection,
+    CLIPVisionModelWithProjection
+)
 
-MODEL = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-PROCESSOR = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-EMBEDDING_SIZE = MODEL.projection_dim
+import app.clip_backends as clip_backends
+from app.batcher import MicroBatcher
+from app.config import CLIP_MODEL_NAME, EMBEDDING_SIZE
+from app.image_utils import open_image
+from app.instrumentation import Span
 
-def get_text_embedding(text):
-    """ Takes in text and returns normalized CLIP embedding."""
+load_dotenv()
 
-    text_inputs = PROCESSOR(
-        text=text,
-        return_tensors="pt"
+CLIP_BATCH_MAX_SIZE = int(os.environ.get("CLIP_BATCH_MAX_SIZE", 32))
+CLIP_BATCH_MAX_WAIT_MS = float(os.environ.get("CLIP_BATCH_MAX_WAIT_MS", 5))
+# eager, int8, torchscript, compile or onnx; see app/clip_backends.py
+CLIP_BACKEND = os.environ.get("CLIP_BACKEND", "eager")
+
+# Which towers this process loads: "search" only embeds text queries,
+# "ingest" only embeds images and "all" does both
+CLIP_ROLE = os.environ.get("CLIP_ROLE", "all")
+ROLES = {
+    "search": ("text",),
+    "ingest": ("image",),
+    "all": ("text", "image"),
+}
+
+# Loaded on first use, so importing this module doesn't load any weights
+_loaded = False
+_text_model = None
+_vision_model = None
+_tokenizer = None
+_image_processor = None
+_text_encoder = None
+_image_encoder = None
+_load_lock = threading.Lock()
+_ready = threading.Event()
+
+def load_model():
+    """
+    Load the towers for CLIP_ROLE. Each tower is loaded on its own from the
+    full CLIP checkpoint, so a search worker never holds the vision weights
+    and an ingest worker never holds the text weights.
+    """
+
+    global _loaded, _text_model, _vision_model, _tokenizer, _image_processor
+    global _text_encoder, _image_encoder
+
+    with _load_lock:
+        if _loaded:
+            return
+
+        if CLIP_ROLE not in ROLES:
+            raise ValueError(
+                f"Unknown CLIP_ROLE {CLIP_ROLE!r}, expected one of "
+                f"{', '.join(ROLES)}"
+            )
+
+        if "text" in ROLES[CLIP_ROLE]:
+            _text_model = _load_tower(CLIPTextModelWithProjection)
+            _tokenizer = AutoTokenizer.from_pretrained(CLIP_MODEL_NAME)
+
+        if "image" in ROLES[CLIP_ROLE]:
+            _vision_model = _load_tower(CLIPVisionModelWithProjection)
+            _image_processor = CLIPImageProcessor.from_pretrained(
+                CLIP_MODEL_NAME
+            )
+
+        _text_encoder, _image_encoder = clip_backends.load(
+            CLIP_BACKEND,
+            _text_model,
+            _vision_model,
+            _tokenizer,
+            _image_processor,
+            CLIP_MODEL_NAME
+        )
+
+        _loaded = True
+
+def _load_tower(model_class):
+    model = model_class.from_pretrained(CLIP_MODEL_NAME)
+
+    if model.config.projection_dim != EMBEDDING_SIZE:
+        raise ValueError(
+            f"{CLIP_MODEL_NAME} produces embeddings of size "
+            f"{model.config.projection_dim}, but EMBEDDING_SIZE is "
+            f"{EMBEDDING_SIZE}"
+        )
+
+    return model.eval()
+
+def can_embed(kind):
+    """Whether this process's CLIP_ROLE embeds kind, "text" or "image"."""
+
+    return kind in ROLES.get(CLIP_ROLE, ())
+
+def _require(kind):
+    """Load the model if needed and check this role embeds kind."""
+
+    if not _loaded:
+        load_model()
+
+    if not can_embed(kind):
+        raise RuntimeError(
+            f"CLIP_ROLE={CLIP_ROLE} doesn't load the {kind} model"
+        )
+
+def get_text_model():
+    """Return the shared CLIP text tower, loading it on first use."""
+
+    _require("text")
+    return _text_model
+
+def get_vision_model():
+    """Return the shared CLIP vision tower, loading it on first use."""
+
+    _require("image")
+    return _vision_model
+
+def get_tokenizer():
+    """Return the shared CLIP tokenizer, loading it on first use."""
+
+    _require("text")
+    return _tokenizer
+
+def get_image_processor():
+    """Return the shared CLIP image processor, loading it on first use."""
+
+    _require("image")
+    return _image_processor
+
+def get_text_encoder():
+    """Return the text encoder for the configured CLIP_BACKEND."""
+
+    _require("text")
+    return _text_encoder
+
+def get_image_encoder():
+    """Return the image encoder for the configured CLIP_BACKEND."""
+
+    _require("image")
+    return _image_encoder
+
+def warm_up():
+    """
+    Load the model and run a dummy text and/or image through it, so the first
+    real request doesn't pay for loading weights or lazy allocations.
+    """
+
+    load_model()
+
+    if can_embed("text"):
+        get_text_embedding("warm up")
+    if can_embed("image"):
+        get_image_embedding_from_data(Image.new("RGB", (224, 224)))
+
+    _ready.set()
+    logging.info(f"{CLIP_MODEL_NAME} warmed up")
+
+def is_ready():
+    """Whether warm_up has finished."""
+
+    return _ready.is_set()
+
+def _normalize(embeds):
+    """Scale each row of a batch of embeddings to unit length."""
+
+    return embeds / vector_norm(embeds, dim=-1, keepdim=True)
+
+def get_text_embeddings(texts):
+    """
+    Takes in a list of texts and returns their normalized CLIP embeddings,
+    computed in a single forward pass.
+    """
+
+    with Span("clip", "tokenize"):
+        text_inputs = get_tokenizer()(
+            texts,
+            return_tensors="pt",
+            padding=True
+        )
+
+    with Span("clip", "text_forward"), torch.inference_mode():
+        text_embeds = get_text_encoder()(
+            text_inputs["input_ids"], text_inputs["attention_mask"]
+        )
+
+    return _normalize(text_embeds).tolist()
+
+def get_image_embeddings(images):
+    """
+    Takes in a list of JPG bytes, file-like objects or decoded PIL images and
+    returns their normalized CLIP embeddings, computed in a single forward pass.
+    """
+
+    return get_preprocessed_image_embeddings(
+        [preprocess_image(image) for image in images]
     )
 
-    text_embeds = MODEL.get_text_features(**text_inputs)
-    normed_text_embeds = div(text_embeds, vector_norm(text_embeds))
+def preprocess_image(image):
+    """Resize and normalize one image into a (1, 3, H, W) pixel tensor."""
 
-    return flatten(normed_text_embeds).tolist()
+    return get_image_processor()(
+        images=open_image(image),
+        return_tensors="pt"
+    )["pixel_values"]
+
+def _get_pixel_embeddings(pixel_values):
+    """Run a batch of preprocessed images through the vision tower."""
+
+    with Span("clip", "image_forward"), torch.inference_mode():
+        image_embeds = get_image_encoder()(pixel_values)
+
+    return _normalize(image_embeds)
+
+def get_preprocessed_image_embeddings(pixel_values):
+    """
+    Takes a list of pixel tensors from preprocess_image and returns their
+    normalized CLIP embeddings, computed in a single forward pass.
+    """
+
+    return _get_pixel_embeddings(torch.cat(pixel_values)).tolist()
+
+# Concurrent single-item calls are gathered into one forward pass.
+TEXT_BATCHER = MicroBatcher(
+    "text",
+    get_text_embeddings,
+    max_batch_size=CLIP_BATCH_MAX_SIZE,
+    max_wait_ms=CLIP_BATCH_MAX_WAIT_MS
+)
+IMAGE_BATCHER = MicroBatcher(
+    "image",
+    get_preprocessed_image_embeddings,
+    max_batch_size=CLIP_BATCH_MAX_SIZE,
+    max_wait_ms=CLIP_BATCH_MAX_WAIT_MS
+)
+
+def get_text_embedding(text):
+    """ Takes in text and returns normalized CLIP embedding."""
+
+    return TEXT_BATCHER(text)
 
 def get_image_embedding(image_url):
     """
     Takes a URL for a JPG image and returns the image's normalized CLIP embedding.
+    Used for re-embedding images that are already stored in S3.
     """
 
     image = Image.open(requests.get(image_url, stream=True).raw)
 
-    image_inputs = PROCESSOR(
-        images=image, 
-        return_tensors="pt", 
-        padding=True
-    )
+    return get_image_embedding_from_data(image)
 
-    image_embeds = MODEL.get_image_features(**image_inputs)
-    normed_image_embeds = div(image_embeds, vector_norm(image_embeds))
+def get_image_embedding_from_data(image):
+    """
+    Takes JPG bytes, a file-like object or a decoded PIL image and returns
+    the image's normalized CLIP embedding without any network round-trip.
+    Preprocessing runs in the calling thread; the forward pass is batched.
+    """
+
+    return IMAGE_BATCHER(preprocess_image(image))
 
-    return flatten(normed_image_embeds).tolist()
+async def get_image_embedding_async(image, executor):
+    """
+    Awaitable get_image_embedding_from_data. Preprocessing runs on the given
+    executor and the forward pass on the image batcher's thread, so the
+    event loop is never blocked. Cancelling it, e.g. when the client goes
+    away, drops the image from the batcher's queue if its batch hasn't
+    started.
+    """
 
+    pixel_values = await executor.run(preprocess_image, image)
 
+    return await asyncio.wrap_future(IMAGE_BATCHER.submit(pixel_values))
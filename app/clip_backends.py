@@ -0,0 +1,197 @@
+import os
+import re
+import logging
+
+import torch
+from dotenv import load_dotenv
+from PIL import Image
+
+load_dotenv()
+
+# Where exported ONNX graphs are cached between restarts
+CLIP_ONNX_DIR = os.environ.get("CLIP_ONNX_DIR", "onnx_models")
+ONNX_OPSET = 17
+
+
+# Inference backends. Each one turns a CLIP tower, wrapped as a module that
+# maps input tensors to unnormalized projected features, into a callable
+# with the same signature that runs on CPU as fast as it can.
+
+class TextEncoder(torch.nn.Module):
+    """
+    A CLIPTextModelWithProjection as a plain tensor-in, tensor-out module.
+    """
+
+    input_names = ["input_ids", "attention_mask"]
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask
+        ).text_embeds
+
+
+class ImageEncoder(torch.nn.Module):
+    """
+    A CLIPVisionModelWithProjection as a plain tensor-in, tensor-out module.
+    """
+
+    input_names = ["pixel_values"]
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).image_embeds
+
+
+def eager(encoder, example_inputs, name):
+    """The fp32 PyTorch reference."""
+
+    return encoder
+
+def int8(encoder, example_inputs, name):
+    """
+    Dynamic int8 quantization of every Linear layer. Weights are quantized
+    once, activations on the fly. Quantizes in place so the fp32 weights
+    aren't kept alongside the int8 ones.
+    """
+
+    return torch.ao.quantization.quantize_dynamic(
+        encoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+def torchscript(encoder, example_inputs, name):
+    """A traced and frozen TorchScript graph."""
+
+    with torch.no_grad():
+        traced = torch.jit.trace(encoder, example_inputs, check_trace=False)
+        return torch.jit.freeze(traced.eval())
+
+def compiled(encoder, example_inputs, name):
+    """torch.compile with dynamic shapes, compiled on the first call."""
+
+    return torch.compile(encoder, dynamic=True)
+
+def onnx(encoder, example_inputs, name):
+    """
+    An ONNX Runtime session over the encoder exported to ONNX. The export
+    is cached in CLIP_ONNX_DIR, so it only happens once per model.
+    """
+
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError(
+            "The onnx CLIP backend needs onnxruntime: pip install onnxruntime"
+        ) from None
+
+    path = os.path.join(CLIP_ONNX_DIR, f"{name}.onnx")
+    if not os.path.exists(path):
+        _export_onnx(encoder, example_inputs, path)
+
+    return OnnxEncoder(
+        onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"]),
+        encoder.input_names
+    )
+
+def _export_onnx(encoder, example_inputs, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+
+    dynamic_axes = {"features": {0: "batch"}}
+    for input_name in encoder.input_names:
+        dynamic_axes[input_name] = {0: "batch"}
+    if "input_ids" in encoder.input_names:
+        dynamic_axes["input_ids"][1] = "sequence"
+        dynamic_axes["attention_mask"][1] = "sequence"
+
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder,
+            example_inputs,
+            tmp_path,
+            input_names=encoder.input_names,
+            output_names=["features"],
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET
+        )
+
+    os.replace(tmp_path, path)
+    logging.info(f"Exported {path}")
+
+
+class OnnxEncoder:
+    """Call an ONNX Runtime session like the module it was exported from."""
+
+    def __init__(self, session, input_names):
+        self.session = session
+        self.input_names = input_names
+
+    def __call__(self, *inputs):
+        features, = self.session.run(
+            ["features"],
+            {
+                input_name: tensor.numpy()
+                for input_name, tensor in zip(self.input_names, inputs)
+            }
+        )
+        return torch.from_numpy(features)
+
+
+BACKENDS = {
+    "eager": eager,
+    "int8": int8,
+    "torchscript": torchscript,
+    "compile": compiled,
+    "onnx": onnx,
+}
+
+def load(backend, text_model, vision_model, tokenizer, image_processor,
+         model_name):
+    """
+    Build (text_encoder, image_encoder) callables with the named backend.
+    The text encoder takes (input_ids, attention_mask) and the image encoder
+    pixel_values; both return unnormalized features. Either model may be
+    None, in which case its encoder is None too.
+    """
+
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown CLIP backend {backend!r}, expected one of "
+            f"{', '.join(BACKENDS)}"
+        )
+
+    prepare = BACKENDS[backend]
+    name = re.sub(r"[^\w.-]", "_", model_name)
+    text_encoder = image_encoder = None
+
+    if text_model is not None:
+        text_inputs = tokenizer(
+            ["an example query", "a longer example search query"],
+            return_tensors="pt",
+            padding=True
+        )
+        text_encoder = prepare(
+            TextEncoder(text_model),
+            (text_inputs["input_ids"], text_inputs["attention_mask"]),
+            f"{name}.text"
+        )
+
+    if vision_model is not None:
+        image_inputs = image_processor(
+            images=[Image.new("RGB", (224, 224))] * 2,
+            return_tensors="pt"
+        )
+        image_encoder = prepare(
+            ImageEncoder(vision_model),
+            (image_inputs["pixel_values"],),
+            f"{name}.image"
+        )
+
+    return text_encoder, image_encoder
@@ -0,0 +1,24 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Settings needed without loading the model's weights, e.g. by the schema.
+
+CLIP_MODEL_NAME = os.environ.get(
+    "CLIP_MODEL_NAME",
+    "openai/clip-vit-base-patch32"
+)
+
+# The model's projection_dim. Checked against the model when it loads.
+EMBEDDING_SIZE = int(os.environ.get("EMBEDDING_SIZE", 512))
+
+# How images.embedding is stored: vector (float32) or halfvec (float16, half
+# the size of the table's vectors and their index, needs pgvector >= 0.7).
+# Existing tables are converted with `python -m app.vector_index migrate`.
+EMBEDDING_TYPE = os.environ.get("EMBEDDING_TYPE", "vector").lower()
+
+# Shortest side the model's image processor resizes inputs to. Uploads are
+# decoded at a reduced scale, but never smaller than this.
+CLIP_IMAGE_SIZE = int(os.environ.get("CLIP_IMAGE_SIZE", 224))
@@ -1,55 +1,1195 @@
-from sqlalchemy.orm import Session
+import os
+import logging
+from itertools import takewhile
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import (
+    String,
+    cast,
+    column,
+    func,
+    literal,
+    or_,
+    select,
+    true,
+    tuple_,
+    union_all,
+    update,
+    values
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, aliased, defer
+from sqlalchemy.orm.attributes import set_committed_value
 
 import app.schemas as schemas
 import app.clip as clip
-from app.models import Image
+import app.vector_index as vector_index
+import app.vector_store as vector_store
+from app.cache import LRUCache, normalize_query
+from app.exif_columns import TAKEN_AT_FORMAT
+from app.instrumentation import timed_iter
+from app.models import Image, IngestJob, QueryEmbedding, TableVersion
+
+load_dotenv()
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", 3600))
+QUERY_CACHE_PERSIST = (
+    os.environ.get("QUERY_CACHE_PERSIST", "false").lower() == "true"
+)
+# Rows fetched per round trip when streaming results
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 100))
+# How filtered searches run: "pre" ranks every matching row exactly, "post"
+# filters rows as they come off the ANN index, "auto" pre-filters when at
+# most FILTER_EXACT_MAX_ROWS rows match
+FILTER_STRATEGY = os.environ.get("FILTER_STRATEGY", "auto").lower()
+FILTER_EXACT_MAX_ROWS = int(os.environ.get("FILTER_EXACT_MAX_ROWS", 10000))
+# When post-filtering, how many more index rows to scan than are needed
+FILTER_OVERSAMPLE = int(os.environ.get("FILTER_OVERSAMPLE", 10))
+# How long a process trusts the images version it last read, so conditional
+# GETs and cached searches don't each query it. Writes from other processes
+# show up after at most this long.
+IMAGES_VERSION_TTL = float(os.environ.get("IMAGES_VERSION_TTL", 1))
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 256))
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 3600))
 
+query_embedding_cache = LRUCache(
+    "query_embedding",
+    max_size=QUERY_CACHE_SIZE,
+    ttl=QUERY_CACHE_TTL
+)
+# Version of images on the primary and on the read replica, see
+# get_images_version
+images_version_cache = LRUCache(
+    "images_version",
+    max_size=2,
+    ttl=IMAGES_VERSION_TTL
+)
+# Pages of search results, keyed by search and images version
+search_results_cache = LRUCache(
+    "search_results",
+    max_size=SEARCH_CACHE_SIZE,
+    ttl=SEARCH_CACHE_TTL
+)
 
-def get_image(db: Session, image_name: str):
-    """Get one image based on its name"""
 
-    image = (
-        db.query(Image)
+def get_image(db: Session, image_name: str, exif_fields: list = None):
+    """
+    Get one image based on its name, without its embedding.
+    exif_fields: only load these keys of its EXIF data
+    """
+
+    row = (
+        _project(db.query(Image), exif_fields)
         .filter(Image.name == image_name)
         .first()
     )
 
-    return image
+    return next(_images([row], False, exif_fields)) if row else None
 
-def get_images(db: Session, limit: int = 50, search_term = None):
+def _project(query, exif_fields):
+    """
+    Never load the embedding, which responses don't include. With
+    exif_fields, select just those keys of exif_data as an extra column.
+    """
+
+    query = query.options(defer(Image.embedding))
+    if exif_fields is None:
+        return query
+
+    return query.options(defer(Image.exif_data)).add_columns(
+        func.json_strip_nulls(func.json_build_object(*[
+            arg for field in exif_fields
+            for arg in (cast(field, String), Image.exif_data[field])
+        ]))
+    )
+
+def _images(rows, scored, exif_fields):
+    """
+    Turn query rows into images. Scored rows carry the pgvector distance
+    and projected rows their selected EXIF data as extra columns.
+    """
+
+    for row in rows:
+        if not scored and exif_fields is None:
+            yield row
+            continue
+
+        image, *columns = row
+        if scored:
+            # <#> is the negative inner product
+            image.score = -columns.pop(0)
+        if exif_fields is not None:
+            # Not a change, so it's never written back
+            set_committed_value(image, "exif_data", columns.pop(0))
+
+        yield image
+
+def get_image_embedding(db: Session, image_name: str):
+    """Get the stored embedding of an image as a list, or None."""
+
+    embedding = (
+        db.query(Image.embedding).filter(Image.name == image_name).scalar()
+    )
+
+    return embedding.tolist() if embedding is not None else None
+
+def get_query_embedding(db: Session, search_term: str):
+    """
+    Get the CLIP embedding for a search term.
+    Looks in the in-process cache, then (if enabled) the query_embeddings
+    table, and only runs the text encoder when both miss.
+    """
+
+    query = normalize_query(search_term)
+
+    embedding = query_embedding_cache.get(query)
+    if embedding is not None:
+        return embedding
+
+    if QUERY_CACHE_PERSIST:
+        embedding = _get_persisted_query_embeddings(db, [query]).get(query)
+
+    if embedding is None:
+        embedding = clip.get_text_embedding(query)
+
+        if QUERY_CACHE_PERSIST:
+            _persist_query_embeddings(db, {query: embedding})
+
+    query_embedding_cache.set(query, embedding)
+    return embedding
+
+def get_query_embeddings(db: Session, search_terms: list[str]):
+    """
+    get_query_embedding for several search terms, embedding all the ones
+    missing from the caches in a single forward pass.
+    """
+
+    queries = [normalize_query(search_term) for search_term in search_terms]
+
+    embeddings = {}
+    for query in queries:
+        embedding = query_embedding_cache.get(query)
+        if embedding is not None:
+            embeddings[query] = embedding
+
+    # Each distinct query once, in order
+    missing = [
+        query for query in dict.fromkeys(queries) if query not in embeddings
+    ]
+
+    if missing and QUERY_CACHE_PERSIST:
+        embeddings.update(_get_persisted_query_embeddings(db, missing))
+        missing = [query for query in missing if query not in embeddings]
+
+    if missing:
+        computed = dict(zip(missing, clip.get_text_embeddings(missing)))
+        embeddings.update(computed)
+
+        if QUERY_CACHE_PERSIST:
+            _persist_query_embeddings(db, computed)
+
+    for query in queries:
+        query_embedding_cache.set(query, embeddings[query])
+
+    return [embeddings[query] for query in queries]
+
+def _get_persisted_query_embeddings(db: Session, queries: list[str]):
+    try:
+        rows = db.query(QueryEmbedding).filter(
+            QueryEmbedding.query.in_(queries)
+        ).all()
+    except SQLAlchemyError as e:
+        logging.error(e)
+        db.rollback()
+        return {}
+
+    return {row.query: row.embedding.tolist() for row in rows}
+
+def _persist_query_embeddings(db: Session, embeddings: dict):
+    # Replicas are read-only
+    if db.info.get("replica"):
+        from app.database import SessionLocal
+
+        with SessionLocal() as primary:
+            return _persist_query_embeddings(primary, embeddings)
+
+    try:
+        db.execute(
+            insert(QueryEmbedding)
+            .values([
+                {"query": query, "embedding": embedding}
+                for query, embedding in embeddings.items()
+            ])
+            .on_conflict_do_nothing()
+        )
+        db.commit()
+    except SQLAlchemyError as e:
+        logging.error(e)
+        db.rollback()
+
+def get_images(
+        db: Session,
+        limit: int = 50,
+        search_term = None,
+        cursor: dict = None,
+        ef_search: int = None,
+        probes: int = None,
+        stream: bool = False,
+        exif_fields: list = None,
+        min_score: float = None,
+        filters: schemas.ImageFilters = None,
+        query_embedding: list = None,
+        exclude: str = None):
     """
     Get multiple images
     limit: Number of images to limit results to
     search_term: string by which to do a semantic search
+    query_embedding: embedding to search by instead of a search term's
+    cursor: decoded cursor from app.pagination, to start after the last
+        image of a previous page
+    ef_search / probes: ANN recall vs latency knobs, defaulting to env config
+    stream: fetch rows in batches from a server-side cursor
+    exif_fields: only load these keys of each image's EXIF data
+    min_score: with a search term, leave out images scoring lower
+    filters: only include images matching these metadata filters
+    exclude: name of an image to leave out, e.g. the one searched by
+
+    Embeddings are never loaded. Without a search term, images are listed
+    newest first, keyed on (uploaded_at, name). Search results are ranked
+    by inner product and carry it as image.score.
     """
 
-    embedding = clip.get_text_embedding(search_term) if search_term else None
+    embedding = query_embedding
+    if embedding is None and search_term:
+        embedding = get_query_embedding(db, search_term)
+
+    # The vector store only knows embeddings, so filtered searches go to
+    # Postgres
+    if (embedding and not filters and vector_store.is_enabled()
+            and len(vector_store.get_store())):
+        return _get_images_from_store(
+            db, embedding, limit, cursor, exif_fields, min_score, exclude
+        )
 
     if embedding:
-        return (
-            db.query(Image)
-            .order_by(Image.embedding.max_inner_product(embedding))
-            .limit(limit)
-        )
-    return (
-        db.query(Image)
-        .order_by(Image.uploaded_at.desc())
+        return _search_images(
+            db, embedding, limit, cursor, ef_search, probes, stream,
+            exif_fields, min_score, filters, exclude
+        )
+
+    query = _filter(db.query(Image), filters)
+    if exclude is not None:
+        query = query.filter(Image.name != exclude)
+    if cursor:
+        query = query.filter(
+            tuple_(Image.uploaded_at, Image.name) < (cursor["t"], cursor["n"])
+        )
+
+    query = (
+        _project(query, exif_fields)
+        .order_by(Image.uploaded_at.desc(), Image.name.desc())
         .limit(limit)
+    )
+    if stream:
+        query = query.yield_per(STREAM_BATCH_SIZE)
+
+    return query if exif_fields is None else _images(query, False, exif_fields)
+
+def search_images_cached(
+        db: Session,
+        search_term: str,
+        limit: int = 50,
+        cursor: dict = None,
+        exif_fields: list = None,
+        min_score: float = None,
+        filters: schemas.ImageFilters = None):
+    """
+    get_images for a search term, as a list of schemas.Image. Pages are
+    cached until the images version changes, so repeated searches run
+    neither CLIP nor the database.
+    """
+
+    key = (
+        normalize_query(search_term),
+        limit,
+        tuple(sorted(cursor.items())) if cursor else None,
+        tuple(exif_fields) if exif_fields is not None else None,
+        min_score,
+        filters.model_dump_json(exclude_none=True) if filters else None,
+        get_images_version(db)
+    )
+
+    images = search_results_cache.get(key)
+    if images is None:
+        rows = get_images(
+            db,
+            limit=limit,
+            search_term=search_term,
+            cursor=cursor,
+            exif_fields=exif_fields,
+            min_score=min_score,
+            filters=filters
+        )
+        images = [
+            _to_schema(image)
+            for image in timed_iter(rows, "crud", "get_images")
+        ]
+        search_results_cache.set(key, images)
+
+    return images
+
+def _filter(query, filters):
+    """Add the WHERE clauses for filters, a schemas.ImageFilters."""
+
+    if not filters:
+        return query
+
+    if filters.make:
+        query = query.filter(
+            Image.camera_make.startswith(filters.make.lower(), autoescape=True)
+        )
+    if filters.model:
+        query = query.filter(
+            Image.camera_model.startswith(
+                filters.model.lower(), autoescape=True
+            )
+        )
+    # taken_at is EXIF's own timestamp text, which sorts like the time
+    if filters.taken_after:
+        query = query.filter(
+            Image.taken_at >= filters.taken_after.strftime(TAKEN_AT_FORMAT)
+        )
+    if filters.taken_before:
+        query = query.filter(
+            Image.taken_at < filters.taken_before.strftime(TAKEN_AT_FORMAT)
+        )
+    if filters.min_focal_length is not None:
+        query = query.filter(Image.focal_length >= filters.min_focal_length)
+    if filters.max_focal_length is not None:
+        query = query.filter(Image.focal_length <= filters.max_focal_length)
+    if filters.orientation is not None:
+        query = query.filter(Image.orientation == filters.orientation)
+    if filters.uploaded_after:
+        query = query.filter(Image.uploaded_at >= filters.uploaded_after)
+    if filters.uploaded_before:
+        query = query.filter(Image.uploaded_at < filters.uploaded_before)
+
+    return query
+
+def _pre_filter(db, filters):
+    """
+    Whether a filtered search should rank every matching row exactly rather
+    than filter the ANN index's results. Exact ranking is cheap when few
+    rows match, and then an index scan would have to read past many
+    non-matching rows to fill a page.
+    """
+
+    if FILTER_STRATEGY != "auto":
+        return FILTER_STRATEGY == "pre"
+
+    # Counting stops as soon as the threshold is passed
+    matches = _filter(db.query(Image.name), filters).limit(
+        FILTER_EXACT_MAX_ROWS + 1
+    ).count()
+
+    return matches <= FILTER_EXACT_MAX_ROWS
+
+def _search_images(
+        db, embedding, limit, cursor, ef_search, probes, stream, exif_fields,
+        min_score, filters=None, exclude=None):
+    """
+    Rank images with pgvector, by distance and then name, so pages of
+    images with identical embeddings, e.g. deduplicated copies, neither
+    overlap nor skip any. The cursor resumes after the last (score, name).
+
+    With filters, either every matching row is ranked exactly (pre-filter),
+    or the index is scanned deeper and rows are filtered as they come off it
+    (post-filter), see _pre_filter.
+    """
+
+    depth = cursor["d"] if cursor else 0
+    pre_filter = bool(filters) and _pre_filter(db, filters)
+
+    if not pre_filter:
+        vector_index.set_search_params(
+            db,
+            ef_search=ef_search,
+            probes=probes,
+            min_results=_ann_depth(depth + limit, filters),
+            filtered=bool(filters)
         )
 
+    query = _search_query(
+        db, embedding, limit, cursor, exif_fields, None, filters, exclude,
+        pre_filter
+    )
+    if stream:
+        query = query.yield_per(STREAM_BATCH_SIZE)
+
+    images = _images(query, True, exif_fields)
+    if min_score is None:
+        return images
+
+    # Rows come best first, so those scoring at least min_score are a prefix
+    # of them. Stopping at the first weak one stops fetching rows, which a
+    # WHERE clause wouldn't.
+    return takewhile(lambda image: image.score >= min_score, images)
+
+def _ann_depth(min_results, filters):
+    """
+    Rows an index scan needs to return, oversampled for post-filtering, and
+    at least RERANK_CANDIDATES with binary quantization.
+    """
+
+    depth = min_results * FILTER_OVERSAMPLE if filters else min_results
+
+    if vector_index.BINARY_QUANTIZATION:
+        depth = max(depth, vector_index.RERANK_CANDIDATES)
+
+    return depth
+
+def _search_query(
+        db, embedding, limit, cursor, exif_fields, min_score, filters,
+        exclude, pre_filter, ranking_only=False):
+    """
+    Build the query for _search_images, selecting (Image, distance), or
+    (name, distance) if ranking_only, ordered by (distance, name) to match
+    the cursor.
+
+    With binary quantization, unless pre-filtering, candidates are taken
+    off the index by Hamming distance and only they are ranked exactly.
+    """
+
+    distance = Image.embedding.max_inner_product(embedding)
+    entity = Image.name if ranking_only else Image
+
+    if pre_filter:
+        # Materialized, so the planner can't merge it into an index scan
+        candidates = (
+            _filter(db.query(Image.name, distance.label("distance")), filters)
+            .cte()
+            .prefix_with("MATERIALIZED")
+        )
+        distance = candidates.c.distance
+        query = _search_filters(
+            db.query(entity, distance).join(
+                candidates, candidates.c.name == Image.name
+            ),
+            distance, cursor, min_score, exclude
+        )
+    elif vector_index.BINARY_QUANTIZATION:
+        depth = cursor["d"] if cursor else 0
+        # Materialized, so the exact ranking can't be merged into the scan
+        candidates = (
+            _filter(db.query(Image.name), filters)
+            .order_by(
+                Image.embedding_bits.hamming_distance(
+                    vector_index.quantize(embedding)
+                )
+            )
+            .limit(_ann_depth(depth + limit, filters))
+            .cte()
+            .prefix_with("MATERIALIZED")
+        )
+        query = _search_filters(
+            db.query(entity, distance.label("distance")).join(
+                candidates, candidates.c.name == Image.name
+            ),
+            distance, cursor, min_score, exclude
+        )
+    else:
+        # The index only serves an ORDER BY on the distance alone. Take the
+        # nearest rows off it, with every row tied with the last one, and
+        # only sort those by (distance, name).
+        nearest = (
+            _search_filters(
+                _filter(
+                    db.query(Image.name, distance.label("distance")), filters
+                ),
+                distance, cursor, min_score, exclude
+            )
+            .statement
+            .order_by(distance)
+            .fetch(limit, with_ties=True)
+            .subquery("nearest")
+        )
+        distance = nearest.c.distance
+        query = db.query(entity, distance).join(
+            nearest, nearest.c.name == Image.name
+        )
+
+    if not ranking_only:
+        query = _project(query, exif_fields)
+
+    return query.order_by(distance, Image.name).limit(limit)
+
+def _search_filters(query, distance, cursor, min_score, exclude):
+    """Narrow a search query to the rows after cursor, as _search_query."""
+
+    if exclude is not None:
+        query = query.filter(Image.name != exclude)
+    if cursor:
+        query = query.filter(
+            tuple_(distance, Image.name) > (-cursor["s"], cursor["n"])
+        )
+    if min_score is not None:
+        # Postgres doesn't end the scan at the first weak row. It keeps
+        # scanning and discarding rows until LIMIT or the index's
+        # ef_search/probes candidates run out. _search_images cuts off
+        # client-side instead, so only batch searches filter here.
+        query = query.filter(distance <= -min_score)
+
+    return query
+
+def search_images_batch(
+        db: Session,
+        searches: list[schemas.SearchQuery],
+        exif_fields: list = None):
+    """
+    Run several searches at once. Uncached queries are embedded in one
+    forward pass, and all the searches are ranked in one database query,
+    or one matrix multiply with the vector store.
+
+    Returns a list of schemas.Image per search. They aren't ORM objects
+    because one image can be in several results with different scores.
+    """
+
+    embeddings = get_query_embeddings(db, [search.q for search in searches])
+    results = [None] * len(searches)
+
+    # Routed as in get_images
+    use_store = vector_store.is_enabled() and len(vector_store.get_store())
+    from_store = [
+        i for i, search in enumerate(searches)
+        if use_store and not search.filters
+    ]
+    from_db = [i for i in range(len(searches)) if i not in set(from_store)]
+
+    if from_store:
+        ranked = vector_store.get_store().search_many(
+            [embeddings[i] for i in from_store],
+            [searches[i].limit for i in from_store],
+            [_min_score_filter(searches[i].min_score) for i in from_store]
+        )
+        for i, images in zip(
+                from_store, _get_ranked_images(db, ranked, exif_fields)):
+            results[i] = images
+
+    if from_db:
+        for i, images in zip(
+                from_db,
+                _search_images_union(
+                    db,
+                    [embeddings[i] for i in from_db],
+                    [searches[i] for i in from_db],
+                    exif_fields
+                )):
+            results[i] = images
+
+    return results
+
+def _search_images_union(db, embeddings, searches, exif_fields):
+    """
+    Rank several searches with pgvector in one query. Each search is ranked
+    by the query _search_images would run, narrowed to (name, distance) so
+    their UNION ALL doesn't carry whole rows, then joined to images once.
+    """
+
+    pre_filters = [
+        bool(search.filters) and _pre_filter(db, search.filters)
+        for search in searches
+    ]
+
+    ann_depths = [
+        _ann_depth(search.limit, search.filters)
+        for search, pre_filter in zip(searches, pre_filters)
+        if not pre_filter
+    ]
+    if ann_depths:
+        vector_index.set_search_params(
+            db,
+            min_results=max(ann_depths),
+            filtered=any(search.filters for search in searches)
+        )
+
+    ranked = union_all(*[
+        _search_query(
+            db, embedding, search.limit, None, None, search.min_score,
+            search.filters, None, pre_filter, ranking_only=True
+        ).add_columns(literal(i).label("search")).statement
+        for i, (embedding, search, pre_filter)
+        in enumerate(zip(embeddings, searches, pre_filters))
+    ]).subquery("ranked")
+
+    query = (
+        _project(
+            db.query(Image, ranked.c.distance)
+            .join(ranked, ranked.c.name == Image.name),
+            exif_fields
+        )
+        .add_columns(ranked.c.search)
+        .order_by(ranked.c.search, ranked.c.distance, Image.name)
+    )
+
+    rows = [[] for _ in searches]
+    for row in query:
+        # The search index is the last column, after the ones _images reads
+        rows[row[-1]].append(row)
+
+    return [
+        [_to_schema(image) for image in _images(search_rows, True, exif_fields)]
+        for search_rows in rows
+    ]
+
+def _get_ranked_images(db, ranked, exif_fields):
+    """
+    Fetch the images for several vector store rankings of (name, score)
+    pairs in one query.
+    """
+
+    names = {name for search_ranked in ranked for name, _ in search_ranked}
+
+    images = {
+        image.name: image
+        for image in _images(
+            _project(db.query(Image), exif_fields)
+            .filter(Image.name.in_(names)),
+            False,
+            exif_fields
+        )
+    }
+
+    return [
+        [
+            _to_schema(images[name], score)
+            for name, score in search_ranked if name in images
+        ]
+        for search_ranked in ranked
+    ]
+
+def _to_schema(image, score=None):
+    result = schemas.Image.model_validate(image, from_attributes=True)
+    if score is not None:
+        result.score = score
+    return result
+
+def _min_score_filter(min_score):
+    if min_score is None:
+        return None
+    return lambda scores: scores >= min_score
+
+def _get_images_from_store(
+        db: Session, embedding: list, limit: int, cursor, exif_fields,
+        min_score, exclude=None):
+    """
+    Rank with the memory-mapped vector store, then fetch just those rows
+    from Postgres by primary key.
+    """
+
+    # Rank one extra row in case the excluded image is among them
+    extra = 1 if exclude is not None else 0
+
+    max_score = cursor["s"] if cursor else None
+
+    def score_filter(scores):
+        keep = np.ones(len(scores), dtype=bool)
+        if max_score is not None:
+            keep &= scores <= max_score
+        if min_score is not None:
+            keep &= scores >= min_score
+        return keep
+
+    if cursor:
+        # Rows tied with the cursor's score may already have been returned,
+        # at most depth of them
+        ranked = vector_store.get_store().search(
+            embedding, limit + cursor["d"] + extra, score_filter=score_filter
+        )
+        ranked = [
+            (name, score)
+            for name, score in sorted(ranked, key=lambda r: (-r[1], r[0]))
+            if (-score, name) > (-cursor["s"], cursor["n"])
+        ]
+    else:
+        ranked = vector_store.get_store().search(
+            embedding, limit + extra, score_filter=score_filter
+        )
+
+    ranked = [
+        (name, score) for name, score in ranked if name != exclude
+    ][:limit]
+
+    names = [name for name, _ in ranked]
+
+    images = {
+        image.name: image
+        for image in _images(
+            _project(db.query(Image), exif_fields)
+            .filter(Image.name.in_(names)),
+            False,
+            exif_fields
+        )
+    }
+
+    results = []
+    for name, score in ranked:
+        if name in images:
+            images[name].score = score
+            results.append(images[name])
+
+    return results
+
+def get_images_version(db: Session):
+    """
+    Version of the images table, bumped by every write to it, as seen by
+    the database db is on. Cached for IMAGES_VERSION_TTL seconds.
+
+    Read it before the rows it versions: a replica only moves forward, so
+    rows read after it are never older, and nothing is cached under a
+    version newer than the rows it holds.
+    """
+
+    database = "replica" if db.info.get("replica") else "primary"
+
+    version = images_version_cache.get(database)
+    if version is None:
+        version = db.query(TableVersion.version).filter(
+            TableVersion.table_name == "images"
+        ).scalar() or 0
+        images_version_cache.set(database, version)
+
+    return version
+
+def _commit_images_change(db: Session):
+    """
+    Commit a write to images, bumping their version in the same
+    transaction so no reader sees the new version with the old rows.
+    """
+
+    version = db.execute(
+        insert(TableVersion)
+        .values(table_name="images", version=1)
+        .on_conflict_do_update(
+            index_elements=[TableVersion.table_name],
+            set_={"version": TableVersion.version + 1}
+        )
+        .returning(TableVersion.version)
+    ).scalar()
+    db.commit()
+
+    # This process sees its own writes on the primary at once. A replica
+    # may not have them yet, so its version is only ever read from it.
+    images_version_cache.set("primary", version)
+    search_results_cache.clear()
+
 def create_image(db: Session, image: schemas.ImageCreate):
     """Create a new image"""
 
     db_image = Image(**image.model_dump())
     db.add(db_image)
-    db.commit()
+    _commit_images_change(db)
     db.refresh(db_image)
+
+    if vector_store.is_enabled():
+        _sync_vector_store(
+            vector_store.get_store().append, image.name, image.embedding
+        )
+
     return db_image
 
+def create_images(db: Session, images: list[schemas.ImageCreate]):
+    """
+    Create many images in one INSERT, skipping names that already exist.
+    Returns the names that were created.
+    """
+
+    if not images:
+        return []
+
+    created = db.execute(
+        insert(Image)
+        .values([image.model_dump() for image in images])
+        .on_conflict_do_nothing(index_elements=[Image.name])
+        .returning(Image.name)
+    ).scalars().all()
+    _commit_images_change(db)
+
+    if vector_store.is_enabled():
+        created_names = set(created)
+        _sync_vector_store(
+            vector_store.get_store().append_many,
+            [
+                (image.name, image.embedding) for image in images
+                if image.name in created_names
+            ]
+        )
+
+    return created
+
+def get_images_missing_variants(
+        db: Session,
+        variants: list[str],
+        after: str = None,
+        limit: int = 100,
+        force: bool = False):
+    """
+    (name, aws_image_src) of images that lack any of the given variants, in
+    name order, starting after the name after. With force, of all images.
+    """
+
+    query = db.query(Image.name, Image.aws_image_src)
+    if not force:
+        query = query.filter(or_(
+            Image.variants.is_(None),
+            *[Image.variants[variant].is_(None) for variant in variants]
+        ))
+    if after is not None:
+        query = query.filter(Image.name > after)
+
+    return [tuple(row) for row in query.order_by(Image.name).limit(limit)]
+
+def set_variants(db: Session, image_name: str, variants: dict):
+    """Record the variants uploaded for an image."""
+
+    db.query(Image).filter(Image.name == image_name).update(
+        {Image.variants: variants}, synchronize_session=False
+    )
+    _commit_images_change(db)
+
+def get_images_missing_hashes(
+        db: Session, after: str = None, limit: int = 100):
+    """
+    (name, aws_image_src) of images without a content hash, in name order,
+    starting after the name after.
+    """
+
+    query = db.query(Image.name, Image.aws_image_src).filter(
+        Image.content_hash.is_(None)
+    )
+    if after is not None:
+        query = query.filter(Image.name > after)
+
+    return [tuple(row) for row in query.order_by(Image.name).limit(limit)]
+
+def set_hashes(
+        db: Session, image_name: str, content_hash: str, perceptual_hash: int):
+    """Record the hashes of an image's original."""
+
+    db.query(Image).filter(Image.name == image_name).update(
+        {
+            Image.content_hash: content_hash,
+            Image.perceptual_hash: perceptual_hash
+        },
+        synchronize_session=False
+    )
+    db.commit()
+
+def get_duplicate_names(db: Session, content_hashes: list[str]):
+    """
+    Map each content hash already stored to the name of one image with it.
+    """
+
+    return dict(
+        db.query(Image.content_hash, func.min(Image.name))
+        .filter(Image.content_hash.in_(content_hashes))
+        .group_by(Image.content_hash)
+    )
+
+def copy_images(db: Session, copies: list[tuple[str, str]]):
+    """
+    Create images from (name, source name) pairs, sharing everything but
+    the name with the source: S3 object, EXIF data, embedding and variants.
+    Copied in one INSERT ... SELECT, so the embeddings never leave the
+    database. Names that already exist are skipped. Returns the names that
+    were created.
+    """
+
+    if not copies:
+        return []
+
+    pairs = values(
+        column("name", String), column("source", String), name="copies"
+    ).data(copies)
+    shared = [
+        Image.aws_image_src,
+        Image.exif_data,
+        Image.embedding,
+        Image.variants,
+        Image.content_hash,
+        Image.perceptual_hash,
+    ]
+
+    created = db.execute(
+        insert(Image)
+        .from_select(
+            [Image.name, *shared],
+            select(pairs.c.name, *shared)
+            .join_from(pairs, Image, Image.name == pairs.c.source)
+        )
+        .on_conflict_do_nothing(index_elements=[Image.name])
+        .returning(Image.name, Image.embedding)
+    ).all()
+    _commit_images_change(db)
+
+    if vector_store.is_enabled():
+        _sync_vector_store(
+            vector_store.get_store().append_many,
+            [(name, embedding) for name, embedding in created]
+        )
+
+    return [name for name, _ in created]
+
+def get_used_urls(db: Session, content_hash: str, urls: list[str]):
+    """
+    The urls, of S3 objects, that any image uses as its original or one of
+    its variants. Only images with the same content hash can share objects.
+    """
+
+    if content_hash is None:
+        return set()
+
+    used = set()
+    for aws_image_src, variants in db.query(
+            Image.aws_image_src, Image.variants).filter(
+            Image.content_hash == content_hash):
+        used.add(aws_image_src)
+        used.update((variants or {}).values())
+
+    return used.intersection(urls)
+
+def get_near_duplicates(
+        db: Session, min_score: float = 0.95, neighbours: int = 5):
+    """
+    Yield (name, other name, score, same content, perceptual hashes) for
+    pairs of images whose embeddings have an inner product of at least
+    min_score, looking at each image's nearest neighbours through the ANN
+    index. Each pair is yielded once, best first.
+    """
+
+    vector_index.set_search_params(
+        db, min_results=_ann_depth(neighbours + 1, None)
+    )
+
+    other = aliased(Image, name="other")
+    distance = other.embedding.max_inner_product(Image.embedding)
+    nearest = (
+        select(
+            other.name,
+            other.content_hash,
+            other.perceptual_hash,
+            distance.label("distance")
+        )
+        .where(other.name != Image.name)
+        .order_by(distance)
+        .limit(neighbours)
+    )
+
+    if vector_index.BINARY_QUANTIZATION:
+        # Only rank the candidates found through the index, as searches do
+        candidate = aliased(Image, name="candidate")
+        nearest = nearest.where(other.name.in_(
+            select(candidate.name)
+            .order_by(
+                candidate.embedding_bits.hamming_distance(Image.embedding_bits)
+            )
+            .limit(_ann_depth(neighbours + 1, None))
+        ))
+
+    nearest = nearest.lateral("nearest")
+
+    # Neighbourhoods aren't symmetric, so a pair can be found from either
+    # side or both
+    first = func.least(Image.name, nearest.c.name)
+    second = func.greatest(Image.name, nearest.c.name)
+    score = (-nearest.c.distance).label("score")
+
+    query = (
+        db.query(
+            first,
+            second,
+            score,
+            Image.content_hash == nearest.c.content_hash,
+            # In a fixed order too, so both sides of a pair are the same row
+            func.least(Image.perceptual_hash, nearest.c.perceptual_hash),
+            func.greatest(Image.perceptual_hash, nearest.c.perceptual_hash)
+        )
+        .join(nearest, true())
+        .filter(nearest.c.distance <= -min_score)
+        .distinct()
+        .order_by(score.desc(), first, second)
+    )
+
+    for name, other_name, score, same_content, *hashes in query.yield_per(
+            STREAM_BATCH_SIZE):
+        yield name, other_name, score, bool(same_content), hashes
+
+def get_existing_names(db: Session, image_names: list[str]):
+    """Return which of the given image names are already taken."""
+
+    return set(
+        name for name, in
+        db.query(Image.name).filter(Image.name.in_(image_names))
+    )
+
 def delete_image(db: Session, image_name: str):
     """Delete an image."""
 
     db_image = db.query(Image).filter(Image.name == image_name).first()
     db.delete(db_image)
+    _commit_images_change(db)
+
+    if vector_store.is_enabled():
+        _sync_vector_store(vector_store.get_store().delete, image_name)
+
+    return db_image
+
+# Ingestion jobs
+
+UNFINISHED_JOB_STATUSES = ("queued", "running")
+
+def create_job(
+        db: Session,
+        job_id,
+        image_name: str,
+        content_hash: str,
+        idempotency_key: str = None):
+    """
+    Queue an ingestion job. Returns it, or None if another job already has
+    the idempotency key.
+    """
+
+    created = db.execute(
+        insert(IngestJob)
+        .values(
+            id=job_id,
+            image_name=image_name,
+            content_hash=content_hash,
+            idempotency_key=idempotency_key
+        )
+        .on_conflict_do_nothing(index_elements=[IngestJob.idempotency_key])
+        .returning(IngestJob.id)
+    ).scalar()
+    db.commit()
+
+    return get_job(db, created) if created else None
+
+def get_job(db: Session, job_id):
+    """Get an ingestion job by id."""
+
+    return db.query(IngestJob).filter(IngestJob.id == job_id).first()
+
+def get_job_by_idempotency_key(db: Session, idempotency_key: str):
+    """Get the ingestion job created with an idempotency key."""
+
+    return db.query(IngestJob).filter(
+        IngestJob.idempotency_key == idempotency_key
+    ).first()
+
+def is_name_queued(db: Session, image_name: str):
+    """Whether an unfinished ingestion job will create image_name."""
+
+    return db.query(
+        db.query(IngestJob)
+        .filter(
+            IngestJob.image_name == image_name,
+            IngestJob.status.in_(UNFINISHED_JOB_STATUSES)
+        )
+        .exists()
+    ).scalar()
+
+def claim_jobs(db: Session, limit: int, lease_seconds: float):
+    """
+    Claim up to limit jobs that are due, oldest first: queued jobs, and
+    running ones whose worker's lease ran out. Rows other workers are
+    claiming are skipped rather than waited on, so any number of workers
+    can poll at once. Claimed jobs are leased for lease_seconds, and their
+    attempts counted.
+    """
+
+    due = (
+        select(IngestJob.id)
+        .where(
+            IngestJob.status.in_(UNFINISHED_JOB_STATUSES),
+            IngestJob.available_at <= func.now()
+        )
+        .order_by(IngestJob.available_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+
+    claimed = db.scalars(
+        update(IngestJob)
+        .where(IngestJob.id.in_(due.scalar_subquery()))
+        .values(
+            status="running",
+            attempts=IngestJob.attempts + 1,
+            available_at=func.now() + _seconds(lease_seconds),
+            updated_at=func.now()
+        )
+        .returning(IngestJob)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+
+    return sorted(claimed, key=lambda job: job.created_at)
+
+def finish_job(db: Session, job_id, status: str, error: str = None):
+    """Mark a job succeeded or failed for good."""
+
+    _update_job(db, job_id, status=status, error=error)
+
+def retry_job(db: Session, job_id, error: str, delay_seconds: float):
+    """Put a job back in the queue to run again after delay_seconds."""
+
+    _update_job(
+        db,
+        job_id,
+        status="queued",
+        error=error,
+        available_at=func.now() + _seconds(delay_seconds)
+    )
+
+def get_job_counts(db: Session):
+    """
+    Returns ({ status: number of jobs }, seconds the oldest due queued job
+    has waited).
+    """
+
+    counts = dict(
+        db.query(IngestJob.status, func.count())
+        .group_by(IngestJob.status)
+        .all()
+    )
+
+    oldest = db.query(
+        func.extract("epoch", func.now() - func.min(IngestJob.available_at))
+    ).filter(
+        IngestJob.status == "queued",
+        IngestJob.available_at <= func.now()
+    ).scalar()
+
+    return counts, float(oldest or 0)
+
+def _update_job(db: Session, job_id, **values):
+    db.query(IngestJob).filter(IngestJob.id == job_id).update(
+        {**values, "updated_at": func.now()},
+        synchronize_session=False
+    )
     db.commit()
-    return db_image
\ No newline at end of file
+
+def _seconds(seconds: float):
+    return func.make_interval(0, 0, 0, 0, 0, 0, seconds)
+
+def _sync_vector_store(operation, *args):
+    """
+    Apply a committed change to the vector store. Postgres is the system of
+    record, so a failure here is logged and fixed by a rebuild.
+    """
+
+    try:
+        operation(*args)
+    except OSError as e:
+        logging.error(e)
@@ -1,15 +1,124 @@
 import os
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.interfaces import CacheStats
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+import app.metrics as metrics
+
 load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.environ.get("SQLALCHEMY_DATABASE_URI")
+# Optional read replica: listings and searches are served from it, writes
+# always go to SQLALCHEMY_DATABASE_URI
+SQLALCHEMY_READ_DATABASE_URL = os.environ.get("SQLALCHEMY_READ_DATABASE_URI")
+
+# Connections kept open per engine, and how many more may be opened on a
+# burst. Overflow connections are closed when returned, so a pool too small
+# for the usual load churns connections.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+# Seconds to wait for a connection before failing the request
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+# Replace connections older than this many seconds, before the server or a
+# proxy drops them. -1 never does.
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+# Test each connection with a round trip when it's checked out
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "false").lower() == "true"
+# Compiled SQL statements kept per engine, so repeated queries skip compiling
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 500))
+
+POOL_SIZE = metrics.gauge(
+    "db_pool_size",
+    "Connections each pool keeps open",
+    ["engine"]
+)
+POOL_CHECKED_OUT = metrics.gauge(
+    "db_pool_checked_out",
+    "Connections currently in use",
+    ["engine"]
+)
+POOL_OVERFLOW = metrics.gauge(
+    "db_pool_overflow",
+    "Connections open beyond the pool size",
+    ["engine"]
+)
+CONNECTIONS_OPENED = metrics.counter(
+    "db_connections_opened_total",
+    "New database connections, including overflow and recycled ones",
+    ["engine"]
+)
+CHECKOUTS = metrics.counter(
+    "db_pool_checkouts_total",
+    "Connections taken from each pool",
+    ["engine"]
+)
+STATEMENT_CACHE = metrics.counter(
+    "db_statement_cache_total",
+    "Statements executed, by whether their compiled form was cached",
+    ["engine", "result"]
+)
+CACHE_RESULTS = {CacheStats.CACHE_HIT: "hit", CacheStats.CACHE_MISS: "miss"}
+
+
+def make_engine(url, name):
+    """An engine with the configured pool, reporting metrics as name."""
+
+    engine = create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        query_cache_size=DB_STATEMENT_CACHE_SIZE
+    )
+    instrument_engine(engine, name)
+
+    return engine
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+def instrument_engine(engine, name):
+    """Report the pool utilization and statement caching of engine."""
+
+    pool = engine.pool
+
+    POOL_SIZE.labels(engine=name).set_function(pool.size)
+    POOL_CHECKED_OUT.labels(engine=name).set_function(pool.checkedout)
+    # Negative until the pool itself is full
+    POOL_OVERFLOW.labels(engine=name).set_function(
+        lambda: max(pool.overflow(), 0)
+    )
+
+    opened = CONNECTIONS_OPENED.labels(engine=name)
+    checkouts = CHECKOUTS.labels(engine=name)
+    event.listen(pool, "connect", lambda *args: opened.inc())
+    event.listen(pool, "checkout", lambda *args: checkouts.inc())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def count_cache_result(conn, cursor, statement, parameters, context,
+                           executemany):
+        if context is not None:
+            result = CACHE_RESULTS.get(context.cache_hit, "uncached")
+            STATEMENT_CACHE.labels(engine=name, result=result).inc()
+
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL, "primary")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+if SQLALCHEMY_READ_DATABASE_URL:
+    read_engine = make_engine(SQLALCHEMY_READ_DATABASE_URL, "replica")
+    # Marked so writes made while reading, e.g. persisting query
+    # embeddings, go to the primary
+    ReadSessionLocal = sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        bind=read_engine,
+        info={"replica": True}
+    )
+else:
+    read_engine = engine
+    ReadSessionLocal = SessionLocal
+
+Base = declarative_base()
@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import app.crud as crud
+import app.image_utils as image_utils
+
+load_dotenv()
+
+# Inner product of two embeddings above which images are reported as near
+# duplicates
+NEAR_DUPLICATE_MIN_SCORE = float(
+    os.environ.get("NEAR_DUPLICATE_MIN_SCORE", 0.95)
+)
+# Nearest neighbours of each image to compare it with
+NEAR_DUPLICATE_NEIGHBOURS = int(
+    os.environ.get("NEAR_DUPLICATE_NEIGHBOURS", 5)
+)
+HASH_BACKFILL_WORKERS = int(
+    os.environ.get("HASH_BACKFILL_WORKERS", os.cpu_count() or 4)
+)
+HASH_BACKFILL_BATCH_SIZE = int(os.environ.get("HASH_BACKFILL_BATCH_SIZE", 32))
+
+
+def hamming_distance(hash_1, hash_2):
+    """Number of differing bits between two perceptual hashes."""
+
+    return bin((hash_1 ^ hash_2) & ((1 << 64) - 1)).count("1")
+
+def report(
+        db,
+        min_score=NEAR_DUPLICATE_MIN_SCORE,
+        neighbours=NEAR_DUPLICATE_NEIGHBOURS):
+    """
+    Yield a dict per pair of near-duplicate images, most similar first.
+    Pairs are found from the stored embeddings; same_content marks pairs
+    that are byte-for-byte the same file, and hash_distance is the number
+    of bits their perceptual hashes differ by, if both have one.
+    """
+
+    for name, other_name, score, same_content, hashes in (
+            crud.get_near_duplicates(
+                db, min_score=min_score, neighbours=neighbours)):
+        yield {
+            "name": name,
+            "other_name": other_name,
+            "score": score,
+            "same_content": same_content,
+            "hash_distance": (
+                hamming_distance(*hashes) if None not in hashes else None
+            ),
+        }
+
+def backfill(db, bucket, batch_size=HASH_BACKFILL_BATCH_SIZE):
+    """
+    Hash the originals of images stored before content hashes were, so
+    later uploads of the same files are deduplicated against them. Returns
+    (updated, failed) counts.
+    """
+
+    updated, failed, after = 0, 0, None
+
+    with ThreadPoolExecutor(HASH_BACKFILL_WORKERS) as pool:
+        while images := crud.get_images_missing_hashes(
+                db, after=after, limit=batch_size):
+            after = images[-1][0]
+
+            for (name, _), result in zip(
+                    images,
+                    pool.map(lambda image: _hash_one(bucket, image[1]),
+                             images)):
+                if isinstance(result, Exception):
+                    logging.error(f"Failed to hash {name}: {result}")
+                    failed += 1
+                else:
+                    crud.set_hashes(db, name, *result)
+                    updated += 1
+
+    return updated, failed
+
+def _hash_one(bucket, aws_image_src):
+    try:
+        original = bucket.get_file(bucket.key(aws_image_src))["Body"].read()
+        return (
+            image_utils.content_hash(original),
+            image_utils.perceptual_hash(original)
+        )
+    except Exception as e:
+        return e
+
+def main(argv):
+    """CLI: python -m app.dedupe [report [min_score]|backfill]"""
+
+    usage = "usage: python -m app.dedupe [report [min_score]|backfill]"
+
+    if not argv or argv[0] not in ("report", "backfill") or (
+            argv[0] == "backfill" and len(argv) > 1) or len(argv) > 2:
+        print(usage)
+        return 1
+
+    from app.database import SessionLocal
+
+    with SessionLocal() as db:
+        if argv[0] == "backfill":
+            from app.bucket import Bucket
+
+            updated, failed = backfill(db, Bucket())
+            print(f"Hashed {updated} images, {failed} failed")
+            return 1 if failed else 0
+
+        min_score = float(argv[1]) if len(argv) > 1 else (
+            NEAR_DUPLICATE_MIN_SCORE
+        )
+        for pair in report(db, min_score=min_score):
+            print(json.dumps(pair))
+
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
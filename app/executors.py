@@ -0,0 +1,106 @@
+import os
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import anyio.to_thread
+from dotenv import load_dotenv
+
+import app.metrics as metrics
+
+load_dotenv()
+
+# Starlette's default threadpool, used for sync dependencies and routes
+THREADPOOL_SIZE = int(os.environ.get("THREADPOOL_SIZE", 40))
+# Sized to the database connection pool (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", 15))
+S3_EXECUTOR_WORKERS = int(os.environ.get("S3_EXECUTOR_WORKERS", 16))
+CLIP_EXECUTOR_WORKERS = int(
+    os.environ.get("CLIP_EXECUTOR_WORKERS", os.cpu_count() or 4)
+)
+
+WORKERS = metrics.gauge(
+    "executor_workers",
+    "Maximum number of threads in each executor",
+    ["executor"]
+)
+ACTIVE = metrics.gauge(
+    "executor_active",
+    "Calls currently running in each executor",
+    ["executor"]
+)
+QUEUED = metrics.gauge(
+    "executor_queued",
+    "Calls waiting for a free thread in each executor",
+    ["executor"]
+)
+
+
+class Executor:
+    """
+    A bounded thread pool that async route handlers can await, so blocking
+    database, S3 and image work never runs on the event loop. Each kind of
+    work gets its own pool so one slow dependency can't starve the others.
+    """
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(
+            max_workers, thread_name_prefix=f"{name}-executor"
+        )
+
+        self._active = ACTIVE.labels(executor=name)
+        self._queued = QUEUED.labels(executor=name)
+        WORKERS.labels(executor=name).set(max_workers)
+
+    async def run(self, function, *args, **kwargs):
+        """Run function(*args, **kwargs) in the pool and await its result."""
+
+        self._queued.inc()
+        # Carries the request's context, e.g. its Server-Timing spans
+        context = contextvars.copy_context()
+        try:
+            future = self._pool.submit(
+                partial(context.run, self._call, function, args, kwargs)
+            )
+        except BaseException:
+            self._queued.dec()
+            raise
+
+        # A call cancelled before a thread picked it up never runs _call
+        future.add_done_callback(
+            lambda future: future.cancelled() and self._queued.dec()
+        )
+        return await asyncio.wrap_future(future)
+
+    def _call(self, function, args, kwargs):
+        self._queued.dec()
+        self._active.inc()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self._active.dec()
+
+
+db = Executor("db", DB_EXECUTOR_WORKERS)
+s3 = Executor("s3", S3_EXECUTOR_WORKERS)
+clip = Executor("clip", CLIP_EXECUTOR_WORKERS)
+
+def configure_default_threadpool():
+    """
+    Resize Starlette's default threadpool. Must be called from the running
+    event loop, e.g. in the app's lifespan.
+    """
+
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = THREADPOOL_SIZE
+
+    WORKERS.labels(executor="default").set(THREADPOOL_SIZE)
+    ACTIVE.labels(executor="default").set_function(
+        lambda: limiter.borrowed_tokens
+    )
+    QUEUED.labels(executor="default").set_function(
+        lambda: limiter.statistics().tasks_waiting
+    )
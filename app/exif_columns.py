@@ -0,0 +1,101 @@
+import sys
+import logging
+
+from sqlalchemy import Index, text
+
+# Frequently filtered EXIF fields, promoted out of the exif_data JSON into
+# stored generated columns so they can be indexed and compared with proper
+# types. Every expression is immutable and never raises on odd EXIF data:
+# a value of the wrong type just leaves the column NULL.
+
+TABLE_NAME = "images"
+
+# Lower-cased and trimmed, so prefix filters match "NIKON CORPORATION "
+CAMERA_MAKE = "lower(btrim(exif_data->>'Make'))"
+CAMERA_MODEL = "lower(btrim(exif_data->>'Model'))"
+# EXIF's "YYYY:MM:DD HH:MM:SS" text sorts chronologically, so it's kept
+# as text and compared against timestamps in the same format
+TAKEN_AT = "coalesce(exif_data->>'DateTimeOriginal', exif_data->>'DateTime')"
+FOCAL_LENGTH = (
+    "CASE WHEN json_typeof(exif_data->'FocalLength') = 'number' "
+    "THEN (exif_data->>'FocalLength')::float8 END"
+)
+ORIENTATION = (
+    "CASE WHEN json_typeof(exif_data->'Orientation') = 'number' "
+    "AND (exif_data->>'Orientation')::numeric BETWEEN 1 AND 8 "
+    "THEN (exif_data->>'Orientation')::numeric::int END"
+)
+
+TAKEN_AT_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+# column: (type, expression)
+COLUMNS = {
+    "camera_make": ("text", CAMERA_MAKE),
+    "camera_model": ("text", CAMERA_MODEL),
+    "taken_at": ("text", TAKEN_AT),
+    "focal_length": ("float8", FOCAL_LENGTH),
+    "orientation": ("integer", ORIENTATION),
+}
+
+# index name: (column, operator class)
+INDEXES = {
+    "images_camera_make_idx": ("camera_make", "text_pattern_ops"),
+    "images_camera_model_idx": ("camera_model", "text_pattern_ops"),
+    "images_taken_at_idx": ("taken_at", None),
+    "images_focal_length_idx": ("focal_length", None),
+}
+
+
+def exif_indexes():
+    """Return the indexes on the promoted columns to declare on images."""
+
+    return [
+        Index(
+            name,
+            column,
+            postgresql_ops={column: ops} if ops else {}
+        )
+        for name, (column, ops) in INDEXES.items()
+    ]
+
+def add_columns(engine):
+    """
+    Add the promoted columns and their indexes to an existing images table.
+    Postgres fills in the generated columns for every existing row while it
+    rewrites the table, which locks it; the indexes are then built
+    concurrently.
+    """
+
+    with engine.begin() as conn:
+        for column, (column_type, expression) in COLUMNS.items():
+            conn.execute(text(
+                f"ALTER TABLE {TABLE_NAME} ADD COLUMN IF NOT EXISTS {column} "
+                f"{column_type} GENERATED ALWAYS AS ({expression}) STORED"
+            ))
+
+    with engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT") as conn:
+        for name, (column, ops) in INDEXES.items():
+            conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+                f"ON {TABLE_NAME} ({column} {ops or ''})"
+            ))
+
+    logging.info(f"Added {', '.join(COLUMNS)} to {TABLE_NAME}")
+
+def main(argv):
+    """CLI: python -m app.exif_columns add"""
+
+    from app.database import engine
+
+    if argv != ["add"]:
+        print("usage: python -m app.exif_columns add")
+        return 1
+
+    add_columns(engine)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,97 @@
+import os
+import hashlib
+
+from dotenv import load_dotenv
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.cache import LRUCache
+
+load_dotenv()
+
+# Cache-Control of cacheable GETs. Browsers revalidate with the ETag after
+# HTTP_CACHE_MAX_AGE seconds, shared caches such as CDNs after
+# HTTP_CACHE_S_MAXAGE, and may serve a stale copy while revalidating for
+# HTTP_CACHE_STALE_WHILE_REVALIDATE more.
+HTTP_CACHE_MAX_AGE = int(os.environ.get("HTTP_CACHE_MAX_AGE", 0))
+HTTP_CACHE_S_MAXAGE = int(os.environ.get("HTTP_CACHE_S_MAXAGE", 10))
+HTTP_CACHE_STALE_WHILE_REVALIDATE = int(
+    os.environ.get("HTTP_CACHE_STALE_WHILE_REVALIDATE", 30)
+)
+# Requests whose last ETag is remembered, so a matching If-None-Match gets a
+# 304 without the request being run
+ETAG_CACHE_SIZE = int(os.environ.get("ETAG_CACHE_SIZE", 10000))
+
+CACHE_CONTROL = (
+    f"public, max-age={HTTP_CACHE_MAX_AGE}, "
+    f"s-maxage={HTTP_CACHE_S_MAXAGE}, "
+    f"stale-while-revalidate={HTTP_CACHE_STALE_WHILE_REVALIDATE}"
+)
+
+# request key: (images version, ETag of the response)
+etag_cache = LRUCache("etags", max_size=ETAG_CACHE_SIZE)
+
+
+def request_key(request):
+    """The path and query parameters of a request, in a canonical order."""
+
+    return (request.url.path, tuple(sorted(request.query_params.multi_items())))
+
+def etag(body):
+    """Strong ETag of a response body."""
+
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def matches(if_none_match, tag):
+    """Whether an If-None-Match header value matches the ETag tag."""
+
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    # If-None-Match compares weakly, so W/ prefixes don't matter
+    return tag in (
+        candidate.strip().removeprefix("W/")
+        for candidate in if_none_match.split(",")
+    )
+
+def not_modified(tag):
+    return Response(
+        status_code=304,
+        headers={"ETag": tag, "Cache-Control": CACHE_CONTROL}
+    )
+
+def cached_response(key, version, if_none_match):
+    """
+    304 if the response last served for key at this images version had an
+    ETag matching if_none_match, else None. Runs nothing but the lookup.
+    """
+
+    if not if_none_match:
+        return None
+
+    entry = etag_cache.get(key)
+    if entry is not None and entry[0] == version and matches(
+            if_none_match, entry[1]):
+        return not_modified(entry[1])
+
+    return None
+
+def json_response(key, version, content, if_none_match, headers=None):
+    """
+    JSON response of content tagged with the ETag of its body, or 304 if
+    if_none_match matches it. Remembers the ETag for cached_response.
+    """
+
+    response = JSONResponse(jsonable_encoder(content), headers=headers)
+    tag = etag(response.body)
+    etag_cache.set(key, (version, tag))
+
+    if matches(if_none_match, tag):
+        return not_modified(tag)
+
+    response.headers["ETag"] = tag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
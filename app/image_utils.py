@@ -1,14 +1,73 @@
+import hashlib
+import math
+from io import BytesIO
+
 from PIL import Image, ExifTags, TiffImagePlugin, ImageOps
 
+# Shooting details from the Exif sub-IFD, which getexif() doesn't include
+# in its top level
+EXIF_IFD_TAGS = (
+    "DateTimeOriginal",
+    "FocalLength",
+    "FocalLengthIn35mmFilm",
+    "ExposureTime",
+    "FNumber",
+    "ISOSpeedRatings",
+)
+
+ORIGINALS_PREFIX = "originals"
+
+
+def open_image(image):
+    """
+    Takes in JPG bytes, a file-like object or an already decoded PIL image.
+    Returns a PIL image. Decoding is lazy, so callers can share the result.
+    """
+
+    if isinstance(image, Image.Image):
+        return image
+
+    if isinstance(image, (bytes, bytearray)):
+        image = BytesIO(image)
+
+    return Image.open(image)
+
+
+def load_reduced(image, min_short_side, min_long_side=0):
+    """
+    Takes in JPG bytes, a file-like object or a PIL image that hasn't been
+    decoded yet. Decodes its pixels at the smallest scale whose shorter and
+    longer sides are still at least min_short_side and min_long_side, and
+    returns it.
+
+    JPEGs are scaled by 1/2, 1/4 or 1/8 inside the decoder (draft mode), so
+    the full-resolution bitmap is never held in memory. Other formats are
+    decoded in full. Read EXIF data before calling this; draft mode doesn't
+    change it.
+    """
+
+    img = open_image(image)
+    width, height = img.size
+
+    scale = min(
+        min(width, height) / max(min_short_side, 1),
+        max(width, height) / max(min_long_side, 1)
+    )
+    if scale > 1:
+        img.draft(None, (math.ceil(width / scale), math.ceil(height / scale)))
+
+    img.load()
+    return img
+
 
 def scrape_exif(image):
     """
-    Takes in a JPG binary.
+    Takes in a JPG binary, a file-like object or a decoded PIL image.
     Returns a dict containing EXIF image metadata:
     { tag_name : tag_value }
     """
 
-    img = Image.open(image)
+    img = open_image(image)
     img_exif = img.getexif()
 
     metadata = {}
@@ -25,4 +84,48 @@ def scrape_exif(image):
             print(f'{key}:{val}')
             metadata[key] = val
 
-    return metadata
\ No newline at end of file
+    exif_ifd = img_exif.get_ifd(ExifTags.IFD.Exif)
+    for key, val in exif_ifd.items():
+        tag = ExifTags.TAGS.get(key)
+        if tag in EXIF_IFD_TAGS:
+            if isinstance(val, (TiffImagePlugin.IFDRational)):
+                metadata[tag] = float(val)
+            elif not isinstance(val, (bytes)):
+                metadata[tag] = val
+
+    return metadata
+
+def content_hash(image_bytes):
+    """SHA-256 hex digest of an image file's bytes."""
+
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def original_key(content_hash):
+    """
+    S3 key of an original image file. Keys are content addressed, so an
+    upload never overwrites an object another image uses with other bytes.
+    """
+
+    return f"{ORIGINALS_PREFIX}/{content_hash}"
+
+
+def perceptual_hash(image):
+    """
+    Takes a JPG binary, a file-like object or a decoded PIL image.
+    Returns its 64-bit difference hash (dHash) as a signed integer, to fit a
+    BIGINT. Resized or recompressed copies of an image hash the same or
+    differ in only a few bits.
+    """
+
+    small = ImageOps.exif_transpose(open_image(image)).convert("L").resize(
+        (9, 8), Image.Resampling.LANCZOS
+    )
+    pixels = list(small.getdata())
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+
+    return bits - (1 << 64) if bits >= (1 << 63) else bits
@@ -0,0 +1,448 @@
+import os
+import sys
+import posixpath
+import json
+import logging
+import tarfile
+import threading
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from time import perf_counter
+
+from dotenv import load_dotenv
+from PIL import Image
+
+import app.crud as crud
+import app.clip as clip
+import app.schemas as schemas
+import app.image_utils as image_utils
+import app.variants as variants
+from app.config import CLIP_IMAGE_SIZE
+
+load_dotenv()
+
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 32))
+INGEST_DECODE_WORKERS = int(
+    os.environ.get("INGEST_DECODE_WORKERS", os.cpu_count() or 4)
+)
+INGEST_S3_WORKERS = int(os.environ.get("INGEST_S3_WORKERS", 16))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tiff")
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+MAX_NAME_LENGTH = 50
+# Largest file, or archive member, read. The same limit as single uploads.
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+
+
+class StageTimer:
+    """Accumulates busy time and item counts for each pipeline stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = defaultdict(float)
+        self.items = defaultdict(int)
+
+    def time(self, stage, items):
+        return _StageTiming(self, stage, items)
+
+    def add(self, stage, items, seconds):
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.items[stage] += items
+
+    def report(self):
+        return {
+            stage: schemas.IngestStage(
+                items=self.items[stage],
+                seconds=self.seconds[stage],
+                images_per_second=_rate(self.items[stage], self.seconds[stage])
+            )
+            for stage in self.seconds
+        }
+
+
+class _StageTiming:
+
+    def __init__(self, timer, stage, items):
+        self.timer = timer
+        self.stage = stage
+        self.items = items
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timer.add(self.stage, self.items, perf_counter() - self.start)
+
+
+def _rate(items, seconds):
+    return items / seconds if seconds else 0.0
+
+
+# Sources. Each yields (image_name, image_bytes) pairs lazily so only one
+# batch of images is held in memory at a time. A file that can't be
+# ingested is yielded as (path, error) instead.
+
+def image_name_from_path(path):
+    """
+    Image name for a file: its relative path without the extension, with /
+    separators. Raises ValueError for paths outside their directory.
+    """
+
+    name = posixpath.normpath(
+        os.path.splitext(path)[0].replace(os.sep, "/")
+    ).removeprefix("./").lstrip("/")
+
+    if name in ("", ".") or ".." in name.split("/"):
+        raise ValueError(f"Can't name an image after {path}")
+
+    return name
+
+def read_image(fileobj):
+    """Read a file, raising ValueError if it's over MAX_IMAGE_BYTES."""
+
+    # Never reads more than one byte past the limit, however large the
+    # file, or what an archive member decompresses to, really is
+    data = fileobj.read(MAX_IMAGE_BYTES + 1)
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ValueError(f"File larger than {MAX_IMAGE_BYTES} bytes")
+
+    return data
+
+def _item(path, fileobj):
+    """(image name, bytes) of a file, or (path, error) if it's unusable."""
+
+    try:
+        return image_name_from_path(path), read_image(fileobj)
+    except ValueError as e:
+        return path, e
+
+def is_archive(filename):
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def is_image(filename):
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+def iter_directory(directory):
+    """Yield every image under directory, named by its relative path."""
+
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            if not is_image(filename):
+                continue
+
+            path = os.path.join(root, filename)
+            with open(path, "rb") as f:
+                yield _item(os.path.relpath(path, directory), f)
+
+def iter_archive(fileobj, filename):
+    """Yield every image in a zip or tar archive."""
+
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_image(info.filename):
+                    with archive.open(info) as member:
+                        yield _item(info.filename, member)
+        return
+
+    # Stream mode reads members in order without seeking
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile() and is_image(member.name):
+                yield _item(member.name, archive.extractfile(member))
+
+def iter_uploads(files):
+    """Yield images from uploaded files, expanding any archives."""
+
+    for file in files:
+        if is_archive(file.filename):
+            yield from iter_archive(file.file, file.filename)
+        else:
+            yield _item(file.filename, file.file)
+
+def iter_paths(paths):
+    """Yield images from local files, directories and archives."""
+
+    for path in paths:
+        if os.path.isdir(path):
+            yield from iter_directory(path)
+        elif is_archive(path):
+            with open(path, "rb") as f:
+                yield from iter_archive(f, path)
+        else:
+            with open(path, "rb") as f:
+                yield _item(os.path.basename(path), f)
+
+
+# Pipeline
+
+def _decode(item):
+    """
+    Decode one image, scrape its EXIF data, preprocess it for CLIP, make
+    its resized variants and its perceptual hash, all from the same decoded
+    pixels. JPEGs are decoded at the smallest scale CLIP and the variants
+    can use, and only the small preprocessed tensor and encoded variants
+    outlive this call.
+    """
+
+    _, image_bytes = item
+
+    image = image_utils.open_image(image_bytes)
+    content_type = Image.MIME.get(image.format, "image/jpeg")
+    exif_data = image_utils.scrape_exif(image)
+    image_utils.load_reduced(image, CLIP_IMAGE_SIZE, variants.max_size())
+
+    return (
+        clip.preprocess_image(image),
+        exif_data,
+        content_type,
+        variants.make_variants(image),
+        image_utils.perceptual_hash(image)
+    )
+
+def _upload(bucket, content_hash, image_bytes, content_type, made_variants):
+    """Upload an original and its variants. Returns (url, variant urls)."""
+
+    aws_image_src = bucket.upload_file(
+        image_bytes, image_utils.original_key(content_hash), content_type
+    )
+    if aws_image_src is None:
+        raise RuntimeError("S3 upload failed")
+
+    return aws_image_src, variants.upload_variants(
+        bucket, content_hash, made_variants
+    )
+
+def _embed(pixel_values):
+    """Embed a batch in one forward pass, falling back to one at a time."""
+
+    if not pixel_values:
+        return []
+
+    try:
+        return clip.get_preprocessed_image_embeddings(pixel_values)
+    except Exception as e:
+        logging.error(e)
+
+    embeddings = []
+    for pixels in pixel_values:
+        try:
+            embeddings.append(
+                clip.get_preprocessed_image_embeddings([pixels])[0]
+            )
+        except Exception as e:
+            embeddings.append(e)
+
+    return embeddings
+
+def _ingest_batch(db, bucket, batch, pools, timer, results):
+    """Run one batch of (name, bytes) pairs through every stage."""
+
+    decode_pool, s3_pool = pools
+
+    with timer.time("check_existing", len(batch)):
+        existing = crud.get_existing_names(db, [name for name, _ in batch])
+
+    pending = []
+    seen = set()
+    for name, image_bytes in batch:
+        if isinstance(image_bytes, Exception):
+            results.append(_failed(name, "read", image_bytes))
+        elif name in existing or name in seen:
+            results.append(schemas.IngestItem(name=name, status="skipped"))
+        elif len(name) > MAX_NAME_LENGTH:
+            # Checked up front, as copies never reach the decode stage
+            results.append(_failed(name, "name", ValueError(
+                f"Name longer than {MAX_NAME_LENGTH} characters"
+            )))
+        else:
+            seen.add(name)
+            pending.append((name, image_bytes))
+
+    with timer.time("dedupe", len(pending)):
+        hashes = list(decode_pool.map(
+            image_utils.content_hash, [image_bytes for _, image_bytes in pending]
+        ))
+        stored = crud.get_duplicate_names(db, hashes)
+
+    # Files already stored, or repeated within the batch, are copied from
+    # the first image with the same content instead of being processed
+    copies = []
+    first_with_hash = {}
+    unique = []
+    for (name, image_bytes), content_hash in zip(pending, hashes):
+        source = stored.get(content_hash) or first_with_hash.get(content_hash)
+        if source:
+            copies.append((name, source))
+        else:
+            first_with_hash[content_hash] = name
+            unique.append((name, image_bytes, content_hash))
+
+    with timer.time("decode_exif", len(unique)):
+        decoded = list(decode_pool.map(
+            _safe(_decode),
+            [(name, image_bytes) for name, image_bytes, _ in unique]
+        ))
+
+    ready = []
+    for (name, image_bytes, content_hash), result in zip(unique, decoded):
+        if isinstance(result, Exception):
+            results.append(_failed(name, "decode", result))
+        else:
+            ready.append((name, image_bytes, content_hash, *result))
+
+    # S3 puts run in the background while CLIP embeds the batch
+    s3_start = perf_counter()
+    uploads = [
+        s3_pool.submit(
+            _upload, bucket, content_hash, image_bytes, content_type,
+            made_variants
+        )
+        for _, image_bytes, content_hash, _, _, content_type, made_variants, _
+        in ready
+    ]
+
+    with timer.time("embed", len(ready)):
+        embeddings = _embed([item[3] for item in ready])
+
+    to_create = []
+    for item, upload, embedding in zip(ready, uploads, embeddings):
+        name, _, content_hash, _, exif_data, _, _, perceptual_hash = item
+
+        try:
+            aws_image_src, variant_urls = upload.result()
+        except Exception as e:
+            results.append(_failed(name, "upload", e))
+            continue
+
+        if isinstance(embedding, Exception):
+            results.append(_failed(name, "embed", embedding))
+            continue
+
+        to_create.append(schemas.ImageCreate(
+            name=name,
+            aws_image_src=aws_image_src,
+            exif_data=exif_data,
+            embedding=embedding,
+            variants=variant_urls,
+            content_hash=content_hash,
+            perceptual_hash=perceptual_hash
+        ))
+
+    timer.add("upload", len(ready), perf_counter() - s3_start)
+
+    with timer.time("insert", len(to_create) + len(copies)):
+        try:
+            created = set(crud.create_images(db, to_create))
+            # Copies of images that failed have nothing to copy from
+            copied = set(crud.copy_images(db, copies))
+        except Exception as e:
+            db.rollback()
+            for image in to_create:
+                results.append(_failed(image.name, "insert", e))
+            for name, _ in copies:
+                results.append(_failed(name, "insert", e))
+            return
+
+    for image in to_create:
+        results.append(schemas.IngestItem(
+            name=image.name,
+            status="created" if image.name in created else "skipped"
+        ))
+
+    for name, source in copies:
+        if name in copied:
+            results.append(schemas.IngestItem(
+                name=name, status="created", duplicate_of=source
+            ))
+        else:
+            results.append(_failed(
+                name, "insert", f"duplicate of {source}, which failed"
+            ))
+
+def ingest(db, bucket, items, batch_size=INGEST_BATCH_SIZE):
+    """
+    Ingest (image_name, image_bytes) pairs in batches. image_bytes may be
+    the exception reading the file raised, to report it as failed.
+
+    Names already in the database are skipped, so an interrupted run can
+    simply be repeated. Files with the same content as a stored image, or
+    an earlier one in the run, share its S3 object, EXIF data, embedding
+    and variants instead of being processed again. Each item's outcome is
+    reported separately, and a failure never stops the rest of the batch.
+    """
+
+    timer = StageTimer()
+    results = []
+    start = perf_counter()
+    items = iter(items)
+
+    with ThreadPoolExecutor(INGEST_DECODE_WORKERS) as decode_pool, \
+            ThreadPoolExecutor(INGEST_S3_WORKERS) as s3_pool:
+        while batch := list(islice(items, batch_size)):
+            _ingest_batch(
+                db, bucket, batch, (decode_pool, s3_pool), timer, results
+            )
+
+    seconds = perf_counter() - start
+    counts = defaultdict(int)
+    for result in results:
+        counts[result.status] += 1
+
+    return schemas.IngestReport(
+        created=counts["created"],
+        skipped=counts["skipped"],
+        failed=counts["failed"],
+        deduplicated=sum(1 for result in results if result.duplicate_of),
+        seconds=seconds,
+        images_per_second=_rate(counts["created"], seconds),
+        stages=timer.report(),
+        items=results
+    )
+
+def _safe(function):
+    """Wrap function so exceptions are returned instead of raised."""
+
+    def wrapper(*args):
+        try:
+            return function(*args)
+        except Exception as e:
+            return e
+
+    return wrapper
+
+def _failed(name, stage, error):
+    logging.error(f"Failed to ingest {name} at {stage}: {error}")
+    return schemas.IngestItem(
+        name=name, status="failed", error=f"{stage}: {error}"
+    )
+
+def main(argv):
+    """CLI: python -m app.ingest <directory|archive|image> [...]"""
+
+    if not argv:
+        print("usage: python -m app.ingest <directory|archive|image> [...]")
+        return 1
+
+    from app.database import SessionLocal
+    from app.bucket import Bucket
+
+    with SessionLocal() as db:
+        report = ingest(db, Bucket(), iter_paths(argv))
+
+    summary = report.model_dump(exclude={"items"})
+    summary["failures"] = [
+        item.model_dump() for item in report.items if item.status == "failed"
+    ]
+    print(json.dumps(summary, indent=2))
+
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,347 @@
+import io
+import os
+import inspect
+import importlib
+import cProfile
+import pstats
+import functools
+import threading
+from collections import defaultdict
+from contextvars import ContextVar
+from time import perf_counter
+
+from dotenv import load_dotenv
+from fastapi.responses import PlainTextResponse
+
+import app.metrics as metrics
+
+load_dotenv()
+
+# Add a Server-Timing header with the time spent in each instrumented
+# operation to every response
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "false").lower() == "true"
+# Profiler for requests with an X-Profile header and the admin token:
+# cprofile, or pyinstrument (sampling and async-aware, needs
+# `pip install pyinstrument`)
+PROFILER = os.environ.get("PROFILER", "cprofile").lower()
+PROFILE_HEADER = "X-Profile"
+# Functions listed in a cProfile report
+PROFILE_LIMIT = int(os.environ.get("PROFILE_LIMIT", 50))
+
+CALL_SECONDS = metrics.histogram(
+    "operation_seconds",
+    "Time taken by instrumented database, S3, CLIP and image calls",
+    ["component", "operation"]
+)
+CALL_ERRORS = metrics.counter(
+    "operation_errors_total",
+    "Instrumented calls that raised",
+    ["component", "operation"]
+)
+REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds",
+    "Time taken to respond to requests, by route",
+    ["method", "route", "status"]
+)
+
+# Operations to instrument, by component: module or module:class, and names
+# of its functions or methods. None means every public function defined in
+# the module. Functions returning a lazy query or iterator, such as
+# crud.get_images, are timed with timed_iter where their rows are fetched.
+TARGETS = {
+    "crud": ("app.crud", (
+        "get_image",
+        "get_image_embedding",
+        "get_query_embedding",
+        "get_query_embeddings",
+        "search_images_cached",
+        "search_images_batch",
+        "get_images_version",
+        "create_image",
+        "create_images",
+        "get_images_missing_variants",
+        "set_variants",
+        "get_images_missing_hashes",
+        "set_hashes",
+        "get_duplicate_names",
+        "copy_images",
+        "get_used_urls",
+        "get_existing_names",
+        "delete_image",
+        "create_job",
+        "get_job",
+        "get_job_by_idempotency_key",
+        "is_name_queued",
+        "claim_jobs",
+        "finish_job",
+        "retry_job",
+        "get_job_counts",
+    )),
+    "clip": ("app.clip", (
+        "load_model",
+        "warm_up",
+        "get_text_embedding",
+        "get_text_embeddings",
+        "get_image_embedding",
+        "get_image_embedding_from_data",
+        "get_image_embedding_async",
+        "get_image_embeddings",
+        "get_preprocessed_image_embeddings",
+        "preprocess_image",
+    )),
+    "image": ("app.image_utils", (
+        "scrape_exif",
+        "load_reduced",
+        "perceptual_hash",
+    )),
+    "variants": ("app.variants", ("make_variants",)),
+    "s3": ("app.bucket:Bucket", (
+        "upload_file",
+        "upload_fileobj",
+        "get_file",
+        "delete_file",
+    )),
+}
+
+# (name, seconds) of the operations run for the current request
+_spans = ContextVar("spans", default=None)
+_profiling = threading.Lock()
+
+
+class Span:
+    """
+    Context manager timing one operation into operation_seconds, and into
+    the current request's Server-Timing.
+    """
+
+    def __init__(self, component, operation):
+        self.name = f"{component}.{operation}"
+        self.histogram = CALL_SECONDS.labels(
+            component=component, operation=operation
+        )
+        self.errors = CALL_ERRORS.labels(
+            component=component, operation=operation
+        )
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.record(perf_counter() - self.start, exc_type is not None)
+
+    def record(self, elapsed, failed=False):
+        """Record the operation as having taken elapsed seconds."""
+
+        self.histogram.observe(elapsed)
+        if failed:
+            self.errors.inc()
+
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((self.name, elapsed))
+
+
+def timed(component, operation=None):
+    """Decorator running each call of a function in a span."""
+
+    def decorator(function):
+        name = operation or function.__name__
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with Span(component, name):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with Span(component, name):
+                    return function(*args, **kwargs)
+
+        wrapper.instrumented = True
+        return wrapper
+
+    return decorator
+
+def timed_iter(iterable, component, operation):
+    """
+    Iterate over iterable, e.g. a query, in one span timing only the work of
+    producing its items: running the query and fetching its rows, not what
+    the caller does with each.
+    """
+
+    span = Span(component, operation)
+    iterator, elapsed, failed = None, 0.0, False
+
+    try:
+        while True:
+            start = perf_counter()
+            try:
+                # Iterating over a query is what runs it
+                if iterator is None:
+                    iterator = iter(iterable)
+                item = next(iterator)
+            except StopIteration:
+                return
+            except Exception:
+                failed = True
+                raise
+            finally:
+                elapsed += perf_counter() - start
+
+            yield item
+    finally:
+        span.record(elapsed, failed)
+
+def instrument(target, component, names=None):
+    """
+    Wrap functions of a module, or methods of a class, in place with timed.
+    Without names, every public function defined in the module. Generator
+    functions are left alone, as their work happens after they return.
+    """
+
+    if names is None:
+        names = [
+            name for name, value in vars(target).items()
+            if inspect.isfunction(value)
+            and value.__module__ == target.__name__
+            and not name.startswith("_")
+        ]
+
+    for name in names:
+        function = getattr(target, name)
+        if getattr(function, "instrumented", False) or (
+                inspect.isgeneratorfunction(function)):
+            continue
+        setattr(target, name, timed(component)(function))
+
+def install():
+    """Instrument every module in TARGETS. Safe to call more than once."""
+
+    for component, (path, names) in TARGETS.items():
+        module_name, _, class_name = path.partition(":")
+        target = importlib.import_module(module_name)
+        if class_name:
+            target = getattr(target, class_name)
+        instrument(target, component, names)
+
+async def middleware(request, call_next):
+    """
+    Time each request into http_request_duration_seconds by route template,
+    add Server-Timing if enabled, and profile the request if asked to.
+    """
+
+    spans = []
+    token = _spans.set(spans)
+    profiler = _start_profiler(request)
+    start = perf_counter()
+
+    try:
+        response = await call_next(request)
+    except Exception:
+        if profiler:
+            _stop_profiler(profiler)
+        raise
+    finally:
+        _spans.reset(token)
+
+    elapsed = perf_counter() - start
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(
+        method=request.method,
+        route=route.path if route else "unmatched",
+        status=response.status_code
+    ).observe(elapsed)
+
+    if profiler:
+        return await _profile_response(profiler, response)
+
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(spans, elapsed)
+
+    return response
+
+def server_timing(spans, total):
+    """Server-Timing header value, summing repeated operations."""
+
+    seconds = defaultdict(float)
+    calls = defaultdict(int)
+    for name, elapsed in spans:
+        seconds[name] += elapsed
+        calls[name] += 1
+
+    entries = [
+        f"{name};dur={seconds[name] * 1000:.1f}"
+        + (f';desc="{calls[name]} calls"' if calls[name] > 1 else "")
+        for name in seconds
+    ]
+    entries.append(f"total;dur={total * 1000:.1f}")
+
+    return ", ".join(entries)
+
+def _start_profiler(request):
+    """
+    Start profiling a request with an X-Profile header and the admin token,
+    unless another request is already being profiled.
+    """
+
+    if PROFILE_HEADER not in request.headers:
+        return None
+
+    import app.auth as auth
+
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not auth.verify_admin(token):
+        return None
+
+    if not _profiling.acquire(blocking=False):
+        return None
+
+    try:
+        if PROFILER == "pyinstrument":
+            from pyinstrument import Profiler
+
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+        else:
+            # Only sees the event loop thread, not the executors' threads
+            profiler = cProfile.Profile()
+            profiler.enable()
+    except Exception:
+        _profiling.release()
+        raise
+
+    return profiler
+
+def _stop_profiler(profiler):
+    """Stop a profiler started by _start_profiler. Returns its report."""
+
+    try:
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats(
+                "cumulative"
+            ).print_stats(PROFILE_LIMIT)
+            return report.getvalue()
+
+        profiler.stop()
+        return profiler.output_text(unicode=True)
+    finally:
+        _profiling.release()
+
+async def _profile_response(profiler, response):
+    """Replace a profiled request's response with the profiler's report."""
+
+    try:
+        # Streamed bodies are part of the request's work
+        async for _ in response.body_iterator:
+            pass
+    finally:
+        report = _stop_profiler(profiler)
+
+    return PlainTextResponse(
+        report,
+        headers={"X-Profiled-Status": str(response.status_code)}
+    )
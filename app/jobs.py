@@ -0,0 +1,174 @@
+import os
+import sys
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+import app.crud as crud
+import app.ingest as ingest
+import app.metrics as metrics
+
+load_dotenv()
+
+# Jobs a worker claims and ingests together
+JOB_BATCH_SIZE = int(os.environ.get("JOB_BATCH_SIZE", 16))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 5))
+# Doubled after each failed attempt
+JOB_RETRY_DELAY = float(os.environ.get("JOB_RETRY_DELAY", 10))
+# How long a claimed job is a worker's before others may take it over, e.g.
+# after the worker crashed. Longer than a batch takes to ingest.
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 300))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+
+KEY_PREFIX = "staging"
+# Failures retrying can't fix
+PERMANENT_STAGES = ("name", "decode")
+
+JOBS = metrics.gauge(
+    "ingest_jobs",
+    "Number of ingestion jobs in each status",
+    ["status"]
+)
+OLDEST_QUEUED_SECONDS = metrics.gauge(
+    "ingest_jobs_oldest_queued_seconds",
+    "How long the oldest due queued ingestion job has waited"
+)
+
+
+def staging_key(job_id):
+    """S3 key of the upload a job ingests."""
+
+    return f"{KEY_PREFIX}/{job_id}"
+
+def update_metrics(db):
+    """Refresh the queue depth gauges from the database."""
+
+    counts, oldest = crud.get_job_counts(db)
+    for status in ("queued", "running", "succeeded", "failed"):
+        JOBS.labels(status=status).set(counts.get(status, 0))
+    OLDEST_QUEUED_SECONDS.set(oldest)
+
+def run_once(db, bucket, batch_size=JOB_BATCH_SIZE):
+    """
+    Claim a batch of due jobs and ingest their staged uploads together
+    through app.ingest. Failed jobs are retried with a doubling delay, up
+    to JOB_MAX_ATTEMPTS. Returns the number of jobs claimed.
+    """
+
+    jobs = crud.claim_jobs(db, batch_size, JOB_LEASE_SECONDS)
+
+    runnable = []
+    for job in jobs:
+        if job.attempts > JOB_MAX_ATTEMPTS:
+            _fail(db, bucket, job, job.error or "ran out of attempts")
+        else:
+            runnable.append(job)
+
+    with ThreadPoolExecutor(ingest.INGEST_S3_WORKERS) as pool:
+        staged = list(pool.map(lambda job: _fetch(bucket, job), runnable))
+
+    fetched, items = [], []
+    for job, result in zip(runnable, staged):
+        if isinstance(result, Exception):
+            _handle_failure(db, bucket, job, f"fetch: {result}", result)
+        elif job.image_name in (item_name for item_name, _ in items):
+            # Only raced enqueues get here; let the first one settle it
+            _handle_failure(
+                db, bucket, job, "queue: another job has the same name"
+            )
+        else:
+            fetched.append(job)
+            items.append((job.image_name, result))
+
+    report = ingest.ingest(db, bucket, items)
+    outcomes = {item.name: item for item in report.items}
+
+    for job in fetched:
+        item = outcomes[job.image_name]
+
+        if item.status == "created":
+            _finish(db, bucket, job)
+        elif item.status == "skipped":
+            # An earlier attempt may have got as far as inserting the image
+            image = crud.get_image(db, job.image_name)
+            if image and image.content_hash == job.content_hash:
+                _finish(db, bucket, job)
+            else:
+                _fail(db, bucket, job, "File name already taken")
+        else:
+            _handle_failure(db, bucket, job, item.error)
+
+    return len(jobs)
+
+def _fetch(bucket, job):
+    try:
+        return bucket.get_file(staging_key(job.id))["Body"].read()
+    except Exception as e:
+        return e
+
+def _handle_failure(db, bucket, job, error, exception=None):
+    permanent = error.split(":", 1)[0] in PERMANENT_STAGES or (
+        isinstance(exception, ClientError)
+        and exception.response["Error"]["Code"] == "NoSuchKey"
+    )
+
+    if permanent or job.attempts >= JOB_MAX_ATTEMPTS:
+        _fail(db, bucket, job, error)
+    else:
+        logging.warning(
+            f"Job {job.id} ({job.image_name}) failed attempt "
+            f"{job.attempts}: {error}"
+        )
+        crud.retry_job(
+            db, job.id, error, JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        )
+
+def _finish(db, bucket, job):
+    crud.finish_job(db, job.id, "succeeded")
+    bucket.delete_file(staging_key(job.id))
+
+def _fail(db, bucket, job, error):
+    logging.error(f"Job {job.id} ({job.image_name}) failed: {error}")
+    crud.finish_job(db, job.id, "failed", error)
+    bucket.delete_file(staging_key(job.id))
+
+def work(session_factory, bucket, stop=None, batch_size=JOB_BATCH_SIZE):
+    """
+    Run jobs until stop is set, polling every JOB_POLL_INTERVAL seconds
+    while the queue is empty. Any number of workers can run at once.
+    """
+
+    stop = stop or threading.Event()
+
+    while not stop.is_set():
+        try:
+            with session_factory() as db:
+                claimed = run_once(db, bucket, batch_size)
+        except Exception as e:
+            # Claimed jobs are picked up again when their lease runs out
+            logging.exception(e)
+            claimed = 0
+
+        if not claimed:
+            stop.wait(JOB_POLL_INTERVAL)
+
+def main(argv):
+    """CLI: python -m app.jobs worker"""
+
+    if argv != ["worker"]:
+        print("usage: python -m app.jobs worker")
+        return 1
+
+    from app.database import SessionLocal
+    from app.bucket import Bucket
+
+    work(SessionLocal, Bucket())
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
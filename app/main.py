@@ -1,5 +1,12 @@
 import os
-from typing import Annotated
+import json
+import uuid
+import hashlib
+import asyncio
+import logging
+from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import Annotated, Literal
 
 from fastapi import (
     FastAPI, 
@@ -9,9 +16,17 @@ from fastapi import (
     Body,
     Header,
     UploadFile,  
+    BackgroundTasks,
+    Request,
+    Response,
     status
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse
+)
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
@@ -21,17 +36,52 @@ import app.models as models
 import app.schemas as schemas
 import app.image_utils as image_utils
 import app.clip as clip
+import app.ingest as ingest
+import app.jobs as jobs
 import app.auth as auth
-from app.database import SessionLocal, engine
-from app.bucket import Bucket
+import app.executors as executors
+import app.http_cache as http_cache
+import app.instrumentation as instrumentation
+import app.metrics as metrics
+import app.pagination as pagination
+import app.variants as variants
+import app.vector_index as vector_index
+from app.config import CLIP_IMAGE_SIZE
+from app.database import ReadSessionLocal, SessionLocal, engine
+from app.bucket import AsyncBucket, Bucket
 
 models.Base.metadata.create_all(bind=engine)
+instrumentation.install()
 
 load_dotenv()
 
 ALLOWED_ORIGINS = os.environ['ALLOWED_ORIGINS']
+# Larger limits are clamped; follow X-Next-Cursor for more
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 200))
+MAX_STREAM_PAGE_SIZE = int(os.environ.get("MAX_STREAM_PAGE_SIZE", 10000))
+MAX_EXIF_FIELDS = 50
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+MAX_BATCH_QUERIES = int(os.environ.get("MAX_BATCH_QUERIES", 20))
+
+
+async def warm_up():
+    """Load CLIP and run a dummy forward pass off the event loop."""
+
+    try:
+        await executors.clip.run(clip.warm_up)
+    except Exception as e:
+        logging.error(f"CLIP warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    executors.configure_default_threadpool()
+    # Warm up in the background so the server can answer /ready meanwhile
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    warm_up_task.cancel()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -39,12 +89,85 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cross-origin scripts only see the response headers listed here
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+app.middleware("http")(instrumentation.middleware)
 
 security = HTTPBearer()
 
 bucket = Bucket()
+async_bucket = AsyncBucket(bucket)
+
+
+def require_clip(kind):
+    """503 when this server's CLIP_ROLE doesn't embed kind."""
+
+    if not clip.can_embed(kind):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=(
+                f"This server doesn't load the CLIP {kind} model "
+                f"(CLIP_ROLE={clip.CLIP_ROLE})"
+            )
+        )
+
+def parse_exif_fields(
+        fields: Annotated[str | None, Query(
+            description="Comma-separated EXIF keys to return, e.g. Make,Model"
+        )] = None):
+    """Dependency: the EXIF keys to include in responses, or None for all."""
 
+    if fields is None:
+        return None
+
+    exif_fields = [
+        field.strip() for field in fields.split(",") if field.strip()
+    ]
+    if len(exif_fields) > MAX_EXIF_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_EXIF_FIELDS} fields can be selected"
+        )
+
+    return exif_fields
+
+def parse_image_filters(
+        make: Annotated[str | None, Query(max_length=100)] = None,
+        model: Annotated[str | None, Query(max_length=100)] = None,
+        taken_after: datetime | None = None,
+        taken_before: datetime | None = None,
+        min_focal_length: Annotated[float | None, Query(ge=0)] = None,
+        max_focal_length: Annotated[float | None, Query(ge=0)] = None,
+        orientation: Annotated[int | None, Query(ge=1, le=8)] = None,
+        uploaded_after: datetime | None = None,
+        uploaded_before: datetime | None = None):
+    """Dependency: metadata filters for listing images, or None for none."""
+
+    filters = schemas.ImageFilters(
+        make=make,
+        model=model,
+        taken_after=taken_after,
+        taken_before=taken_before,
+        min_focal_length=min_focal_length,
+        max_focal_length=max_focal_length,
+        orientation=orientation,
+        uploaded_after=uploaded_after,
+        uploaded_before=uploaded_before
+    )
+
+    return filters if filters.model_dump(exclude_none=True) else None
+
+def parse_cursor(cursor, search):
+    """Decode a cursor query parameter, 400 if it's invalid."""
+
+    if not cursor:
+        return None
+
+    try:
+        return pagination.decode_cursor(cursor, search=search)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 def get_db():
     db = SessionLocal()
@@ -53,58 +176,537 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    """
+    Dependency: a session for routes that only read images, on the read
+    replica when one is configured. Replicas may lag behind writes.
+    """
+
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 @app.get("/images/{image_name}", response_model=schemas.Image)
-def get_image(image_name: str, db: Session = Depends(get_db)):
-    
-    image = crud.get_image(image_name=image_name, db=db)
+async def get_image(
+    image_name: str,
+    request: Request,
+    exif_fields: list[str] | None = Depends(parse_exif_fields),
+    if_none_match: Annotated[str | None, Header()] = None,
+    db: Session = Depends(get_read_db)):
+    """
+    An image's metadata. The response carries an ETag, and requests sending
+    it back in If-None-Match get a 304 while the image is unchanged.
+    """
+
+    key = http_cache.request_key(request)
+    version = await executors.db.run(crud.get_images_version, db)
+    not_modified = http_cache.cached_response(key, version, if_none_match)
+    if not_modified:
+        return not_modified
+
+    image = await executors.db.run(
+        crud.get_image, db, image_name, exif_fields
+    )
     if not image:
         raise HTTPException(status_code=404, detail="File not found")
-    
-    return image
+
+    return http_cache.json_response(
+        key,
+        version,
+        schemas.Image.model_validate(image, from_attributes=True),
+        if_none_match
+    )
 
 @app.get("/images/", response_model=list[schemas.Image])
-def get_images(
+async def get_images(
+    request: Request,
+    response: Response,
     q: Annotated[str | None, Query(max_length=100)] = None,
-    limit: int = 50,
-    db: Session = Depends(get_db)):
+    limit: Annotated[int, Query(ge=1)] = 50,
+    cursor: str | None = None,
+    min_score: float | None = None,
+    response_format: Annotated[
+        Literal["json", "ndjson"], Query(alias="format")
+    ] = "json",
+    exif_fields: list[str] | None = Depends(parse_exif_fields),
+    filters: schemas.ImageFilters | None = Depends(parse_image_filters),
+    if_none_match: Annotated[str | None, Header()] = None,
+    db: Session = Depends(get_read_db)):
+    """
+    List images newest first, or ranked by similarity to q. When there are
+    more results, the X-Next-Cursor header holds the cursor for the next
+    page. format=ndjson streams one image per line instead, ending with a
+    {"next_cursor": ...} line when there are more results. fields selects
+    which EXIF keys to return.
+
+    Search results carry their score, the inner product of the image and
+    query embeddings, and min_score drops weaker matches.
+
+    make, model, taken_after/before, min/max_focal_length, orientation and
+    uploaded_after/before filter on image metadata, with or without q.
+    Keep the same filters when following a cursor.
+
+    JSON pages carry an ETag, and requests sending it back in If-None-Match
+    get a 304 until an image is uploaded, changed or deleted.
+    """
+
+    if q:
+        require_clip("text")
+    elif min_score is not None:
+        raise HTTPException(
+            status_code=400, detail="min_score needs a search query q"
+        )
+
+    cursor = parse_cursor(cursor, search=bool(q))
+
+    if response_format == "ndjson":
+        return StreamingResponse(
+            _stream_images(
+                db,
+                min(limit, MAX_STREAM_PAGE_SIZE),
+                q,
+                cursor,
+                exif_fields,
+                min_score,
+                filters
+            ),
+            media_type="application/x-ndjson"
+        )
+
+    key = http_cache.request_key(request)
+    version = await executors.db.run(crud.get_images_version, db)
+    not_modified = http_cache.cached_response(key, version, if_none_match)
+    if not_modified:
+        return not_modified
+
+    images = await _get_page(
+        response,
+        db,
+        limit,
+        cursor,
+        search=bool(q),
+        search_term=q,
+        exif_fields=exif_fields,
+        min_score=min_score,
+        filters=filters
+    )
+
+    return http_cache.json_response(
+        key,
+        version,
+        [
+            schemas.Image.model_validate(image, from_attributes=True)
+            for image in images
+        ],
+        if_none_match,
+        # Returning a response directly drops those set on response
+        headers=dict(response.headers)
+    )
+
+@app.post("/images/search/batch", response_model=list[schemas.SearchResults])
+async def search_images_batch(
+    batch: schemas.BatchSearch,
+    exif_fields: list[str] | None = Depends(parse_exif_fields),
+    db: Session = Depends(get_read_db)):
+    """
+    Run several searches in one request, each with its own limit, min_score
+    and filters. The queries are embedded in one forward pass and ranked in
+    one database query. Results come back in the order of the queries.
+    """
+
+    require_clip("text")
+
+    if len(batch.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_QUERIES} queries can be batched"
+        )
+    if not batch.queries:
+        return []
+
+    searches = [
+        search.model_copy(update={"limit": min(search.limit, MAX_PAGE_SIZE)})
+        for search in batch.queries
+    ]
+
+    results = await executors.db.run(
+        crud.search_images_batch, db, searches, exif_fields
+    )
+
+    return [
+        schemas.SearchResults(q=search.q, images=images)
+        for search, images in zip(searches, results)
+    ]
+
+@app.get("/images/{image_name}/similar", response_model=list[schemas.Image])
+async def get_similar_images(
+    image_name: str,
+    response: Response,
+    limit: Annotated[int, Query(ge=1)] = 50,
+    cursor: str | None = None,
+    min_score: float | None = None,
+    exif_fields: list[str] | None = Depends(parse_exif_fields),
+    filters: schemas.ImageFilters | None = Depends(parse_image_filters),
+    db: Session = Depends(get_read_db)):
+    """
+    Images most like image_name, ranked by its stored embedding, so no
+    model is run. Takes the same paging, score and filter parameters as
+    searching GET /images/, and leaves image_name itself out.
+    """
+
+    cursor = parse_cursor(cursor, search=True)
+
+    embedding = await executors.db.run(
+        crud.get_image_embedding, db, image_name
+    )
+    if embedding is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    return await _get_page(
+        response,
+        db,
+        limit,
+        cursor,
+        search=True,
+        query_embedding=embedding,
+        exclude=image_name,
+        exif_fields=exif_fields,
+        min_score=min_score,
+        filters=filters
+    )
+
+@app.post("/images/search-by-image", response_model=list[schemas.Image])
+async def search_by_image(
+    file: UploadFile,
+    response: Response,
+    limit: Annotated[int, Query(ge=1)] = 50,
+    cursor: str | None = None,
+    min_score: float | None = None,
+    exif_fields: list[str] | None = Depends(parse_exif_fields),
+    filters: schemas.ImageFilters | None = Depends(parse_image_filters),
+    db: Session = Depends(get_read_db)):
+    """
+    Images most like an uploaded one. The upload is only embedded, through
+    the same batched path as uploads, and never stored. Takes the same
+    paging, score and filter parameters as searching GET /images/; post the
+    same image again with X-Next-Cursor for the next page.
+    """
+
+    require_clip("image")
+    cursor = parse_cursor(cursor, search=True)
+
+    await read_upload(file)
+
+    try:
+        image = await executors.clip.run(
+            image_utils.load_reduced, file.file, CLIP_IMAGE_SIZE
+        )
+        embedding = await clip.get_image_embedding_async(image, executors.clip)
+    except OSError:
+        raise HTTPException(status_code=400, detail="Not a readable image")
+
+    return await _get_page(
+        response,
+        db,
+        limit,
+        cursor,
+        search=True,
+        query_embedding=embedding,
+        exif_fields=exif_fields,
+        min_score=min_score,
+        filters=filters
+    )
+
+async def _get_page(response, db, limit, cursor, search, **kwargs):
+    """
+    Get a page of images with crud.get_images, setting X-Next-Cursor when
+    there are more.
+    """
+
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    # Pages of searches by a term are cached. crud.get_images only builds
+    # the query, so time running it.
+    if kwargs.get("search_term"):
+        get_page = lambda: crud.search_images_cached(
+            db, limit=limit, cursor=cursor, **kwargs
+        )
+    else:
+        get_page = lambda: list(instrumentation.timed_iter(
+            crud.get_images(db, limit=limit, cursor=cursor, **kwargs),
+            "crud", "get_images"
+        ))
+
+    # Materialize the query on the db executor, not the event loop
+    images = await executors.db.run(get_page)
+
+    next_cursor = pagination.next_cursor(
+        images[-1] if images else None,
+        len(images),
+        limit,
+        search=search,
+        cursor=cursor
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    return images
+
+def _stream_images(db, limit, q, cursor, exif_fields, min_score, filters):
+    """
+    Serialize images as rows come off a server-side cursor, so the full
+    result is never held in memory. Closes the session when done, since
+    the response outlives the route.
+    """
+
+    last_image, count = None, 0
+
+    try:
+        images = crud.get_images(
+            db,
+            limit=limit,
+            search_term=q,
+            cursor=cursor,
+            stream=True,
+            exif_fields=exif_fields,
+            min_score=min_score,
+            filters=filters
+        )
+        for image in instrumentation.timed_iter(images, "crud", "get_images"):
+            last_image, count = image, count + 1
+            yield schemas.Image.model_validate(
+                image, from_attributes=True
+            ).model_dump_json() + "\n"
 
-    return crud.get_images(limit=limit, search_term=q, db=db)
+        next_cursor = pagination.next_cursor(
+            last_image, count, limit, search=bool(q), cursor=cursor
+        )
+        if next_cursor:
+            yield json.dumps({"next_cursor": next_cursor}) + "\n"
+    finally:
+        db.close()
 
-@app.post("/images/", response_model=schemas.Image, status_code=201)
-def upload_image(
+@app.post(
+    "/images/",
+    response_model=schemas.Image,
+    status_code=201,
+    responses={202: {"model": schemas.Job}}
+)
+async def upload_image(
     file: UploadFile, 
     image_name: Annotated[str, Body()],
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)], 
+    mode: Literal["sync", "async"] = "sync",
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
     db: Session = Depends(get_db)):
+    """
+    Upload an image. With mode=async the upload is only staged and queued
+    for an ingestion worker, and a 202 with the job to poll is returned.
+    """
 
     if not auth.verify_admin(credentials.credentials):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Unauthorized"
         )
+
+    if mode == "async":
+        return await enqueue_upload(db, file, image_name, idempotency_key)
     
-    if crud.get_image(image_name=image_name, db=db):
-        raise HTTPException(status_code=400, detail="File name already taken")
+    require_clip("image")
+
+    await check_name_free(db, image_name)
     
-    exif_data = image_utils.scrape_exif(file.file)
-    file.file.seek(0)
+    content_hash = await read_upload(file)
+
+    # The same file uploaded before under another name shares its S3
+    # object, embedding and variants, so there's nothing to process
+    duplicates = await executors.db.run(
+        crud.get_duplicate_names, db, [content_hash]
+    )
+    if content_hash in duplicates and await executors.db.run(
+            crud.copy_images, db, [(image_name, duplicates[content_hash])]):
+        return await executors.db.run(crud.get_image, db, image_name)
 
-    aws_image_src = bucket.upload_file(file.file, image_name)
-    image_embedding = clip.get_image_embedding(aws_image_src)
+    # Opening the upload only parses its header, which is all EXIF scraping
+    # needs. The pixels are then decoded once, at the smallest scale CLIP
+    # and the variants can use, and shared between them.
+    try:
+        pil_image = image_utils.open_image(file.file)
+
+        exif_data = await executors.clip.run(image_utils.scrape_exif, pil_image)
+        await executors.clip.run(
+            image_utils.load_reduced,
+            pil_image,
+            CLIP_IMAGE_SIZE,
+            variants.max_size()
+        )
+        perceptual_hash = await executors.clip.run(
+            image_utils.perceptual_hash, pil_image
+        )
+    except OSError:
+        raise HTTPException(status_code=400, detail="Not a readable image")
+
+    # With the pixels decoded, the file is free to stream to S3 while CLIP
+    # and the variants work from the decoded image
+    await file.seek(0)
+    aws_image_src, image_embedding, variant_urls = await asyncio.gather(
+        async_bucket.upload_fileobj(
+            file.file, image_utils.original_key(content_hash)
+        ),
+        clip.get_image_embedding_async(pil_image, executors.clip),
+        upload_variants(pil_image, content_hash)
+    )
 
     image = schemas.ImageCreate(
         name=image_name,
         aws_image_src=aws_image_src,
         exif_data=exif_data,
-        embedding=image_embedding
+        embedding=image_embedding,
+        variants=variant_urls,
+        content_hash=content_hash,
+        perceptual_hash=perceptual_hash
     )
 
-    image = crud.create_image(image=image, db=db)
+    image = await executors.db.run(crud.create_image, db, image)
 
     return image
 
+async def check_name_free(db, image_name):
+    """400 if an image, or an unfinished job, already has image_name."""
+
+    if await executors.db.run(crud.get_image, db, image_name) or (
+            await executors.db.run(crud.is_name_queued, db, image_name)):
+        raise HTTPException(status_code=400, detail="File name already taken")
+
+async def enqueue_upload(db, file, image_name, idempotency_key):
+    """
+    Stage an upload in S3 and queue a job for the workers to ingest it.
+    A request repeated with the same idempotency key gets the job the
+    first one created.
+    """
+
+    if idempotency_key:
+        job = await executors.db.run(
+            crud.get_job_by_idempotency_key, db, idempotency_key
+        )
+        if job:
+            return job_accepted(job, image_name)
+
+    await check_name_free(db, image_name)
+
+    content_hash = await read_upload(file)
+
+    # Only the header is read, to turn away anything that isn't an image
+    # before it's queued
+    try:
+        await executors.clip.run(image_utils.open_image, file.file)
+    except OSError:
+        raise HTTPException(status_code=400, detail="Not a readable image")
+    await file.seek(0)
+
+    job_id = uuid.uuid4()
+    if not await async_bucket.upload_fileobj(
+            file.file, jobs.staging_key(job_id)):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Couldn't store the upload"
+        )
+
+    job = await executors.db.run(
+        crud.create_job, db, job_id, image_name, content_hash, idempotency_key
+    )
+    if job is None:
+        # A concurrent request with the same idempotency key won
+        await async_bucket.delete_file(jobs.staging_key(job_id))
+        job = await executors.db.run(
+            crud.get_job_by_idempotency_key, db, idempotency_key
+        )
+
+    return job_accepted(job, image_name)
+
+def job_accepted(job, image_name):
+    """202 response for a queued upload, or 409 if the job is another's."""
+
+    if job.image_name != image_name:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Idempotency key already used for another image"
+        )
+
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=schemas.Job.model_validate(
+            job, from_attributes=True
+        ).model_dump(mode="json"),
+        headers={"Location": f"/jobs/{job.id}"}
+    )
+
+async def read_upload(file):
+    """
+    Read through an uploaded file in chunks, hashing it, and rewind it.
+    Returns its content hash. Raises a 413 if it's over MAX_UPLOAD_BYTES.
+    """
+
+    digest = hashlib.sha256()
+    size = 0
+
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File larger than {MAX_UPLOAD_BYTES} bytes"
+            )
+        digest.update(chunk)
+
+    await file.seek(0)
+
+    return digest.hexdigest()
+
+async def upload_variants(image, content_hash):
+    """
+    Make the resized variants of a decoded image off the event loop and
+    upload them concurrently. Returns { variant: url } of the ones that
+    were uploaded; missing ones can be filled in by the backfill.
+    """
+
+    made = await executors.clip.run(variants.make_variants, image)
+
+    urls = await asyncio.gather(*[
+        async_bucket.upload_file(
+            data, variants.variant_key(content_hash, variant, content_type),
+            content_type
+        )
+        for variant, (data, content_type) in made.items()
+    ])
+
+    return {variant: url for variant, url in zip(made, urls) if url}
+
+@app.post("/images/bulk", response_model=schemas.IngestReport)
+def bulk_upload_images(
+    files: list[UploadFile],
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    db: Session = Depends(get_db)):
+    """
+    Upload many images at once. Each file is either an image, named after
+    its file name without the extension, or a zip/tar archive of images.
+    """
+
+    if not auth.verify_admin(credentials.credentials):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized"
+        )
+
+    require_clip("image")
+
+    return ingest.ingest(db, bucket, ingest.iter_uploads(files))
+
 @app.delete("/images/{image_name}")
-def delete_image(
+async def delete_image(
     image_name: str, 
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)], 
     db: Session = Depends(get_db)):
@@ -115,10 +717,79 @@ def delete_image(
             detail="Unauthorized"
         )
     
-    if not crud.get_image(image_name=image_name, db=db):
+    image = await executors.db.run(crud.get_image, db, image_name)
+    if not image:
         raise HTTPException(status_code=404, detail="File not found")
     
-    crud.delete_image(image_name=image_name, db=db)
-    bucket.delete_file(image_name)
+    content_hash = image.content_hash
+    urls = [image.aws_image_src, *(image.variants or {}).values()]
+
+    await executors.db.run(crud.delete_image, db, image_name)
+
+    # Duplicates of the image share its original and often its variants,
+    # so each object is only deleted once no image uses it
+    used = await executors.db.run(crud.get_used_urls, db, content_hash, urls)
+    await asyncio.gather(*[
+        async_bucket.delete_file(bucket.key(url))
+        for url in urls if url not in used
+    ])
 
     return {"Message": "Successfully deleted file."}
+
+@app.post("/admin/vector-index/rebuild", status_code=202)
+def rebuild_vector_index(
+    background_tasks: BackgroundTasks,
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]):
+    """Rebuild the embedding ANN index concurrently in the background."""
+
+    if not auth.verify_admin(credentials.credentials):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized"
+        )
+
+    background_tasks.add_task(vector_index.rebuild_index, engine)
+
+    return {"Message": "Rebuilding vector index."}
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the CLIP model has been warmed up."""
+
+    if not clip.is_ready():
+        return JSONResponse(
+            {"status": "warming up"},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+    return {"status": "ready"}
+
+@app.get("/jobs/{job_id}", response_model=schemas.Job)
+def get_job(
+    job_id: uuid.UUID,
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    db: Session = Depends(get_db)):
+    """Status of an ingestion job queued by an async upload."""
+
+    if not auth.verify_admin(credentials.credentials):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized"
+        )
+
+    job = crud.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return job
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(db: Session = Depends(get_db)):
+    """Expose service metrics in the Prometheus text format."""
+
+    jobs.update_metrics(db)
+
+    return PlainTextResponse(
+        metrics.render(),
+        media_type="text/plain; version=0.0.4"
+    )
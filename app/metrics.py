@@ -0,0 +1,286 @@
+import bisect
+import threading
+from time import perf_counter
+
+
+DEFAULT_BUCKETS = (
+    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10
+)
+
+REGISTRY = {}
+
+
+class Metric:
+    """Base class for a metric with optional labels."""
+
+    type_name = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, **labels):
+        """Return the child metric for this combination of label values."""
+
+        key = tuple(str(labels[name]) for name in self.labelnames)
+
+        with self._lock:
+            if key not in self._children:
+                self._children[key] = self._new_child()
+            return self._children[key]
+
+    def samples(self):
+        """Yield (suffix, labels, value) tuples for every child."""
+
+        with self._lock:
+            children = list(self._children.items())
+
+        if not self.labelnames and not children:
+            children = [((), self.labels())]
+
+        for key, child in children:
+            labels = dict(zip(self.labelnames, key))
+            for suffix, extra, value in child.samples():
+                yield suffix, {**labels, **extra}, value
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default_child(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} requires labels {self.labelnames}")
+        return self.labels()
+
+
+class _CounterChild:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield "", {}, self.value
+
+
+class Counter(Metric):
+    """A monotonically increasing count."""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default_child().inc(amount)
+
+    @property
+    def value(self):
+        return self._default_child().value
+
+
+class _GaugeChild:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+        self._function = None
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """Compute the value by calling function at scrape time."""
+
+        self._function = function
+
+    @property
+    def value(self):
+        return self._function() if self._function else self._value
+
+    def samples(self):
+        yield "", {}, self.value
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default_child().set(value)
+
+    def inc(self, amount=1):
+        self._default_child().inc(amount)
+
+    def dec(self, amount=1):
+        self._default_child().dec(amount)
+
+    def set_function(self, function):
+        self._default_child().set_function(function)
+
+    @property
+    def value(self):
+        return self._default_child().value
+
+
+class _HistogramChild:
+
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with self._lock:
+            self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        with self._lock:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, self.bucket_counts):
+                cumulative += bucket_count
+                yield "_bucket", {"le": _format_value(bound)}, cumulative
+            yield "_bucket", {"le": "+Inf"}, self.count
+            yield "_sum", {}, self.sum
+            yield "_count", {}, self.count
+
+
+class Histogram(Metric):
+    """Counts observations into cumulative buckets."""
+
+    type_name = "histogram"
+
+    def __init__(
+            self,
+            name,
+            description,
+            labelnames=(),
+            buckets=DEFAULT_BUCKETS):
+
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default_child().observe(value)
+
+    @property
+    def count(self):
+        return self._default_child().count
+
+    @property
+    def sum(self):
+        return self._default_child().sum
+
+
+class Timer:
+    """Context manager observing elapsed seconds into a histogram."""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = perf_counter() - self.start
+        self.histogram.observe(self.elapsed)
+
+
+def _register(metric):
+    """Add a metric to the registry, reusing one already registered."""
+
+    existing = REGISTRY.get(metric.name)
+    if existing is not None:
+        if type(existing) is not type(metric):
+            raise ValueError(f"Metric {metric.name} already registered")
+        return existing
+
+    REGISTRY[metric.name] = metric
+    return metric
+
+
+def counter(name, description, labelnames=()):
+    """Create or fetch a registered counter."""
+
+    return _register(Counter(name, description, labelnames))
+
+
+def gauge(name, description, labelnames=()):
+    """Create or fetch a registered gauge."""
+
+    return _register(Gauge(name, description, labelnames))
+
+
+def histogram(name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Create or fetch a registered histogram."""
+
+    return _register(Histogram(name, description, labelnames, buckets))
+
+
+def render():
+    """Render every registered metric in the Prometheus text format."""
+
+    lines = []
+
+    for metric in list(REGISTRY.values()):
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+
+        for suffix, labels, value in metric.samples():
+            lines.append(
+                f"{metric.name}{suffix}{_format_labels(labels)} "
+                f"{_format_value(value)}"
+            )
+
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    pairs = ",".join(
+        f'{key}="{_escape(value)}"' for key, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\n", "\\n")
+        .replace('"', '\\"')
+    )
+
+
+def _format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -1,9 +1,49 @@
-from sqlalchemy import Column, String, JSON, DateTime, func
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Computed,
+    Index,
+    Integer,
+    String,
+    Text,
+    JSON,
+    DateTime,
+    Float,
+    Uuid,
+    func
+)
+import numpy as np
 from sqlalchemy.orm import mapped_column
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import BIT, HALFVEC, Vector
 
 from app.database import Base
-from app.clip import EMBEDDING_SIZE
+from app.config import EMBEDDING_SIZE, EMBEDDING_TYPE
+import app.exif_columns as exif_columns
+from app.vector_index import (
+    BINARY_QUANTIZATION,
+    BITS_EXPRESSION,
+    embedding_indexes
+)
+
+
+class HalfVec(HALFVEC):
+    """halfvec read back as a float32 array, like Vector columns are."""
+
+    cache_ok = True
+
+    def result_processor(self, dialect, coltype):
+        process = super().result_processor(dialect, coltype)
+
+        def to_array(value):
+            value = process(value)
+            if value is None:
+                return None
+            return value.to_numpy().astype(np.float32)
+
+        return to_array
+
+
+EMBEDDING_COLUMN_TYPES = {"vector": Vector, "halfvec": HalfVec}
 
 
 # class User(Base):
@@ -18,13 +58,22 @@ class Image(Base):
     """Data model for Image"""
 
     __tablename__ = "images"
+    __table_args__ = (
+        # Keyset pagination of the newest-first listing
+        Index("images_uploaded_at_name_idx", "uploaded_at", "name"),
+        # Finding an upload's duplicates
+        Index("images_content_hash_idx", "content_hash"),
+        *exif_columns.exif_indexes(),
+        *embedding_indexes()
+    )
 
     name = Column(
         String(50),
         primary_key=True)
 
+    # Keyed on the content hash, see image_utils.original_key
     aws_image_src = Column(
-        String(100),
+        String(255),
         nullable=False
     )
 
@@ -32,10 +81,145 @@ class Image(Base):
         JSON()
     )
 
-    embedding = mapped_column(Vector(EMBEDDING_SIZE))
+    embedding = mapped_column(
+        EMBEDDING_COLUMN_TYPES[EMBEDDING_TYPE](EMBEDDING_SIZE)
+    )
+
+    if BINARY_QUANTIZATION:
+        # Generated from embedding for the index, see app/vector_index.py.
+        # Only ever compared in SQL, so never loaded.
+        embedding_bits = mapped_column(
+            BIT(EMBEDDING_SIZE), Computed(BITS_EXPRESSION), deferred=True
+        )
 
     uploaded_at = Column(
         DateTime,
         nullable=False,
         default=func.now()
-    )
\ No newline at end of file
+    )
+
+    # { variant: url } of the resized copies, see app/variants.py
+    variants = Column(
+        JSON()
+    )
+
+    # SHA-256 of the original file. Images with the same hash share one S3
+    # object and embedding.
+    content_hash = Column(
+        String(64)
+    )
+
+    # 64-bit dHash, see image_utils.perceptual_hash
+    perceptual_hash = Column(
+        BigInteger
+    )
+
+    # Generated from exif_data for filtering, see app/exif_columns.py
+    camera_make = Column(Text, Computed(exif_columns.CAMERA_MAKE))
+    camera_model = Column(Text, Computed(exif_columns.CAMERA_MODEL))
+    taken_at = Column(Text, Computed(exif_columns.TAKEN_AT))
+    focal_length = Column(Float, Computed(exif_columns.FOCAL_LENGTH))
+    orientation = Column(Integer, Computed(exif_columns.ORIENTATION))
+
+
+class QueryEmbedding(Base):
+    """Persisted CLIP embedding for a normalized search query"""
+
+    __tablename__ = "query_embeddings"
+
+    query = Column(
+        String(100),
+        primary_key=True)
+
+    embedding = mapped_column(Vector(EMBEDDING_SIZE))
+
+    created_at = Column(
+        DateTime,
+        nullable=False,
+        default=func.now()
+    )
+
+
+class TableVersion(Base):
+    """Counter bumped by every write to a table, to key caches of its reads"""
+
+    __tablename__ = "table_versions"
+
+    table_name = Column(
+        String(50),
+        primary_key=True)
+
+    version = Column(
+        BigInteger,
+        nullable=False
+    )
+
+
+class IngestJob(Base):
+    """An upload waiting for, or processed by, an ingestion worker"""
+
+    __tablename__ = "ingest_jobs"
+    __table_args__ = (
+        # Workers claiming the next jobs to run
+        Index("ingest_jobs_status_available_at_idx", "status", "available_at"),
+        # Names taken by unfinished jobs
+        Index("ingest_jobs_image_name_idx", "image_name"),
+    )
+
+    id = Column(
+        Uuid,
+        primary_key=True)
+
+    image_name = Column(
+        String(50),
+        nullable=False
+    )
+
+    # Set by clients so a retried request doesn't enqueue the upload twice
+    idempotency_key = Column(
+        String(255),
+        unique=True
+    )
+
+    # SHA-256 of the staged file
+    content_hash = Column(
+        String(64),
+        nullable=False
+    )
+
+    # queued, running, succeeded or failed
+    status = Column(
+        String(20),
+        nullable=False,
+        default="queued"
+    )
+
+    attempts = Column(
+        Integer,
+        nullable=False,
+        default=0
+    )
+
+    error = Column(
+        Text
+    )
+
+    # When a queued job may next run, or when a running job's lease runs
+    # out and another worker may take it over
+    available_at = Column(
+        DateTime,
+        nullable=False,
+        default=func.now()
+    )
+
+    created_at = Column(
+        DateTime,
+        nullable=False,
+        default=func.now()
+    )
+
+    updated_at = Column(
+        DateTime,
+        nullable=False,
+        default=func.now()
+    )
@@ -0,0 +1,67 @@
+import json
+import base64
+import binascii
+from datetime import datetime
+
+# Cursors are opaque to clients: url-safe base64 of a small JSON object
+# holding the sort key of the last row on the previous page.
+#   recency listing: {"t": uploaded_at, "n": name}
+#   semantic search: {"s": score, "n": name, "d": rows returned so far}
+
+RECENT_KEYS = {"t", "n"}
+SEARCH_KEYS = {"s", "n", "d"}
+
+
+def encode_cursor(key):
+    payload = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_cursor(cursor, search=False):
+    """
+    Decode a cursor from a previous page. Raises ValueError if it's
+    malformed or came from the other kind of listing.
+    """
+
+    try:
+        key = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor") from None
+
+    if not isinstance(key, dict) or set(key) != (
+            SEARCH_KEYS if search else RECENT_KEYS):
+        raise ValueError("Invalid cursor")
+
+    try:
+        if search:
+            key["s"] = float(key["s"])
+            key["d"] = int(key["d"])
+        else:
+            key["t"] = datetime.fromisoformat(key["t"])
+        key["n"] = str(key["n"])
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor") from None
+
+    return key
+
+def next_cursor(last_image, count, limit, search=False, cursor=None):
+    """
+    Cursor for the page after one that returned count images ending with
+    last_image, or None if that page was the last.
+    """
+
+    if last_image is None or count < limit:
+        return None
+
+    if search:
+        return encode_cursor({
+            "s": last_image.score,
+            "n": last_image.name,
+            "d": (cursor["d"] if cursor else 0) + count
+        })
+
+    return encode_cursor({
+        "t": last_image.uploaded_at.isoformat(),
+        "n": last_image.name
+    })
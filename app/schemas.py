@@ -1,6 +1,7 @@
 from datetime import datetime
+from uuid import UUID
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class ImageBase(BaseModel):
@@ -11,12 +12,87 @@ class ImageCreate(ImageBase):
     aws_image_src : str
     exif_data: object
     embedding: list
+    variants: dict[str, str] = {}
+    content_hash: str | None = None
+    perceptual_hash: int | None = None
 
 
 class Image(ImageBase):
     aws_image_src : str
     exif_data: object
     uploaded_at : datetime
+    # Resized copies: { variant: url }
+    variants: dict[str, str] | None = None
+    # Inner product with the search query, only set on search results
+    score: float | None = None
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class ImageFilters(BaseModel):
+    """Metadata filters for listing and search. Unset fields don't filter."""
+
+    make: str | None = None # Case-insensitive prefix of the camera make
+    model: str | None = None # Case-insensitive prefix of the camera model
+    taken_after: datetime | None = None
+    taken_before: datetime | None = None
+    min_focal_length: float | None = None
+    max_focal_length: float | None = None
+    orientation: int | None = None
+    uploaded_after: datetime | None = None
+    uploaded_before: datetime | None = None
+
+
+class SearchQuery(BaseModel):
+    q: str = Field(max_length=100)
+    limit: int = Field(default=50, ge=1)
+    min_score: float | None = None
+    filters: ImageFilters | None = None
+
+
+class BatchSearch(BaseModel):
+    queries: list[SearchQuery]
+
+
+class SearchResults(BaseModel):
+    q: str
+    images: list[Image]
+
+
+class IngestItem(BaseModel):
+    name: str
+    status: str # "created", "skipped" or "failed"
+    error: str | None = None
+    # Name of the stored image with the same content it was copied from
+    duplicate_of: str | None = None
+
+
+class IngestStage(BaseModel):
+    items: int
+    seconds: float
+    images_per_second: float
+
+
+class IngestReport(BaseModel):
+    created: int
+    skipped: int
+    failed: int
+    # Created images copied from a duplicate rather than processed
+    deduplicated: int = 0
+    seconds: float
+    images_per_second: float
+    stages: dict[str, IngestStage]
+    items: list[IngestItem]
+
+
+class Job(BaseModel):
+    id: UUID
+    image_name: str
+    status: str # "queued", "running", "succeeded" or "failed"
+    attempts: int
+    error: str | None = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        orm_mode = True
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+from app.batcher import MicroBatcher, BATCH_SIZE
+
+
+def test_batcher_returns_results_in_order():
+    """Test that every caller gets back the result for its own item."""
+
+    batcher = MicroBatcher("test_order", lambda items: [i * 2 for i in items])
+
+    futures = [batcher.submit(i) for i in range(10)]
+
+    assert [f.result(timeout=5) for f in futures] == list(range(0, 20, 2))
+
+def test_batcher_groups_concurrent_calls():
+    """Test that concurrent callers are batched into fewer calls."""
+
+    batch_sizes = []
+
+    def batch_fn(items):
+        batch_sizes.append(len(items))
+        return items
+
+    batcher = MicroBatcher(
+        "test_group",
+        batch_fn,
+        max_batch_size=8,
+        max_wait_ms=200
+    )
+
+    results = [None] * 8
+
+    def call(i):
+        results[i] = batcher(i)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == list(range(8))
+    assert sum(batch_sizes) == 8
+    assert len(batch_sizes) < 8
+    assert max(batch_sizes) <= 8
+
+def test_batcher_respects_max_batch_size():
+    """Test that batches never exceed the max batch size."""
+
+    batch_sizes = []
+
+    def batch_fn(items):
+        batch_sizes.append(len(items))
+        return items
+
+    batcher = MicroBatcher(
+        "test_max",
+        batch_fn,
+        max_batch_size=3,
+        max_wait_ms=50
+    )
+
+    futures = [batcher.submit(i) for i in range(10)]
+    [f.result(timeout=5) for f in futures]
+
+    assert max(batch_sizes) <= 3
+    assert BATCH_SIZE.labels(batcher="test_max").count == len(batch_sizes)
+
+def test_batcher_propagates_errors():
+    """Test that an error in the batch function reaches every caller."""
+
+    def batch_fn(items):
+        raise ValueError("bad batch")
+
+    batcher = MicroBatcher("test_error", batch_fn)
+
+    with pytest.raises(ValueError):
+        batcher("foo")
+
+    # The worker keeps running after a failed batch
+    batcher.batch_fn = lambda items: items
+    assert batcher("bar") == "bar"
+
+def test_batcher_skips_cancelled_items():
+    """Test that items cancelled while queued aren't run or answered."""
+
+    started, release = threading.Event(), threading.Event()
+    batches = []
+
+    def batch_fn(items):
+        batches.append(items)
+        started.set()
+        release.wait(timeout=5)
+        return items
+
+    batcher = MicroBatcher("test_cancel", batch_fn, max_wait_ms=0)
+
+    first = batcher.submit("first")
+    started.wait(timeout=5)
+    cancelled, kept = batcher.submit("cancelled"), batcher.submit("kept")
+    assert cancelled.cancel()
+    release.set()
+
+    assert first.result(timeout=5) == "first"
+    assert kept.result(timeout=5) == "kept"
+    assert all("cancelled" not in batch for batch in batches)
+
+    # The worker is still running
+    assert batcher("after") == "after"
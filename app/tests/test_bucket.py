@@ -1,9 +1,12 @@
 import os
+import asyncio
+from io import BytesIO
 from unittest import mock
 
 import pytest
 
-from app.bucket import Bucket
+import app.bucket as bucket_module
+from app.bucket import AsyncBucket, Bucket
 
 REGION = os.environ['REGION']
 BUCKET_NAME = os.environ['BUCKET_NAME']
@@ -60,6 +63,23 @@ class TestBucket:
         # Clean up
         bucket.delete_file(image_name)
 
+    def test_upload_fileobj(self, monkeypatch):
+        """Test streaming a file to the bucket in parts."""
+
+        monkeypatch.setattr(bucket_module, "S3_PART_SIZE", 5 * 1024 * 1024)
+
+        bucket = Bucket()
+        data = os.urandom(11 * 1024 * 1024)
+
+        src = bucket.upload_fileobj(BytesIO(data), "large_test")
+
+        assert src == bucket.url("large_test")
+        response = bucket.get_file("large_test")
+        assert response["Body"].read() == data
+        assert response["ContentType"] == "image/jpeg"
+
+        bucket.delete_file("large_test")
+
     def test_upload_bad_credentials(self):
         """Test attempting to upload with bad credentials."""
 
@@ -100,6 +120,54 @@ class TestBucket:
         # Upload image
         assert bucket.delete_file("pentax_test") == None
 
+    def test_url_key(self):
+        """Test mapping between object keys and URLs."""
+
+        bucket = Bucket()
+
+        assert bucket.key(bucket.url("variants/thumb/foo")) == (
+            "variants/thumb/foo"
+        )
+        with pytest.raises(ValueError):
+            bucket.key("https://example.com/foo")
+
+    def test_url_endpoint(self):
+        """Test path-style URLs on an S3-compatible server."""
+
+        bucket = Bucket(endpoint_url="http://localhost:9000/")
+
+        assert bucket.url("foo") == (
+            f"http://localhost:9000/{bucket.bucket_name}/foo"
+        )
+        assert bucket.key(bucket.url("foo")) == "foo"
+
+    def test_async_bucket(self):
+        """Test uploading, getting and deleting through the async wrapper."""
+
+        async_bucket = AsyncBucket(Bucket())
+
+        with open("app/tests/images/Nikon_D70.jpg", "rb") as image:
+            image_bytes = image.read()
+
+        async def run():
+            src = await async_bucket.upload_file(image_bytes, "nikon_test")
+            response = await async_bucket.get_file("nikon_test")
+            await async_bucket.delete_file("nikon_test")
+            return src, response
+
+        src, response = asyncio.run(run())
+
+        assert src == (
+            'https://'
+            f'{BUCKET_NAME}.s3.{REGION}'
+            '.amazonaws.com/nikon_test'
+        )
+        assert response
+
+        with pytest.raises(Exception) as e_info:
+            Bucket().get_file("nikon_test")
+        assert e_info.typename == "NoSuchKey"
+
     def teardown_method(self):
         """Delete remaining images."""
 
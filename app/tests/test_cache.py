@@ -0,0 +1,59 @@
+from app.cache import LRUCache, normalize_query
+
+
+class FakeClock:
+    """Clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalize_query():
+    """Test that case and whitespace are folded."""
+
+    assert normalize_query("  A Lizard\ton a   LEAF ") == "a lizard on a leaf"
+
+def test_cache_hit_and_miss():
+    """Test getting values that are and aren't cached."""
+
+    cache = LRUCache("test_hit_miss", max_size=2)
+
+    assert cache.get("foo") is None
+    cache.set("foo", [1, 2])
+
+    assert cache.get("foo") == [1, 2]
+    assert cache.hits.value == 1
+    assert cache.misses.value == 1
+
+def test_cache_evicts_least_recently_used():
+    """Test that the least recently used entry is evicted when full."""
+
+    cache = LRUCache("test_evict", max_size=2)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions.value == 1
+
+def test_cache_ttl():
+    """Test that entries expire after the ttl."""
+
+    clock = FakeClock()
+    cache = LRUCache("test_ttl", max_size=2, ttl=10, clock=clock)
+
+    cache.set("a", 1)
+    clock.now = 9
+    assert cache.get("a") == 1
+
+    clock.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
@@ -1,8 +1,29 @@
+import os
+import sys
+import asyncio
+import subprocess
+import threading
+
+import pytest
+import torch
 from numpy.linalg import norm
-from numpy import isclose
+from transformers import CLIPModel, CLIPProcessor
+from numpy import isclose, allclose
 
+import app.clip as clip
+import app.executors as executors
+from app.batcher import MicroBatcher
 from app.bucket import Bucket
-from app.clip import EMBEDDING_SIZE, get_image_embedding, get_text_embedding
+from app.clip import (
+    EMBEDDING_SIZE,
+    get_image_embedding,
+    get_image_embedding_from_data,
+    get_image_embeddings,
+    get_text_embedding,
+    get_text_embeddings
+)
+from app.config import CLIP_MODEL_NAME
+from app.image_utils import open_image
 
 
 def test_get_text_embedding():
@@ -33,3 +54,199 @@ def test_get_image_embedding():
 
     bucket.delete_file("fuji_test")
 
+def test_get_image_embedding_from_data():
+    """Test getting an image embedding from bytes, a file and a PIL image."""
+
+    with open("app/tests/images/Fujifilm_FinePix_E500.jpg", "rb") as image:
+        image_bytes = image.read()
+
+    from_bytes = get_image_embedding_from_data(image_bytes)
+
+    with open("app/tests/images/Fujifilm_FinePix_E500.jpg", "rb") as image:
+        from_file = get_image_embedding_from_data(image)
+
+    from_pil = get_image_embedding_from_data(open_image(image_bytes))
+
+    assert isinstance(from_bytes, list)
+    assert (len(from_bytes) == EMBEDDING_SIZE)
+    assert (isclose(norm(from_bytes), 1))
+    assert allclose(from_bytes, from_file)
+    assert allclose(from_bytes, from_pil)
+
+def test_get_image_embedding_matches_url():
+    """Test that embedding in-memory data matches embedding via S3."""
+
+    bucket = Bucket()
+
+    with open("app/tests/images/Fujifilm_FinePix_E500.jpg", "rb") as image:
+        image_bytes = image.read()
+
+    src = bucket.upload_file(image_bytes, "fuji_test")
+
+    assert allclose(
+        get_image_embedding(src),
+        get_image_embedding_from_data(image_bytes),
+        atol=1e-6
+    )
+
+    bucket.delete_file("fuji_test")
+
+def test_get_text_embeddings_batch():
+    """Test that a batched forward pass matches single calls."""
+
+    texts = ["a lizard on a leaf", "a rose", "a long skinny object"]
+
+    embeddings = get_text_embeddings(texts)
+
+    assert len(embeddings) == len(texts)
+    for text, embedding in zip(texts, embeddings):
+        assert (isclose(norm(embedding), 1))
+        assert allclose(embedding, get_text_embedding(text), atol=1e-5)
+
+def test_get_image_embeddings_batch():
+    """Test that a batched forward pass matches single calls."""
+
+    images = []
+    for fname in ["Nikon_D70.jpg", "Pentax_K10D.jpg"]:
+        with open(f"app/tests/images/{fname}", "rb") as image:
+            images.append(image.read())
+
+    embeddings = get_image_embeddings(images)
+
+    assert len(embeddings) == len(images)
+    for image, embedding in zip(images, embeddings):
+        assert allclose(
+            embedding,
+            get_image_embedding_from_data(image),
+            atol=1e-5
+        )
+
+def test_import_does_not_load_model():
+    """Test that importing the app's modules doesn't load CLIP's weights."""
+
+    code = (
+        "import app.models, app.crud, app.clip as clip; "
+        "assert not clip._loaded; "
+        "assert not clip.is_ready()"
+    )
+
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+def test_warm_up(monkeypatch):
+    """Test that warm_up loads the shared model and marks CLIP ready."""
+
+    monkeypatch.setattr(clip, "_ready", threading.Event())
+    assert not clip.is_ready()
+
+    clip.warm_up()
+
+    assert clip.is_ready()
+    assert clip.get_text_model() is clip.get_text_model()
+    assert clip.get_vision_model().config.projection_dim == EMBEDDING_SIZE
+
+def test_get_image_embedding_async_cancelled(monkeypatch):
+    """
+    Test that callers going away while their image waits for, or is in, a
+    batch leave the image batcher working.
+    """
+
+    started, release = threading.Event(), threading.Event()
+
+    def batch_fn(items):
+        started.set()
+        release.wait(timeout=5)
+        return items
+
+    monkeypatch.setattr(
+        clip, "IMAGE_BATCHER",
+        MicroBatcher("test_cancel_image", batch_fn, max_wait_ms=0)
+    )
+    monkeypatch.setattr(clip, "preprocess_image", lambda image: image)
+
+    async def embed(image):
+        return await clip.get_image_embedding_async(image, executors.clip)
+
+    async def run():
+        running = asyncio.create_task(embed("running"))
+        await asyncio.to_thread(started.wait, 5)
+        queued = asyncio.create_task(embed("queued"))
+        kept = asyncio.create_task(embed("kept"))
+        await asyncio.sleep(0.05)
+
+        # e.g. clients disconnecting
+        running.cancel()
+        queued.cancel()
+        for task in (running, queued):
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        release.set()
+
+        # Batched with the cancelled image
+        return await asyncio.wait_for(kept, timeout=5)
+
+    assert asyncio.run(run()) == "kept"
+
+def test_towers_match_full_model():
+    """Test that the separately loaded towers embed exactly like CLIPModel."""
+
+    model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).eval()
+    processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+
+    texts = ["a lizard on a leaf", "a rose"]
+    with open("app/tests/images/Nikon_D70.jpg", "rb") as image:
+        image_bytes = image.read()
+
+    with torch.inference_mode():
+        text_features = model.get_text_features(
+            **processor(text=texts, return_tensors="pt", padding=True)
+        )
+        image_features = model.get_image_features(
+            **processor(images=open_image(image_bytes), return_tensors="pt")
+        )
+
+    assert torch.equal(
+        torch.tensor(get_text_embeddings(texts)),
+        clip._normalize(text_features)
+    )
+    assert torch.equal(
+        torch.tensor(get_image_embeddings([image_bytes])),
+        clip._normalize(image_features)
+    )
+
+def test_search_role_loads_text_model_only():
+    """Test that a search worker loads the text tower and not the vision one."""
+
+    code = (
+        "import app.clip as clip; "
+        "clip.get_text_embedding('a rose'); "
+        "assert clip._vision_model is None and clip._image_processor is None; "
+        "assert not clip.can_embed('image')\n"
+        "try:\n"
+        "    clip.get_image_embeddings([b''])\n"
+        "    raise AssertionError('embedded an image')\n"
+        "except RuntimeError:\n"
+        "    pass"
+    )
+
+    subprocess.run(
+        [sys.executable, "-c", code],
+        env={**os.environ, "CLIP_ROLE": "search"},
+        check=True
+    )
+
+def test_ingest_role_loads_vision_model_only():
+    """Test that an ingest worker loads the vision tower and not the text one."""
+
+    code = (
+        "import app.clip as clip; "
+        "from PIL import Image; "
+        "clip.get_image_embedding_from_data(Image.new('RGB', (64, 64))); "
+        "assert clip._text_model is None and clip._tokenizer is None; "
+        "assert not clip.can_embed('text')"
+    )
+
+    subprocess.run(
+        [sys.executable, "-c", code],
+        env={**os.environ, "CLIP_ROLE": "ingest"},
+        check=True
+    )
@@ -0,0 +1,101 @@
+import pytest
+import torch
+from PIL import Image
+from transformers import (
+    CLIPTextModelWithProjection,
+    CLIPVisionModelWithProjection
+)
+
+import app.clip as clip
+import app.clip_backends as clip_backends
+from app.config import CLIP_MODEL_NAME
+
+# Minimum cosine similarity to the eager fp32 embeddings
+MIN_COSINE = {
+    "eager": 0.99999,
+    "torchscript": 0.9999,
+    "compile": 0.9999,
+    "onnx": 0.9999,
+    "int8": 0.98,
+}
+
+TEXTS = [
+    "a dog",
+    "a photo of a red car parked on a street at night",
+    "sunset",
+]
+
+
+def _embed(encoders):
+    text_encoder, image_encoder = encoders
+
+    text_inputs = clip.get_tokenizer()(TEXTS, return_tensors="pt", padding=True)
+    pixel_values = clip.get_image_processor()(
+        images=[
+            Image.open("app/tests/images/Nikon_D70.jpg"),
+            Image.open("app/tests/images/Pentax_K10D.jpg"),
+            Image.new("RGB", (300, 200), "white"),
+        ],
+        return_tensors="pt"
+    )["pixel_values"]
+
+    with torch.inference_mode():
+        return (
+            clip._normalize(text_encoder(
+                text_inputs["input_ids"], text_inputs["attention_mask"]
+            )),
+            # A different batch size to the one the backend was built with
+            clip._normalize(image_encoder(pixel_values)),
+            clip._normalize(image_encoder(pixel_values[:1])),
+        )
+
+def _load(backend):
+    """Encoders for a fresh copy of the model, since int8 quantizes in place."""
+
+    return clip_backends.load(
+        backend,
+        CLIPTextModelWithProjection.from_pretrained(CLIP_MODEL_NAME).eval(),
+        CLIPVisionModelWithProjection.from_pretrained(CLIP_MODEL_NAME).eval(),
+        clip.get_tokenizer(),
+        clip.get_image_processor(),
+        CLIP_MODEL_NAME
+    )
+
+@pytest.fixture(scope="module")
+def reference():
+    return _embed(_load("eager"))
+
+@pytest.mark.parametrize("backend", list(clip_backends.BACKENDS))
+def test_backend_parity(backend, reference, tmp_path, monkeypatch):
+    """Test that each backend's embeddings agree with eager PyTorch's."""
+
+    if backend == "onnx":
+        pytest.importorskip("onnxruntime")
+        monkeypatch.setattr(clip_backends, "CLIP_ONNX_DIR", str(tmp_path))
+
+    for expected, actual in zip(reference, _embed(_load(backend))):
+        assert actual.shape == expected.shape
+        cosine = (actual * expected).sum(dim=-1)
+        assert cosine.min() >= MIN_COSINE[backend]
+
+def test_onnx_export_is_cached(tmp_path, monkeypatch):
+    """Test that the ONNX backend exports once and reuses the export."""
+
+    pytest.importorskip("onnxruntime")
+    monkeypatch.setattr(clip_backends, "CLIP_ONNX_DIR", str(tmp_path))
+
+    _load("onnx")
+    exported = sorted(p.name for p in tmp_path.iterdir())
+    mtimes = [p.stat().st_mtime for p in sorted(tmp_path.iterdir())]
+
+    _load("onnx")
+
+    assert len(exported) == 2
+    assert all(name.endswith(".onnx") for name in exported)
+    assert [p.stat().st_mtime for p in sorted(tmp_path.iterdir())] == mtimes
+
+def test_unknown_backend():
+    """Test that an unknown backend name is rejected."""
+
+    with pytest.raises(ValueError):
+        _load("tensorrt")
@@ -1,15 +1,20 @@
 import os
+from datetime import datetime
 
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, Session
 import numpy as np
+from sqlalchemy import inspect
 
 from app.database import Base
-from app.models import Image
+from app.models import Image, QueryEmbedding
 from app.clip import EMBEDDING_SIZE
 import app.schemas as schemas
 import app.crud as crud
+import app.pagination as pagination
+import app.vector_index as vector_index
+import app.vector_store as vector_store
 
 # Env var overridden in pytest.ini
 SQLALCHEMY_TEST_DATABASE_URI = os.environ['SQLALCHEMY_DATABASE_URI']
@@ -72,7 +77,7 @@ class TestCRUD:
             assert image.name in image_names
             assert isinstance(image.aws_image_src, str)
             assert isinstance(image.exif_data, dict)
-            assert isinstance(image.embedding, np.ndarray)
+            assert "embedding" in inspect(image).unloaded
 
     def test_get_images_no_search(self, session: Session):
         """Test getting multiple images without a search term."""
@@ -84,7 +89,42 @@ class TestCRUD:
             assert image.name in image_names
             assert isinstance(image.aws_image_src, str)
             assert isinstance(image.exif_data, dict)
-            assert isinstance(image.embedding, np.ndarray)
+            assert "embedding" in inspect(image).unloaded
+
+    def test_get_image_exif_fields(self, session: Session):
+        """Test loading only some EXIF keys of an image."""
+
+        session.query(Image).filter(Image.name == "test1").update(
+            {"exif_data": {"Make": "Nikon", "Model": "D70", "ISO": 200}}
+        )
+        session.commit()
+
+        image = crud.get_image(session, "test1", exif_fields=["Make", "Lens"])
+
+        assert image.exif_data == {"Make": "Nikon"}
+        assert "embedding" in inspect(image).unloaded
+
+        image = crud.get_image(session, "test1", exif_fields=[])
+
+        assert image.exif_data == {}
+        assert not session.dirty
+
+    def test_get_images_exif_fields(self, session: Session, monkeypatch):
+        """Test listing and searching with only some EXIF keys."""
+
+        monkeypatch.setattr(
+            crud, "get_query_embedding",
+            lambda db, search_term: self.image_2.embedding
+        )
+
+        for search_term in (None, "foo"):
+            images = list(crud.get_images(
+                session, search_term=search_term, exif_fields=["field1"]
+            ))
+
+            assert len(images) == 2
+            for image in images:
+                assert image.exif_data == {"field1": "value1"}
 
     def test_create_image(self, session: Session):
         """Test creating an image."""
@@ -121,5 +161,646 @@ class TestCRUD:
 
         assert image_none is None
 
-        
+    def test_images_version(self, session: Session):
+        """Test that writes to images bump their version."""
+
+        crud.images_version_cache.clear()
+        version = crud.get_images_version(session)
+
+        crud.set_variants(session, "test1", {"thumb": "https://thumb.jpg"})
+        assert crud.get_images_version(session) == version + 1
+
+        crud.delete_image(session, "test2")
+        assert crud.get_images_version(session) == version + 2
+
+        # Read back from the database too
+        crud.images_version_cache.clear()
+        assert crud.get_images_version(session) == version + 2
+
+    def test_images_version_replica(self, session: Session):
+        """Test that a write doesn't bump the version read on a replica."""
+
+        crud.images_version_cache.clear()
+        version = crud.get_images_version(session)
+
+        crud.set_variants(session, "test1", {"thumb": "https://thumb.jpg"})
+        # A replica that hasn't replayed the write yet
+        session.execute(text(
+            "UPDATE table_versions SET version = version - 1 "
+            "WHERE table_name = 'images'"
+        ))
+        session.commit()
+
+        assert crud.get_images_version(session) == version + 1
+        with TestingSessionLocal(info={"replica": True}) as replica:
+            assert crud.get_images_version(replica) == version
+
+    def test_search_images_cached(self, session: Session, monkeypatch):
+        """Test that search pages are cached until images change."""
+
+        monkeypatch.setattr(
+            crud, "get_query_embedding",
+            lambda db, search_term: self.image_1.embedding
+        )
+        crud.search_results_cache.clear()
+
+        first = crud.search_images_cached(session, "Foo", limit=1)
+
+        monkeypatch.setattr(
+            crud, "get_images",
+            lambda *args, **kwargs: pytest.fail("Should be cached")
+        )
+        assert crud.search_images_cached(session, " foo", limit=1) == first
+        assert first[0].name == "test1"
+        assert first[0].score is not None
+
+        crud.delete_image(session, "test1")
+        monkeypatch.undo()
+        monkeypatch.setattr(
+            crud, "get_query_embedding",
+            lambda db, search_term: self.image_1.embedding
+        )
+
+        images = crud.search_images_cached(session, "foo", limit=1)
+        assert [image.name for image in images] == ["test2"]
+
+    def test_get_query_embedding_cached(self, session: Session, monkeypatch):
+        """Test that repeated search terms only hit CLIP once."""
+
+        calls = []
+
+        def fake_get_text_embedding(text):
+            calls.append(text)
+            return np.random.random(EMBEDDING_SIZE).tolist()
+
+        monkeypatch.setattr(
+            crud.clip, "get_text_embedding", fake_get_text_embedding
+        )
+        crud.query_embedding_cache.clear()
+
+        first = crud.get_query_embedding(session, "A  Rose")
+        second = crud.get_query_embedding(session, "a rose ")
+
+        assert first == second
+        assert calls == ["a rose"]
+
+    def test_get_query_embedding_persisted_from_replica(
+            self, session: Session, monkeypatch):
+        """Test persisting query embeddings looked up on a replica."""
+
+        monkeypatch.setattr(crud, "QUERY_CACHE_PERSIST", True)
+        monkeypatch.setattr(
+            crud.clip,
+            "get_text_embedding",
+            lambda text: np.random.random(EMBEDDING_SIZE).tolist()
+        )
+        crud.query_embedding_cache.clear()
+
+        with TestingSessionLocal(info={"replica": True}) as replica:
+            replica.execute(text("SET TRANSACTION READ ONLY"))
+            crud.get_query_embedding(replica, "a heron")
+
+        assert session.get(QueryEmbedding, "a heron") is not None
+
+    def test_get_query_embedding_persisted(
+            self, session: Session, monkeypatch):
+        """Test that query embeddings survive a cleared in-process cache."""
+
+        monkeypatch.setattr(crud, "QUERY_CACHE_PERSIST", True)
+        crud.query_embedding_cache.clear()
+
+        embedding = crud.get_query_embedding(session, "a lizard")
+
+        assert session.get(QueryEmbedding, "a lizard") is not None
+
+        crud.query_embedding_cache.clear()
+        monkeypatch.setattr(
+            crud.clip,
+            "get_text_embedding",
+            lambda text: pytest.fail("CLIP should not be called")
+        )
+
+        assert np.allclose(
+            crud.get_query_embedding(session, "A Lizard"),
+            embedding
+        )
+
+    def test_get_images_pages(self, session: Session):
+        """Test walking the newest-first listing with cursors."""
+
+        names = []
+        cursor = None
+        while True:
+            images = list(crud.get_images(session, limit=1, cursor=cursor))
+            names += [image.name for image in images]
+            cursor = pagination.next_cursor(
+                images[-1] if images else None, len(images), 1, cursor=cursor
+            )
+            if cursor is None:
+                break
+            cursor = pagination.decode_cursor(cursor)
+
+        assert sorted(names) == ["test1", "test2"]
+        assert names == [
+            image.name for image in crud.get_images(session, limit=2)
+        ]
+
+    def test_get_images_search_pages(self, session: Session, monkeypatch):
+        """Test walking semantic search results with cursors."""
+
+        monkeypatch.setattr(
+            crud, "get_query_embedding",
+            lambda db, search_term: self.image_2.embedding
+        )
+
+        images = list(crud.get_images(session, limit=1, search_term="foo"))
+
+        assert [image.name for image in images] == ["test2"]
+        assert images[0].score == pytest.approx(
+            np.dot(self.image_2.embedding, self.image_2.embedding)
+        )
+
+        cursor = pagination.decode_cursor(
+            pagination.next_cursor(images[0], 1, 1, search=True), search=True
+        )
+        images = list(crud.get_images(
+            session, limit=1, search_term="foo", cursor=cursor
+        ))
+
+        assert [image.name for image in images] == ["test1"]
+        assert images[0].score < cursor["s"]
+
+    def test_get_images_search_pages_ties(
+            self, session: Session, monkeypatch):
+        """Test paging through images with identical embeddings."""
+
+        crud.copy_images(session, [(f"copy{i}", "test1") for i in range(6)])
+        monkeypatch.setattr(
+            crud, "get_query_embedding",
+            lambda db, search_term: self.image_1.embedding
+        )
+
+        names, cursor = [], None
+        while True:
+            page = list(crud.get_images(
+                session, limit=2, search_term="foo", cursor=cursor
+            ))
+            names += [image.name for image in page]
+
+            next_cursor = pagination.next_cursor(
+                page[-1] if page else None, len(page), 2,
+                search=True, cursor=cursor
+            )
+            if not next_cursor:
+                break
+            cursor = pagination.decode_cursor(next_cursor, search=True)
+
+        # Tied copies by name, each exactly once
+        assert names[:7] == sorted(
+            ["test1", *[f"copy{i}" for i in range(6)]]
+        )
+        assert names[7:] == ["test2"]
+
+    def test_get_images_min_score(self, session: Session, monkeypatch):
+        """Test that min_score drops weak matches, streamed or not."""
+
+        monkeypatch.setattr(
+            crud, "get_query_embedding",
+            lambda db, search_term: self.image_2.embedding
+        )
+        scores = {
+            image.name: image.score
+            for image in crud.get_images(session, search_term="foo")
+        }
+        threshold = (scores["test1"] + scores["test2"]) / 2
 
+        images = list(crud.get_images(
+            session, search_term="foo", min_score=threshold
+        ))
+
+        assert [image.name for image in images] == ["test2"]
+        assert images[0].score >= threshold
+
+        images = list(crud.get_images(
+            session, search_term="foo", min_score=threshold, stream=True
+        ))
+
+        assert [image.name for image in images] == ["test2"]
+
+    def test_ann_depth_rerank(self, monkeypatch):
+        """Test that binary-quantized searches re-rank enough candidates."""
+
+        monkeypatch.setattr(vector_index, "BINARY_QUANTIZATION", True)
+        monkeypatch.setattr(vector_index, "RERANK_CANDIDATES", 400)
+        monkeypatch.setattr(crud, "FILTER_OVERSAMPLE", 10)
+
+        assert crud._ann_depth(10, None) == 400
+        assert crud._ann_depth(1000, None) == 1000
+        assert crud._ann_depth(50, schemas.ImageFilters(make="a")) == 500
+
+    @pytest.mark.skipif(
+        not vector_index.BINARY_QUANTIZATION,
+        reason="BINARY_QUANTIZATION is off"
+    )
+    def test_get_images_binary_quantization(
+            self, session: Session, monkeypatch):
+        """Test that candidates off the binary index are ranked exactly."""
+
+        monkeypatch.setattr(
+            crud, "get_query_embedding",
+            lambda db, search_term: self.image_2.embedding
+        )
+
+        images = list(crud.get_images(session, search_term="foo"))
+
+        assert [image.name for image in images] == ["test2", "test1"]
+        assert images[0].score == pytest.approx(
+            np.dot(self.image_2.embedding, self.image_2.embedding), rel=1e-3
+        )
+
+    def test_get_images_stream(self, session: Session):
+        """Test streaming images from a server-side cursor."""
+
+        images = crud.get_images(session, stream=True)
+
+        assert sorted(image.name for image in images) == ["test1", "test2"]
+
+    def test_get_images_mmap_backend(
+            self, session: Session, monkeypatch, tmp_path):
+        """Test semantic search served by the memory-mapped vector store."""
+
+        store = vector_store.VectorStore(str(tmp_path), EMBEDDING_SIZE)
+        monkeypatch.setattr(vector_store, "_store", store)
+        monkeypatch.setattr(vector_store, "VECTOR_SEARCH_BACKEND", "mmap")
+        monkeypatch.setattr(
+            crud, "get_query_embedding",
+            lambda db, search_term: self.image_2.embedding
+        )
+
+        vector_store.rebuild_from_db(session)
+
+        images = crud.get_images(session, search_term="foo")
+
+        assert [image.name for image in images] == ["test2", "test1"]
+
+        images = crud.get_images(
+            session, search_term="foo", min_score=images[0].score
+        )
+
+        assert [image.name for image in images] == ["test2"]
+
+        crud.delete_image(session, "test2")
+        images = crud.get_images(session, search_term="foo")
+
+        assert [image.name for image in images] == ["test1"]
+
+        image = schemas.ImageCreate(
+            name="test3",
+            aws_image_src="https://test3.jpg",
+            exif_data={},
+            embedding=self.image_2.embedding
+        )
+        crud.create_image(session, image)
+        images = crud.get_images(session, search_term="foo", limit=1)
+
+        assert [image.name for image in images] == ["test3"]
+
+        cursor = pagination.decode_cursor(
+            pagination.next_cursor(images[0], 1, 1, search=True), search=True
+        )
+        images = crud.get_images(
+            session, search_term="foo", limit=1, cursor=cursor
+        )
+
+        assert [image.name for image in images] == ["test1"]
+
+
+    def _add_camera_images(self, session: Session):
+        session.bulk_save_objects([
+            Image(
+                name="nikon",
+                aws_image_src="https://nikon.jpg",
+                exif_data={
+                    "Make": "NIKON CORPORATION",
+                    "Model": "NIKON D70",
+                    "DateTimeOriginal": "2021:03:15 09:52:01",
+                    "FocalLength": 100.0,
+                    "Orientation": 1
+                },
+                embedding=np.random.random(EMBEDDING_SIZE).tolist()
+            ),
+            Image(
+                name="fuji",
+                aws_image_src="https://fuji.jpg",
+                exif_data={
+                    "Make": "FUJIFILM",
+                    "Model": "FinePix E500   ",
+                    "DateTime": "2008:07:31 16:49:10",
+                    "FocalLength": 4.7,
+                    "Orientation": 6
+                },
+                embedding=np.random.random(EMBEDDING_SIZE).tolist()
+            ),
+        ])
+        session.commit()
+
+    def test_get_images_filters(self, session: Session):
+        """Test filtering the listing on promoted EXIF columns."""
+
+        self._add_camera_images(session)
+
+        def names(**filters):
+            return sorted(image.name for image in crud.get_images(
+                session, filters=schemas.ImageFilters(**filters)
+            ))
+
+        assert names(make="nikon") == ["nikon"]
+        assert names(model="finepix e") == ["fuji"]
+        assert names(make="%") == []
+        assert names(taken_after=datetime(2020, 1, 1)) == ["nikon"]
+        assert names(taken_before=datetime(2020, 1, 1)) == ["fuji"]
+        assert names(min_focal_length=50) == ["nikon"]
+        assert names(max_focal_length=50) == ["fuji"]
+        assert names(orientation=6) == ["fuji"]
+        assert names(make="fuji", orientation=1) == []
+        assert names(uploaded_after=datetime(2000, 1, 1)) == [
+            "fuji", "nikon", "test1", "test2"
+        ]
+        assert names(uploaded_before=datetime(2000, 1, 1)) == []
+
+    @pytest.mark.parametrize("strategy", ["pre", "post", "auto"])
+    def test_get_images_search_filters(
+            self, session: Session, monkeypatch, strategy):
+        """Test filtered searches rank only matching images."""
+
+        self._add_camera_images(session)
+        monkeypatch.setattr(crud, "FILTER_STRATEGY", strategy)
+        monkeypatch.setattr(
+            crud, "get_query_embedding",
+            lambda db, search_term: self.image_2.embedding
+        )
+        filters = schemas.ImageFilters(uploaded_after=datetime(2000, 1, 1))
+
+        expected = list(crud.get_images(session, search_term="foo"))
+        images = list(crud.get_images(
+            session, search_term="foo", filters=filters
+        ))
+
+        assert [image.name for image in images] == [
+            image.name for image in expected
+        ]
+        assert [image.score for image in images] == pytest.approx(
+            [image.score for image in expected]
+        )
+
+        images = list(crud.get_images(
+            session,
+            search_term="foo",
+            filters=schemas.ImageFilters(make="nikon")
+        ))
+
+        assert [image.name for image in images] == ["nikon"]
+
+        cursor = pagination.decode_cursor(
+            pagination.next_cursor(images[0], 1, 1, search=True), search=True
+        )
+        images = list(crud.get_images(
+            session,
+            limit=1,
+            search_term="foo",
+            cursor=cursor,
+            filters=schemas.ImageFilters(make="nikon")
+        ))
+
+        assert images == []
+
+    def test_get_image_embedding(self, session: Session):
+        """Test getting an image's stored embedding."""
+
+        assert crud.get_image_embedding(session, "test1") == pytest.approx(
+            self.image_1.embedding
+        )
+        assert crud.get_image_embedding(session, "foo") is None
+
+    def test_get_images_by_embedding(self, session: Session, monkeypatch):
+        """Test searching by an embedding, leaving the source image out."""
+
+        monkeypatch.setattr(crud, "get_query_embedding", None)
+
+        images = list(crud.get_images(
+            session, query_embedding=self.image_1.embedding
+        ))
+
+        assert [image.name for image in images] == ["test1", "test2"]
+
+        images = list(crud.get_images(
+            session, query_embedding=self.image_1.embedding, exclude="test1"
+        ))
+
+        assert [image.name for image in images] == ["test2"]
+        assert images[0].score == pytest.approx(
+            np.dot(self.image_1.embedding, self.image_2.embedding)
+        )
+
+    def test_get_images_by_embedding_mmap_backend(
+            self, session: Session, monkeypatch, tmp_path):
+        """Test leaving the source image out of vector store results."""
+
+        store = vector_store.VectorStore(str(tmp_path), EMBEDDING_SIZE)
+        monkeypatch.setattr(vector_store, "_store", store)
+        monkeypatch.setattr(vector_store, "VECTOR_SEARCH_BACKEND", "mmap")
+        vector_store.rebuild_from_db(session)
+
+        images = crud.get_images(
+            session,
+            limit=1,
+            query_embedding=self.image_1.embedding,
+            exclude="test1"
+        )
+
+        assert [image.name for image in images] == ["test2"]
+
+    def test_get_query_embeddings(self, session: Session, monkeypatch):
+        """Test embedding several search terms in one forward pass."""
+
+        calls = []
+
+        def fake_get_text_embeddings(texts):
+            calls.append(texts)
+            return np.random.random((len(texts), EMBEDDING_SIZE)).tolist()
+
+        monkeypatch.setattr(
+            crud.clip, "get_text_embeddings", fake_get_text_embeddings
+        )
+        monkeypatch.setattr(crud, "QUERY_CACHE_PERSIST", True)
+        crud.query_embedding_cache.clear()
+        cached = crud.get_query_embedding(session, "a rose")
+
+        embeddings = crud.get_query_embeddings(
+            session, ["A Rose", "a tulip", "a daisy", "a  tulip"]
+        )
+
+        assert calls == [["a tulip", "a daisy"]]
+        assert embeddings[0] == cached
+        assert embeddings[1] == embeddings[3]
+        assert session.get(QueryEmbedding, "a daisy") is not None
+
+        crud.query_embedding_cache.clear()
+
+        assert np.allclose(
+            crud.get_query_embeddings(session, ["a daisy"])[0],
+            embeddings[2]
+        )
+        assert len(calls) == 1
+
+    def _batch_searches(self, monkeypatch):
+        embeddings = [self.image_1.embedding, self.image_2.embedding]
+        monkeypatch.setattr(
+            crud, "get_query_embeddings",
+            lambda db, search_terms: embeddings[:len(search_terms)]
+        )
+
+        return [
+            schemas.SearchQuery(q="one", limit=2),
+            schemas.SearchQuery(q="two", limit=1, min_score=-100),
+        ]
+
+    def test_search_images_batch(self, session: Session, monkeypatch):
+        """Test that a batch of searches matches running them one by one."""
+
+        searches = self._batch_searches(monkeypatch)
+        searches.append(schemas.SearchQuery(
+            q="three", filters=schemas.ImageFilters(make="nikon")
+        ))
+        embeddings = [
+            self.image_1.embedding, self.image_2.embedding,
+            self.image_1.embedding
+        ]
+        monkeypatch.setattr(
+            crud, "get_query_embeddings", lambda db, search_terms: embeddings
+        )
+
+        results = crud.search_images_batch(session, searches)
+
+        assert [[image.name for image in images] for images in results] == [
+            ["test1", "test2"], ["test2"], []
+        ]
+        assert results[0][0].score == pytest.approx(
+            np.dot(self.image_1.embedding, self.image_1.embedding)
+        )
+        # The same image, with each search's score
+        assert results[0][1].score == pytest.approx(
+            np.dot(self.image_1.embedding, self.image_2.embedding)
+        )
+        assert results[1][0].score == pytest.approx(
+            np.dot(self.image_2.embedding, self.image_2.embedding)
+        )
+
+    def test_search_images_batch_mmap_backend(
+            self, session: Session, monkeypatch, tmp_path):
+        """Test a batch of searches served by the vector store."""
+
+        store = vector_store.VectorStore(str(tmp_path), EMBEDDING_SIZE)
+        monkeypatch.setattr(vector_store, "_store", store)
+        monkeypatch.setattr(vector_store, "VECTOR_SEARCH_BACKEND", "mmap")
+        vector_store.rebuild_from_db(session)
+        searches = self._batch_searches(monkeypatch)
+
+        results = crud.search_images_batch(session, searches)
+
+        assert [[image.name for image in images] for images in results] == [
+            ["test1", "test2"], ["test2"]
+        ]
+        assert results[1][0].score == pytest.approx(
+            np.dot(self.image_2.embedding, self.image_2.embedding), rel=1e-5
+        )
+
+    def test_copy_images_mmap_backend(
+            self, session: Session, monkeypatch, tmp_path):
+        """Test that copies are added to the vector store."""
+
+        store = vector_store.VectorStore(str(tmp_path), EMBEDDING_SIZE)
+        monkeypatch.setattr(vector_store, "_store", store)
+        monkeypatch.setattr(vector_store, "VECTOR_SEARCH_BACKEND", "mmap")
+        vector_store.rebuild_from_db(session)
+
+        crud.copy_images(session, [("copy1", "test1"), ("copy2", "test1")])
+
+        assert len(store) == 4
+        assert {
+            name for name, _ in store.search(self.image_1.embedding, 3)
+        } == {"test1", "copy1", "copy2"}
+
+    def test_copy_images(self, session: Session):
+        """Test creating images that share another image's content."""
+
+        crud.set_hashes(session, "test1", "abc", 42)
+
+        assert crud.get_duplicate_names(session, ["abc", "def"]) == {
+            "abc": "test1"
+        }
+
+        created = crud.copy_images(
+            session, [("copy1", "test1"), ("test2", "test1"), ("copy2", "foo")]
+        )
+
+        assert created == ["copy1"]
+
+        copy = crud.get_image(session, "copy1")
+        embedding = crud.get_image_embedding(session, "copy1")
+        assert copy.aws_image_src == "https://test1.jpg"
+        assert copy.exif_data == {"field1": "value1"}
+        assert copy.content_hash == "abc"
+        assert copy.perceptual_hash == 42
+        assert embedding == pytest.approx(self.image_1.embedding)
+
+    def test_get_used_urls(self, session: Session):
+        """Test checking which S3 objects are still used."""
+
+        urls = ["https://test1.jpg", "https://thumb/abc", "https://thumb/copy1"]
+
+        crud.set_hashes(session, "test1", "abc", 42)
+        crud.set_variants(session, "test1", {"thumb": "https://thumb/abc"})
+        crud.copy_images(session, [("copy1", "test1")])
+        # Copied before the original had variants
+        crud.set_variants(session, "copy1", {"thumb": "https://thumb/copy1"})
+        crud.delete_image(session, "test1")
+
+        assert crud.get_used_urls(session, "abc", urls) == {
+            "https://test1.jpg", "https://thumb/copy1"
+        }
+
+        crud.delete_image(session, "copy1")
+
+        assert crud.get_used_urls(session, "abc", urls) == set()
+        assert crud.get_used_urls(session, None, urls) == set()
+
+    def test_get_near_duplicates(self, session: Session):
+        """Test finding pairs of images with similar embeddings."""
+
+        session.query(Image).delete()
+        rng = np.random.default_rng(0)
+        unit = rng.normal(size=(2, EMBEDDING_SIZE))
+        unit /= np.linalg.norm(unit, axis=1, keepdims=True)
+        near = unit[1] + 0.01 * rng.normal(size=EMBEDDING_SIZE)
+        near /= np.linalg.norm(near)
+        session.add_all([
+            Image(name=name, aws_image_src=f"https://{name}.jpg",
+                  exif_data={}, embedding=embedding.tolist())
+            for name, embedding in [
+                ("a", unit[0]), ("b", unit[1]), ("near_b", near)
+            ]
+        ])
+        session.commit()
+        crud.set_hashes(session, "a", "abc", 0b1011)
+        crud.copy_images(session, [("copy_a", "a")])
+
+        pairs = list(crud.get_near_duplicates(session, min_score=0.9))
+
+        assert [(name, other) for name, other, *_ in pairs] == [
+            ("a", "copy_a"), ("b", "near_b")
+        ]
+        assert pairs[0][2:] == (pytest.approx(1), True, [0b1011, 0b1011])
+        assert pairs[1][2:] == (
+            pytest.approx(np.dot(unit[1], near)), False, [None, None]
+        )
@@ -0,0 +1,65 @@
+import os
+
+from sqlalchemy.orm import sessionmaker
+
+import app.crud as crud
+import app.database as database
+from app.database import (
+    CHECKOUTS,
+    CONNECTIONS_OPENED,
+    POOL_CHECKED_OUT,
+    POOL_OVERFLOW,
+    POOL_SIZE,
+    STATEMENT_CACHE
+)
+
+# Env var overridden in pytest.ini
+SQLALCHEMY_TEST_DATABASE_URI = os.environ['SQLALCHEMY_DATABASE_URI']
+
+
+def test_make_engine_pool(monkeypatch):
+    """Test the configured pool and its utilization metrics."""
+
+    monkeypatch.setattr(database, "DB_POOL_SIZE", 2)
+    monkeypatch.setattr(database, "DB_MAX_OVERFLOW", 1)
+    engine = database.make_engine(SQLALCHEMY_TEST_DATABASE_URI, "test_pool")
+
+    connections = [engine.connect() for _ in range(3)]
+
+    assert POOL_SIZE.labels(engine="test_pool").value == 2
+    assert POOL_CHECKED_OUT.labels(engine="test_pool").value == 3
+    assert POOL_OVERFLOW.labels(engine="test_pool").value == 1
+
+    for connection in connections:
+        connection.close()
+
+    assert POOL_CHECKED_OUT.labels(engine="test_pool").value == 0
+    # The overflow connection is closed, the others kept
+    assert engine.pool.checkedin() == 2
+
+    engine.connect().close()
+
+    assert CONNECTIONS_OPENED.labels(engine="test_pool").value == 3
+    assert CHECKOUTS.labels(engine="test_pool").value == 4
+
+    engine.dispose()
+
+def test_statement_cache():
+    """Test that repeated lookups reuse their compiled statement."""
+
+    engine = database.make_engine(SQLALCHEMY_TEST_DATABASE_URI, "test_cache")
+    database.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    hits = STATEMENT_CACHE.labels(engine="test_cache", result="hit")
+    misses = STATEMENT_CACHE.labels(engine="test_cache", result="miss")
+    # Creating the tables ran catalog queries
+    before = [hits.value, misses.value]
+
+    with Session() as db:
+        for _ in range(3):
+            crud.get_image(db, "missing", ["Make"])
+
+    assert [hits.value, misses.value] == [before[0] + 2, before[1] + 1]
+
+    engine.dispose()
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, Session
+
+import app.crud as crud
+import app.dedupe as dedupe
+import app.image_utils as image_utils
+from app.bucket import Bucket
+from app.clip import EMBEDDING_SIZE
+from app.database import Base
+from app.models import Image as ImageModel
+
+# Env var overridden in pytest.ini
+SQLALCHEMY_TEST_DATABASE_URI = os.environ['SQLALCHEMY_DATABASE_URI']
+
+engine = create_engine(SQLALCHEMY_TEST_DATABASE_URI)
+
+TestingSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=engine
+)
+
+
+def test_hamming_distance():
+    """Test counting differing bits, including the sign bit."""
+
+    assert dedupe.hamming_distance(0b1011, 0b1011) == 0
+    assert dedupe.hamming_distance(0b1011, 0b0010) == 2
+    assert dedupe.hamming_distance(-1, 0) == 64
+
+
+class TestDedupe:
+    """Tests for hashing existing images and reporting near duplicates."""
+
+    @pytest.fixture
+    def session(self):
+        Base.metadata.create_all(bind=engine)
+        session = TestingSessionLocal()
+        self.bucket = Bucket()
+
+        embedding = np.random.random(EMBEDDING_SIZE)
+        embedding /= np.linalg.norm(embedding)
+
+        # The same file stored twice before uploads were hashed
+        for name in ("nikon", "nikon_again"):
+            with open("app/tests/images/Nikon_D70.jpg", "rb") as image:
+                src = self.bucket.upload_file(image.read(), name)
+            session.add(ImageModel(
+                name=name,
+                aws_image_src=src,
+                exif_data={},
+                embedding=embedding.tolist()
+            ))
+        session.commit()
+
+        yield session
+
+        for name in ("nikon", "nikon_again"):
+            self.bucket.delete_file(name)
+
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def test_backfill_and_report(self, session: Session):
+        """Test that backfilled hashes show up in the report."""
+
+        assert list(dedupe.report(session)) == [{
+            "name": "nikon",
+            "other_name": "nikon_again",
+            "score": pytest.approx(1),
+            "same_content": False,
+            "hash_distance": None,
+        }]
+
+        assert dedupe.backfill(session, self.bucket, batch_size=1) == (2, 0)
+        assert crud.get_images_missing_hashes(session) == []
+
+        with open("app/tests/images/Nikon_D70.jpg", "rb") as image:
+            content_hash = image_utils.content_hash(image.read())
+        assert crud.get_duplicate_names(session, [content_hash]) == {
+            content_hash: "nikon"
+        }
+
+        [pair] = dedupe.report(session)
+        assert pair["same_content"]
+        assert pair["hash_distance"] == 0
+
+    def test_backfill_failure(self, session: Session):
+        """Test that an image whose original is missing is reported."""
+
+        self.bucket.delete_file("nikon")
+
+        assert dedupe.backfill(session, self.bucket) == (1, 1)
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.executors import Executor, ACTIVE, QUEUED, WORKERS
+
+
+def test_executor_runs_off_loop():
+    """Test that work runs on the executor's threads, not the event loop."""
+
+    executor = Executor("test_threads", 2)
+
+    async def run():
+        loop_thread = threading.current_thread().name
+        worker_thread = await executor.run(
+            lambda: threading.current_thread().name
+        )
+        return loop_thread, worker_thread
+
+    loop_thread, worker_thread = asyncio.run(run())
+
+    assert loop_thread != worker_thread
+    assert worker_thread.startswith("test_threads-executor")
+
+def test_executor_passes_arguments():
+    """Test that positional and keyword arguments are passed through."""
+
+    executor = Executor("test_args", 1)
+
+    result = asyncio.run(executor.run(lambda a, b=0: a + b, 1, b=2))
+
+    assert result == 3
+
+def test_executor_is_bounded():
+    """Test that no more than max_workers calls run at once."""
+
+    executor = Executor("test_bounded", 2)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def work():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        threading.Event().wait(0.05)
+        with lock:
+            running.pop()
+
+    async def run():
+        await asyncio.gather(*[executor.run(work) for _ in range(6)])
+
+    asyncio.run(run())
+
+    assert max(peak) == 2
+    assert WORKERS.labels(executor="test_bounded").value == 2
+    assert ACTIVE.labels(executor="test_bounded").value == 0
+    assert QUEUED.labels(executor="test_bounded").value == 0
+
+def test_executor_propagates_errors():
+    """Test that exceptions reach the awaiting caller."""
+
+    executor = Executor("test_errors", 1)
+
+    def fail():
+        raise ValueError("foo")
+
+    with pytest.raises(ValueError):
+        asyncio.run(executor.run(fail))
+
+    assert ACTIVE.labels(executor="test_errors").value == 0
+
+def test_executor_cancelled_while_queued():
+    """Test that calls cancelled before they start leave the queue."""
+
+    executor = Executor("test_cancelled", 1)
+    release = threading.Event()
+
+    async def run():
+        blocking = asyncio.ensure_future(executor.run(release.wait))
+        queued = asyncio.ensure_future(executor.run(lambda: None))
+        await asyncio.sleep(0.05)
+
+        assert QUEUED.labels(executor="test_cancelled").value == 1
+        queued.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await blocking
+
+    asyncio.run(run())
+
+    assert QUEUED.labels(executor="test_cancelled").value == 0
+    assert ACTIVE.labels(executor="test_cancelled").value == 0
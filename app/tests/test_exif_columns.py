@@ -0,0 +1,98 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+import app.exif_columns as exif_columns
+from app.database import Base
+import app.models
+
+# Env var overridden in pytest.ini
+SQLALCHEMY_TEST_DATABASE_URI = os.environ['SQLALCHEMY_DATABASE_URI']
+
+engine = create_engine(SQLALCHEMY_TEST_DATABASE_URI)
+
+
+class TestExifColumns:
+    """Tests for the EXIF columns promoted out of exif_data."""
+
+    @pytest.fixture(autouse=True)
+    def tables(self):
+        Base.metadata.create_all(bind=engine)
+        yield
+        Base.metadata.drop_all(bind=engine)
+
+    def _insert(self, name, exif_data):
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO images (name, aws_image_src, exif_data, "
+                    "uploaded_at) VALUES (:name, '', :exif, now())"
+                ),
+                {"name": name, "exif": exif_data}
+            )
+
+    def _columns(self, name):
+        with engine.connect() as conn:
+            return conn.execute(
+                text(
+                    f"SELECT {', '.join(exif_columns.COLUMNS)} "
+                    "FROM images WHERE name = :name"
+                ),
+                {"name": name}
+            ).one()._asdict()
+
+    def test_columns_generated(self):
+        """Test that the columns are filled in from exif_data on insert."""
+
+        self._insert(
+            "nikon",
+            '{"Make": "NIKON CORPORATION ", "Model": "NIKON D70", '
+            '"DateTime": "2008:03:15 10:00:00", '
+            '"DateTimeOriginal": "2008:03:15 09:52:01", '
+            '"FocalLength": 100.0, "Orientation": 1}'
+        )
+
+        assert self._columns("nikon") == {
+            "camera_make": "nikon corporation",
+            "camera_model": "nikon d70",
+            "taken_at": "2008:03:15 09:52:01",
+            "focal_length": 100.0,
+            "orientation": 1,
+        }
+
+    def test_columns_bad_exif(self):
+        """Test that missing or mistyped EXIF values give NULLs, not errors."""
+
+        self._insert(
+            "odd",
+            '{"Make": 5, "FocalLength": "100mm", "Orientation": 42}'
+        )
+        self._insert("none", "null")
+
+        assert self._columns("odd") == {
+            "camera_make": "5",
+            "camera_model": None,
+            "taken_at": None,
+            "focal_length": None,
+            "orientation": None,
+        }
+        assert set(self._columns("none").values()) == {None}
+
+    def test_add_columns(self):
+        """Test adding the columns to a table created before them."""
+
+        self._insert("fuji", '{"Make": "FUJIFILM", "FocalLength": 4.7}')
+        with engine.begin() as conn:
+            for column in exif_columns.COLUMNS:
+                conn.execute(text(f"ALTER TABLE images DROP COLUMN {column}"))
+
+        exif_columns.add_columns(engine)
+        # Running it again is a no-op
+        exif_columns.add_columns(engine)
+
+        assert self._columns("fuji")["camera_make"] == "fujifilm"
+        assert self._columns("fuji")["focal_length"] == 4.7
+        assert set(exif_columns.INDEXES) <= {
+            index["name"] for index in inspect(engine).get_indexes("images")
+        }
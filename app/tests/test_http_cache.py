@@ -0,0 +1,36 @@
+import app.http_cache as http_cache
+
+
+def test_matches():
+    """Test comparing ETags to If-None-Match values."""
+
+    tag = '"abc"'
+
+    assert http_cache.matches('"abc"', tag)
+    assert http_cache.matches('"xyz", W/"abc"', tag)
+    assert http_cache.matches("*", tag)
+    assert not http_cache.matches('"xyz"', tag)
+    assert not http_cache.matches(None, tag)
+
+def test_json_response():
+    """Test ETags of JSON responses and remembering them."""
+
+    key = ("/test", ())
+    http_cache.etag_cache.clear()
+
+    response = http_cache.json_response(key, 1, {"a": 1}, None)
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] == http_cache.etag(response.body)
+    assert response.headers["Cache-Control"] == http_cache.CACHE_CONTROL
+    tag = response.headers["ETag"]
+
+    # The same body gets the same ETag
+    response = http_cache.json_response(key, 2, {"a": 1}, tag)
+    assert response.status_code == 304
+    assert response.headers["ETag"] == tag
+
+    assert http_cache.cached_response(key, 2, tag).status_code == 304
+    # Only at the version it was served at
+    assert http_cache.cached_response(key, 3, tag) is None
+    assert http_cache.cached_response(key, 2, '"other"') is None
@@ -1,4 +1,14 @@
-from app.image_utils import scrape_exif
+from io import BytesIO
+
+from PIL import Image
+
+from app.image_utils import (
+    content_hash,
+    load_reduced,
+    open_image,
+    perceptual_hash,
+    scrape_exif
+)
 
 def test_scrape_exif():
     """Test getting exif data from an image with exif data."""
@@ -17,7 +27,12 @@ def test_scrape_exif():
             'YCbCrPositioning': 2, 
             'Copyright': '    ', 
             'XResolution': 96.0, 
-            'YResolution': 96.0
+            'YResolution': 96.0,
+            'DateTimeOriginal': '2006:08:17 09:24:48',
+            'FocalLength': 4.7,
+            'ExposureTime': 0.0125,
+            'FNumber': 2.9,
+            'ISOSpeedRatings': 100
     }
 
 def test_scrape_exif_no_exif():
@@ -26,4 +41,84 @@ def test_scrape_exif_no_exif():
     with open("app/tests/images/pexels-mikhail-nilov-8297845.jpg", "rb") as image:
         exif = scrape_exif(image)
 
-    assert exif == {}
\ No newline at end of file
+    assert exif == {}
+
+def test_scrape_exif_from_decoded_image():
+    """Test that a decoded image gives the same exif data as the file."""
+
+    with open("app/tests/images/Nikon_D70.jpg", "rb") as image:
+        image_bytes = image.read()
+
+    pil_image = open_image(image_bytes)
+
+    with open("app/tests/images/Nikon_D70.jpg", "rb") as image:
+        assert scrape_exif(pil_image) == scrape_exif(image)
+
+def test_open_image():
+    """Test opening an image from bytes, a file or a PIL image."""
+
+    with open("app/tests/images/Pentax_K10D.jpg", "rb") as image:
+        image_bytes = image.read()
+        image.seek(0)
+        from_file = open_image(image)
+        from_file.load()
+
+    from_bytes = open_image(image_bytes)
+
+    assert from_bytes.size == from_file.size
+    assert open_image(from_bytes) is from_bytes
+
+def test_content_hash():
+    """Test hashing an image file's bytes."""
+
+    assert content_hash(b"foo") == (
+        "2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae"
+    )
+
+def test_perceptual_hash():
+    """Test that resized copies hash alike and different images don't."""
+
+    with open("app/tests/images/Pentax_K10D.jpg", "rb") as image:
+        pentax = open_image(image.read())
+    with open("app/tests/images/Nikon_D70.jpg", "rb") as image:
+        nikon = open_image(image.read())
+
+    buffer = BytesIO()
+    pentax.resize((pentax.width // 4, pentax.height // 4)).save(
+        buffer, "JPEG", quality=50
+    )
+
+    def distance(hash_1, hash_2):
+        return bin((hash_1 ^ hash_2) & ((1 << 64) - 1)).count("1")
+
+    pentax_hash = perceptual_hash(pentax)
+
+    assert -(1 << 63) <= pentax_hash < (1 << 63)
+    assert distance(pentax_hash, perceptual_hash(buffer.getvalue())) <= 4
+    assert distance(pentax_hash, perceptual_hash(nikon)) > 10
+
+def test_load_reduced():
+    """Test that JPEGs are decoded no larger than needed."""
+
+    def encoded(size, image_format):
+        buffer = BytesIO()
+        Image.new("RGB", size, "red").save(buffer, image_format)
+        return buffer.getvalue()
+
+    panorama = encoded((8000, 2000), "JPEG")
+
+    # The longer side limits the scale
+    assert load_reduced(panorama, 224, 1024).size == (2000, 500)
+    # The shorter side does
+    assert load_reduced(panorama, 224).size == (1000, 250)
+    # Never smaller than asked for
+    assert load_reduced(panorama, 4000).size == (8000, 2000)
+    # Only JPEGs can be decoded at a reduced scale
+    assert load_reduced(encoded((800, 200), "PNG"), 50).size == (800, 200)
+
+    with open("app/tests/images/Fujifilm_FinePix_E500.jpg", "rb") as image:
+        fuji = open_image(image.read())
+    exif = scrape_exif(fuji)
+    load_reduced(fuji, 100)
+
+    assert scrape_exif(fuji) == exif
@@ -0,0 +1,190 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, Session
+
+import app.crud as crud
+import app.image_utils as image_utils
+import app.ingest as ingest
+from app.bucket import Bucket
+from app.clip import EMBEDDING_SIZE
+from app.database import Base
+from app.models import Image as ImageModel
+
+# Env var overridden in pytest.ini
+SQLALCHEMY_TEST_DATABASE_URI = os.environ['SQLALCHEMY_DATABASE_URI']
+
+engine = create_engine(SQLALCHEMY_TEST_DATABASE_URI)
+
+TestingSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=engine
+)
+
+IMAGES_DIR = "app/tests/images"
+IMAGE_NAMES = [
+    "Fujifilm_FinePix_E500",
+    "Nikon_D70",
+    "Pentax_K10D",
+    "pexels-mikhail-nilov-8297845"
+]
+
+
+class TestIngest:
+    """Tests for bulk image ingestion."""
+
+    @pytest.fixture
+    def session(self):
+        Base.metadata.create_all(bind=engine)
+        session = TestingSessionLocal()
+
+        yield session
+
+        bucket = Bucket()
+        session.rollback()
+        for image in session.query(ImageModel):
+            for url in [image.aws_image_src, *(image.variants or {}).values()]:
+                bucket.delete_file(bucket.key(url))
+
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def test_ingest_directory(self, session: Session):
+        """Test ingesting a directory of images."""
+
+        report = ingest.ingest(
+            session, Bucket(), ingest.iter_directory(IMAGES_DIR), batch_size=3
+        )
+
+        assert report.created == 4
+        assert report.failed == 0
+        assert sorted(item.name for item in report.items) == IMAGE_NAMES
+        assert set(report.stages) >= {"decode_exif", "upload", "embed", "insert"}
+        assert report.stages["embed"].items == 4
+
+        image = crud.get_image(session, "Nikon_D70")
+        assert image.exif_data["Make"] == "NIKON CORPORATION"
+        assert len(image.embedding) == EMBEDDING_SIZE
+
+    def test_ingest_resumes(self, session: Session):
+        """Test that images already ingested are skipped."""
+
+        items = list(ingest.iter_directory(IMAGES_DIR))
+
+        ingest.ingest(session, Bucket(), items[:2])
+        report = ingest.ingest(session, Bucket(), items)
+
+        assert report.skipped == 2
+        assert report.created == 2
+
+    def test_ingest_reports_failures(self, session: Session):
+        """Test that a bad item fails alone without stopping the batch."""
+
+        with open(f"{IMAGES_DIR}/Nikon_D70.jpg", "rb") as image:
+            nikon = image.read()
+
+        report = ingest.ingest(session, Bucket(), [
+            ("Nikon_D70", nikon),
+            ("not_an_image", b"foo"),
+            ("x" * 51, nikon),
+        ])
+
+        statuses = {item.name: item for item in report.items}
+
+        assert report.created == 1
+        assert report.failed == 2
+        assert statuses["Nikon_D70"].status == "created"
+        assert statuses["not_an_image"].error.startswith("decode")
+        assert statuses["x" * 51].status == "failed"
+
+    def test_ingest_deduplicates(self, session: Session):
+        """Test that repeated content is stored once."""
+
+        with open(f"{IMAGES_DIR}/Nikon_D70.jpg", "rb") as image:
+            nikon = image.read()
+
+        ingest.ingest(session, Bucket(), [("Nikon_D70", nikon)])
+        report = ingest.ingest(session, Bucket(), [
+            ("Pentax_K10D", nikon),
+            ("archive/nikon", b"foo"),
+            ("Fujifilm_FinePix_E500", b"foo"),
+        ])
+
+        statuses = {item.name: item for item in report.items}
+
+        assert report.created == 1
+        assert report.deduplicated == 1
+        assert report.failed == 2
+        assert statuses["Pentax_K10D"].duplicate_of == "Nikon_D70"
+        assert statuses["Fujifilm_FinePix_E500"].error.endswith(
+            "duplicate of archive/nikon, which failed"
+        )
+        assert crud.get_image(session, "Pentax_K10D").aws_image_src == (
+            crud.get_image(session, "Nikon_D70").aws_image_src
+        ) == Bucket().url(
+            image_utils.original_key(image_utils.content_hash(nikon))
+        )
+
+    def test_iter_archives(self):
+        """Test reading images out of zip and tar archives."""
+
+        with open(f"{IMAGES_DIR}/Nikon_D70.jpg", "rb") as image:
+            nikon = image.read()
+
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w") as archive:
+            archive.writestr("archive/nikon.jpg", nikon)
+            archive.writestr("archive/notes.txt", "not an image")
+        zip_buffer.seek(0)
+
+        tar_buffer = io.BytesIO()
+        with tarfile.open(fileobj=tar_buffer, mode="w:gz") as archive:
+            info = tarfile.TarInfo("./archive/nikon.jpg")
+            info.size = len(nikon)
+            archive.addfile(info, io.BytesIO(nikon))
+        tar_buffer.seek(0)
+
+        for buffer, filename in [(zip_buffer, "a.zip"), (tar_buffer, "a.tgz")]:
+            assert list(ingest.iter_archive(buffer, filename)) == [
+                ("archive/nikon", nikon)
+            ]
+
+    def test_iter_archive_limits_size(self, session: Session, monkeypatch):
+        """Test that members over MAX_IMAGE_BYTES fail without being read."""
+
+        monkeypatch.setattr(ingest, "MAX_IMAGE_BYTES", 1024)
+
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            # Compresses to a few bytes
+            archive.writestr("bomb.jpg", bytes(1024 * 1024))
+            archive.writestr("small.jpg", b"foo")
+        zip_buffer.seek(0)
+
+        items = list(ingest.iter_archive(zip_buffer, "a.zip"))
+
+        assert items[0][0] == "bomb.jpg"
+        assert isinstance(items[0][1], ValueError)
+        assert items[1] == ("small", b"foo")
+
+        report = ingest.ingest(session, Bucket(), items[:1])
+
+        assert report.failed == 1
+        assert report.items[0].error.startswith("read: File larger than")
+
+    def test_image_name_from_path(self):
+        """Test naming images after their paths."""
+
+        assert ingest.image_name_from_path("./a/b.jpg") == "a/b"
+        assert ingest.image_name_from_path(".hidden/x.jpg") == ".hidden/x"
+        assert ingest.image_name_from_path("a/./c/../b.jpg") == "a/b"
+        assert ingest.image_name_from_path("/abs/x.jpg") == "abs/x"
+
+        for path in ("../a.jpg", "a/../../b.jpg", "a/.."):
+            with pytest.raises(ValueError):
+                ingest.image_name_from_path(path)
@@ -0,0 +1,105 @@
+import time
+import asyncio
+import types
+
+import pytest
+
+import app.instrumentation as instrumentation
+from app.instrumentation import CALL_SECONDS, CALL_ERRORS
+
+
+def test_timed():
+    """Test that calls are timed and failures counted."""
+
+    @instrumentation.timed("test", "sync")
+    def work(fail=False):
+        if fail:
+            raise ValueError("oops")
+        return 1
+
+    assert work() == 1
+    with pytest.raises(ValueError):
+        work(fail=True)
+
+    assert CALL_SECONDS.labels(component="test", operation="sync").count == 2
+    assert CALL_ERRORS.labels(component="test", operation="sync").value == 1
+
+def test_timed_async():
+    """Test that coroutine functions are timed until they finish."""
+
+    @instrumentation.timed("test")
+    async def async_work():
+        await asyncio.sleep(0.01)
+        return 2
+
+    assert asyncio.run(async_work()) == 2
+
+    histogram = CALL_SECONDS.labels(component="test", operation="async_work")
+    assert histogram.count == 1
+    assert histogram.sum >= 0.01
+
+def test_timed_iter():
+    """Test that only producing items is timed, and failures counted."""
+
+    def items(fail=False):
+        yield 1
+        if fail:
+            raise ValueError("oops")
+        yield 2
+
+    histogram = CALL_SECONDS.labels(component="test", operation="iter")
+    errors = CALL_ERRORS.labels(component="test", operation="iter")
+
+    iterator = instrumentation.timed_iter(items(), "test", "iter")
+    # Not timed until iterated over
+    assert histogram.count == 0
+
+    results = []
+    for item in iterator:
+        time.sleep(0.01)
+        results.append(item)
+
+    assert results == [1, 2]
+    assert histogram.count == 1
+    # Time spent by the consumer isn't counted
+    assert histogram.sum < 0.01
+
+    with pytest.raises(ValueError):
+        list(instrumentation.timed_iter(items(fail=True), "test", "iter"))
+
+    assert histogram.count == 2
+    assert errors.value == 1
+
+def test_instrument():
+    """Test which functions of a module are wrapped."""
+
+    module = types.ModuleType("test_module")
+    exec(
+        "from os.path import join\n"
+        "def public(): pass\n"
+        "def _private(): pass\n"
+        "def generator(): yield 1\n",
+        module.__dict__
+    )
+
+    instrumentation.instrument(module, "test")
+    public = module.public
+    instrumentation.instrument(module, "test")
+
+    assert public.instrumented
+    # Not wrapped twice
+    assert module.public is public
+    assert not hasattr(module._private, "instrumented")
+    assert not hasattr(module.generator, "instrumented")
+    assert not hasattr(module.join, "instrumented")
+
+def test_server_timing():
+    """Test the Server-Timing header value."""
+
+    spans = [("crud.get_image", 0.002), ("s3.get_file", 0.01),
+             ("crud.get_image", 0.003)]
+
+    assert instrumentation.server_timing(spans, 0.02) == (
+        'crud.get_image;dur=5.0;desc="2 calls", s3.get_file;dur=10.0, '
+        'total;dur=20.0'
+    )
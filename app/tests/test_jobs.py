@@ -0,0 +1,190 @@
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker, Session
+
+import app.crud as crud
+import app.ingest as ingest
+import app.image_utils as image_utils
+import app.jobs as jobs
+from app.bucket import Bucket
+from app.database import Base
+from app.models import Image as ImageModel, IngestJob
+
+# Env var overridden in pytest.ini
+SQLALCHEMY_TEST_DATABASE_URI = os.environ['SQLALCHEMY_DATABASE_URI']
+
+engine = create_engine(SQLALCHEMY_TEST_DATABASE_URI)
+
+TestingSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=engine
+)
+
+with open("app/tests/images/Nikon_D70.jpg", "rb") as image:
+    NIKON = image.read()
+
+
+class TestJobs:
+    """Tests for the ingestion job queue and its worker."""
+
+    @pytest.fixture
+    def session(self):
+        Base.metadata.create_all(bind=engine)
+        session = TestingSessionLocal()
+        self.bucket = Bucket()
+        self.job_ids = []
+
+        yield session
+
+        for job_id in self.job_ids:
+            self.bucket.delete_file(jobs.staging_key(job_id))
+        session.rollback()
+        for image in session.query(ImageModel):
+            for url in [image.aws_image_src, *(image.variants or {}).values()]:
+                self.bucket.delete_file(self.bucket.key(url))
+
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def enqueue(self, session, image_name, data=NIKON, key=None):
+        job_id = uuid.uuid4()
+        self.job_ids.append(job_id)
+        self.bucket.upload_file(data, jobs.staging_key(job_id))
+        return crud.create_job(
+            session, job_id, image_name, image_utils.content_hash(data), key
+        )
+
+    def test_run_once(self, session: Session):
+        """Test that a worker ingests queued uploads."""
+
+        job = self.enqueue(session, "nikon")
+
+        assert job.status == "queued"
+        assert crud.is_name_queued(session, "nikon")
+
+        assert jobs.run_once(session, self.bucket) == 1
+
+        job = crud.get_job(session, job.id)
+        assert job.status == "succeeded"
+        assert job.attempts == 1
+        assert crud.get_image(session, "nikon").content_hash == (
+            job.content_hash
+        )
+        assert not crud.is_name_queued(session, "nikon")
+        with pytest.raises(Exception) as e_info:
+            self.bucket.get_file(jobs.staging_key(job.id))
+        assert e_info.typename == "NoSuchKey"
+
+        # Nothing left to do
+        assert jobs.run_once(session, self.bucket) == 0
+
+    def test_idempotency_key(self, session: Session):
+        """Test that a key can only queue one job."""
+
+        job = self.enqueue(session, "nikon", key="abc")
+
+        assert self.enqueue(session, "nikon", key="abc") is None
+        assert crud.get_job_by_idempotency_key(session, "abc").id == job.id
+
+    def test_retries(self, session: Session, monkeypatch):
+        """Test that failed attempts are retried, then given up on."""
+
+        def broken_upload(*args):
+            raise RuntimeError("S3 is down")
+
+        monkeypatch.setattr(ingest, "_upload", broken_upload)
+        monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+        monkeypatch.setattr(jobs, "JOB_RETRY_DELAY", 3600)
+
+        job = self.enqueue(session, "nikon")
+        jobs.run_once(session, self.bucket)
+
+        job = crud.get_job(session, job.id)
+        assert job.status == "queued"
+        assert job.attempts == 1
+        assert job.error == "upload: S3 is down"
+
+        # Not due again yet
+        assert jobs.run_once(session, self.bucket) == 0
+
+        monkeypatch.setattr(jobs, "JOB_RETRY_DELAY", 0)
+        crud.retry_job(session, job.id, job.error, 0)
+        jobs.run_once(session, self.bucket)
+
+        job = crud.get_job(session, job.id)
+        assert job.status == "failed"
+        assert job.attempts == 2
+        assert crud.get_image(session, "nikon") is None
+
+    def test_permanent_failure(self, session: Session):
+        """Test that uploads that aren't images aren't retried."""
+
+        job = self.enqueue(session, "other", data=b"foo")
+        jobs.run_once(session, self.bucket)
+
+        job = crud.get_job(session, job.id)
+        assert job.status == "failed"
+        assert job.attempts == 1
+        assert job.error.startswith("decode")
+
+    def test_name_taken(self, session: Session):
+        """Test that a job fails when its name was taken meanwhile."""
+
+        ingest.ingest(session, self.bucket, [("nikon", NIKON)])
+
+        # With the same content, an earlier attempt got that far
+        same = self.enqueue(session, "nikon")
+        other = self.enqueue(session, "nikon", data=b"foo")
+        jobs.run_once(session, self.bucket, batch_size=1)
+        jobs.run_once(session, self.bucket, batch_size=1)
+
+        assert crud.get_job(session, same.id).status == "succeeded"
+        assert crud.get_job(session, other.id).status == "failed"
+
+    def test_claim_skips_locked(self, session: Session):
+        """Test that workers never claim the same job."""
+
+        first = self.enqueue(session, "nikon")
+        second = self.enqueue(session, "other")
+
+        # Another worker is claiming the first job
+        with TestingSessionLocal() as other:
+            other.execute(
+                select(IngestJob)
+                .where(IngestJob.id == first.id)
+                .with_for_update()
+            )
+
+            claimed = crud.claim_jobs(session, 10, lease_seconds=60)
+
+        assert [job.id for job in claimed] == [second.id]
+
+    def test_lease_expiry(self, session: Session):
+        """Test that jobs of a worker that died are run again."""
+
+        job = self.enqueue(session, "nikon")
+
+        [claimed] = crud.claim_jobs(session, 10, lease_seconds=0)
+        assert claimed.status == "running"
+
+        [reclaimed] = crud.claim_jobs(session, 10, lease_seconds=60)
+        assert reclaimed.id == job.id
+        assert reclaimed.attempts == 2
+
+        assert crud.claim_jobs(session, 10, lease_seconds=60) == []
+
+    def test_update_metrics(self, session: Session):
+        """Test the queue depth gauges."""
+
+        self.enqueue(session, "nikon")
+        self.enqueue(session, "other")
+
+        jobs.update_metrics(session)
+
+        assert jobs.JOBS.labels(status="queued").value == 2
+        assert jobs.JOBS.labels(status="running").value == 0
+        assert jobs.OLDEST_QUEUED_SECONDS.value >= 0
@@ -1,11 +1,22 @@
 import os
+import json
+import threading
 from dateutil import parser
 
+import pytest
+
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from app.main import app, get_db
+import app.clip as clip
+import app.crud as crud
+import app.image_utils as image_utils
+import app.instrumentation as instrumentation
+import app.jobs as jobs
+import app.main as main
+import app.variants as variants
+from app.main import app, get_db, get_read_db
 from app.database import Base
 
 
@@ -35,6 +46,7 @@ def override_get_db():
         db.close()
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
 
 client = TestClient(app)
 
@@ -67,8 +79,11 @@ def test_get_image_okay():
     
     assert response.status_code == 200
     assert data["name"] == image_name
+    with open(f"app/tests/images/{TEST_IMAGES[image_name]}", "rb") as image:
+        content_hash = image_utils.content_hash(image.read())
     assert data["aws_image_src"] == (
-        f'https://{BUCKET_NAME}.s3.{REGION}.amazonaws.com/{image_name}'
+        f'https://{BUCKET_NAME}.s3.{REGION}.amazonaws.com/'
+        f'{image_utils.original_key(content_hash)}'
     )
     assert data["exif_data"] == {
         'ResolutionUnit': 2, 
@@ -79,7 +94,13 @@ def test_get_image_okay():
         'Orientation': 1, 'DateTime': 
         '2008:07:31 10:03:44', 
         'XResolution': 240.0, 
-        'YResolution': 240.0
+        'YResolution': 240.0,
+        'DateTimeOriginal': '2008:03:15 09:52:01',
+        'FocalLength': 100.0,
+        'FocalLengthIn35mmFilm': 150,
+        'ExposureTime': 0.005,
+        'FNumber': 9.0,
+        'ISOSpeedRatings': 200
     } 
 
     assert _is_valid_datetime_string(data["uploaded_at"])
@@ -156,6 +177,255 @@ def test_get_images_with_different_search():
     assert data[0]["name"] == "pentax_test"
     assert data[1]["name"] == "nikon_test"
 
+def test_get_images_scores():
+    """Test that search results carry scores and min_score filters them."""
+
+    response = client.get("/images/", params={"q": "a lizard on a leaf"})
+    data = response.json()
+
+    assert data[0]["score"] >= data[1]["score"]
+
+    response = client.get(
+        "/images/",
+        params={"q": "a lizard on a leaf", "min_score": data[0]["score"]}
+    )
+
+    assert [image["name"] for image in response.json()] == [data[0]["name"]]
+
+    response = client.get("/images/")
+
+    assert all(image["score"] is None for image in response.json())
+
+def test_get_images_min_score_without_search():
+    """Test that min_score needs a search query."""
+
+    response = client.get("/images/", params={"min_score": 0.2})
+
+    assert response.status_code == 400
+
+def test_get_images_exif_fields():
+    """Test selecting EXIF keys with fields."""
+
+    response = client.get("/images/", params={"fields": "Make,Model"})
+    data = response.json()
+
+    assert len(data) == 2
+    for image in data:
+        assert set(image["exif_data"]) == {"Make", "Model"}
+
+    response = client.get("/images/nikon_test", params={"fields": "Make"})
+
+    assert response.json()["exif_data"] == {"Make": "NIKON CORPORATION"}
+
+def test_get_images_filters():
+    """Test filtering the listing and search on image metadata."""
+
+    response = client.get("/images/", params={"make": "nikon"})
+
+    assert [image["name"] for image in response.json()] == ["nikon_test"]
+
+    response = client.get(
+        "/images/",
+        params={"q": "camera", "taken_before": "2008-03-15T09:52:01"}
+    )
+    data = response.json()
+
+    assert "nikon_test" not in [image["name"] for image in data]
+    for image in data:
+        assert image["score"] is not None
+
+    response = client.get("/images/", params={"min_focal_length": 100})
+
+    assert "nikon_test" in [image["name"] for image in response.json()]
+
+def test_get_images_bad_filter():
+    """Test that out of range filters are rejected."""
+
+    response = client.get("/images/", params={"orientation": 9})
+
+    assert response.status_code == 422
+
+def test_get_similar_images(monkeypatch):
+    """Test getting images like a stored one, without running CLIP."""
+
+    def no_model(*args):
+        raise AssertionError("CLIP shouldn't run")
+
+    monkeypatch.setattr(clip, "get_text_embedding", no_model)
+    monkeypatch.setattr(clip, "get_image_embedding_async", no_model)
+
+    response = client.get("/images/nikon_test/similar")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [image["name"] for image in data] == ["pentax_test"]
+    assert data[0]["score"] is not None
+
+def test_get_similar_images_not_found():
+    """Test getting images like one that doesn't exist."""
+
+    response = client.get("/images/foo/similar")
+
+    assert response.status_code == 404
+
+def test_search_by_image():
+    """Test searching with an uploaded image, which isn't stored."""
+
+    with open("app/tests/images/Nikon_D70.jpg", "rb") as image:
+        file = image.read()
+
+    response = client.post(
+        "/images/search-by-image",
+        params={"limit": 1},
+        files={"file": ("Nikon_D70.jpg", file)}
+    )
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [image["name"] for image in data] == ["nikon_test"]
+    assert data[0]["score"] == pytest.approx(1, abs=1e-4)
+    assert "X-Next-Cursor" in response.headers
+    assert len(client.get("/images/").json()) == len(TEST_IMAGES)
+
+def test_search_by_image_not_an_image():
+    """Test searching with an upload that isn't an image."""
+
+    response = client.post(
+        "/images/search-by-image",
+        files={"file": ("notes.txt", b"not an image")}
+    )
+
+    assert response.status_code == 400
+
+def test_search_images_batch():
+    """Test running several searches in one request."""
+
+    response = client.post(
+        "/images/search/batch",
+        json={"queries": [
+            {"q": "a lizard on a leaf", "limit": 1},
+            {"q": "a camera", "filters": {"make": "nikon"}},
+        ]},
+        params={"fields": "Make"}
+    )
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [result["q"] for result in data] == ["a lizard on a leaf", "a camera"]
+    assert len(data[0]["images"]) == 1
+    assert [image["name"] for image in data[1]["images"]] == ["nikon_test"]
+    assert data[1]["images"][0]["exif_data"] == {"Make": "NIKON CORPORATION"}
+
+    single = client.get(
+        "/images/", params={"q": "a lizard on a leaf", "limit": 1}
+    ).json()
+
+    assert data[0]["images"][0]["name"] == single[0]["name"]
+    assert data[0]["images"][0]["score"] == pytest.approx(single[0]["score"])
+
+def test_search_images_batch_too_many(monkeypatch):
+    """Test that batches are capped at MAX_BATCH_QUERIES."""
+
+    monkeypatch.setattr(main, "MAX_BATCH_QUERIES", 1)
+
+    response = client.post(
+        "/images/search/batch",
+        json={"queries": [{"q": "one"}, {"q": "two"}]}
+    )
+
+    assert response.status_code == 400
+
+def test_cors_exposes_headers():
+    """Test that cross-origin pages can read the cursor and ETag."""
+
+    response = client.get(
+        "/images/",
+        params={"limit": 1},
+        headers={"Origin": "https://example.com"}
+    )
+
+    exposed = response.headers["Access-Control-Expose-Headers"].split(", ")
+    assert {"X-Next-Cursor", "ETag"} <= set(exposed)
+
+def test_get_images_pages():
+    """Test following X-Next-Cursor through the listing."""
+
+    response = client.get("/images/", params={"limit": 1})
+    first = response.json()
+
+    assert len(first) == 1
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get("/images/", params={"limit": 1, "cursor": cursor})
+    second = response.json()
+
+    assert len(second) == 1
+    assert {first[0]["name"], second[0]["name"]} == set(TEST_IMAGES)
+
+    response = client.get(
+        "/images/",
+        params={"limit": 1, "cursor": response.headers["X-Next-Cursor"]}
+    )
+
+    assert response.json() == []
+    assert "X-Next-Cursor" not in response.headers
+
+def test_get_images_search_pages():
+    """Test following X-Next-Cursor through search results."""
+
+    params = {"q": "a lizard on a leaf", "limit": 1}
+    response = client.get("/images/", params=params)
+    first = response.json()
+
+    response = client.get(
+        "/images/",
+        params={**params, "cursor": response.headers["X-Next-Cursor"]}
+    )
+    second = response.json()
+
+    assert [first[0]["name"], second[0]["name"]] == [
+        image["name"]
+        for image in client.get("/images/", params={"q": params["q"]}).json()
+    ]
+
+def test_get_images_bad_cursor():
+    """Test that an invalid cursor, or a listing cursor on a search, is a 400."""
+
+    response = client.get("/images/", params={"limit": 1})
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get("/images/", params={"cursor": "nonsense"})
+    assert response.status_code == 400
+
+    response = client.get("/images/", params={"q": "a rose", "cursor": cursor})
+    assert response.status_code == 400
+
+def test_get_images_ndjson():
+    """Test streaming images as newline-delimited JSON."""
+
+    response = client.get("/images/", params={"format": "ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert sorted(line["name"] for line in lines) == sorted(TEST_IMAGES)
+
+    response = client.get("/images/", params={"format": "ndjson", "limit": 1})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert len(lines) == 2
+    assert "next_cursor" in lines[-1]
+
+def test_get_images_limit_clamped(monkeypatch):
+    """Test that the page size is capped at MAX_PAGE_SIZE."""
+
+    monkeypatch.setattr(main, "MAX_PAGE_SIZE", 1)
+
+    response = client.get("/images/", params={"limit": 50})
+
+    assert len(response.json()) == 1
+    assert "X-Next-Cursor" in response.headers
+
 def test_post_image_okay():
     """Test adding an image."""
 
@@ -184,8 +454,10 @@ def test_post_image_okay():
   
     assert response.status_code == 201
     assert data["name"] == image_name
+    content_hash = image_utils.content_hash(file)
     assert data["aws_image_src"] == (
-        f'https://{BUCKET_NAME}.s3.{REGION}.amazonaws.com/{image_name}'
+        f'https://{BUCKET_NAME}.s3.{REGION}.amazonaws.com/'
+        f'{image_utils.original_key(content_hash)}'
     )
     assert data["exif_data"] == {
             'ResolutionUnit': 2,
@@ -198,7 +470,22 @@ def test_post_image_okay():
             'YCbCrPositioning': 2, 
             'Copyright': '    ', 
             'XResolution': 96.0, 
-            'YResolution': 96.0
+            'YResolution': 96.0,
+            'DateTimeOriginal': '2006:08:17 09:24:48',
+            'FocalLength': 4.7,
+            'ExposureTime': 0.0125,
+            'FNumber': 2.9,
+            'ISOSpeedRatings': 100
+    }
+    keys = {
+        variant: variants.variant_key(
+            content_hash, variant, f"image/{image_format.lower()}"
+        )
+        for variant, (_, image_format) in variants.VARIANTS.items()
+    }
+    assert data["variants"] == {
+        variant: f'https://{BUCKET_NAME}.s3.{REGION}.amazonaws.com/{key}'
+        for variant, key in keys.items()
     }
 
     assert _is_valid_datetime_string(data["uploaded_at"])
@@ -208,6 +495,12 @@ def test_post_image_okay():
         headers={"Authorization": "Bearer " + ADMIN_PW}
     )
 
+    # The variants are deleted with the original
+    for key in [image_utils.original_key(content_hash), *keys.values()]:
+        with pytest.raises(Exception) as e_info:
+            main.bucket.get_file(key)
+        assert e_info.typename == "NoSuchKey"
+
 def test_post_dupe_image():
     """Test adding an image with an existing file name."""
 
@@ -231,6 +524,211 @@ def test_post_dupe_image():
     assert response.status_code == 400
     assert data == {"detail": "File name already taken"}
 
+def test_post_duplicate_image(monkeypatch):
+    """Test that re-uploading an image's content reuses its S3 object."""
+
+    with open("app/tests/images/Nikon_D70.jpg", "rb") as image:
+        file = image.read()
+
+    original = client.get("/images/nikon_test").json()
+
+    def no_upload(*args, **kwargs):
+        raise AssertionError("uploaded a duplicate")
+
+    monkeypatch.setattr(main.async_bucket, "upload_file", no_upload)
+    monkeypatch.setattr(clip, "get_image_embedding_async", no_upload)
+
+    response = client.post(
+        "/images/",
+        headers={"Authorization": "Bearer " + ADMIN_PW},
+        data={"image_name": "nikon_copy"},
+        files={"file": ("Nikon_D70.jpg", file)}
+    )
+    data = response.json()
+
+    assert response.status_code == 201
+    assert data["name"] == "nikon_copy"
+    assert data["aws_image_src"] == original["aws_image_src"]
+    assert data["variants"] == original["variants"]
+    assert data["exif_data"] == original["exif_data"]
+
+    client.delete(
+        "/images/nikon_copy",
+        headers={"Authorization": "Bearer " + ADMIN_PW}
+    )
+
+    # Still used by nikon_test
+    main.bucket.get_file(main.bucket.key(original["aws_image_src"]))
+
+def test_delete_shared_image():
+    """
+    Test that objects shared with a copy outlive the image they were
+    uploaded for, and that reusing its name doesn't touch them.
+    """
+
+    headers = {"Authorization": "Bearer " + ADMIN_PW}
+    files = {}
+    for fname in ("Fujifilm_FinePix_E500.jpg", "Pentax_K10D.jpg"):
+        with open(f"app/tests/images/{fname}", "rb") as image:
+            files[fname] = image.read()
+    fuji = files["Fujifilm_FinePix_E500.jpg"]
+
+    for name in ("fuji_test", "fuji_copy"):
+        response = client.post(
+            "/images/",
+            headers=headers,
+            data={"image_name": name},
+            files={"file": ("Fujifilm_FinePix_E500.jpg", fuji)}
+        )
+        assert response.status_code == 201
+    copy = response.json()
+    keys = [
+        main.bucket.key(url)
+        for url in [copy["aws_image_src"], *copy["variants"].values()]
+    ]
+
+    client.delete("/images/fuji_test", headers=headers)
+
+    # The name is free again, for other content
+    response = client.post(
+        "/images/",
+        headers=headers,
+        data={"image_name": "fuji_test"},
+        files={"file": ("Pentax_K10D.jpg", files["Pentax_K10D.jpg"])}
+    )
+    assert response.status_code == 201
+    client.delete("/images/fuji_test", headers=headers)
+
+    assert main.bucket.get_file(keys[0])["Body"].read() == fuji
+    for key in keys[1:]:
+        main.bucket.get_file(key)
+    # Still used by pentax_test
+    main.bucket.get_file(main.bucket.key(response.json()["aws_image_src"]))
+
+    client.delete("/images/fuji_copy", headers=headers)
+
+    for key in keys:
+        with pytest.raises(Exception) as e_info:
+            main.bucket.get_file(key)
+        assert e_info.typename == "NoSuchKey"
+
+def test_post_image_too_large(monkeypatch):
+    """Test that uploads over MAX_UPLOAD_BYTES are rejected."""
+
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 1024)
+
+    with open("app/tests/images/Fujifilm_FinePix_E500.jpg", "rb") as image:
+        file = image.read()
+
+    response = client.post(
+        "/images/",
+        headers={"Authorization": "Bearer " + ADMIN_PW},
+        data={"image_name": "fuji_test"},
+        files={"file": ("Fujifilm_FinePix_E500.jpg", file)}
+    )
+
+    assert response.status_code == 413
+    assert client.get("/images/fuji_test").status_code == 404
+
+def test_post_image_not_an_image():
+    """Test that uploads that can't be decoded are rejected."""
+
+    response = client.post(
+        "/images/",
+        headers={"Authorization": "Bearer " + ADMIN_PW},
+        data={"image_name": "not_an_image"},
+        files={"file": ("foo.jpg", b"foo")}
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Not a readable image"}
+    assert client.get("/images/not_an_image").status_code == 404
+
+def test_post_image_async():
+    """Test queueing an upload for a worker and polling its job."""
+
+    with open("app/tests/images/Fujifilm_FinePix_E500.jpg", "rb") as image:
+        file = image.read()
+
+    def post(image_name):
+        return client.post(
+            "/images/",
+            params={"mode": "async"},
+            headers={
+                "Authorization": "Bearer " + ADMIN_PW,
+                "Idempotency-Key": "fuji-upload"
+            },
+            data={"image_name": image_name},
+            files={"file": ("Fujifilm_FinePix_E500.jpg", file)}
+        )
+
+    response = post("fuji_async")
+    job = response.json()
+
+    assert response.status_code == 202
+    assert response.headers["Location"] == f"/jobs/{job['id']}"
+    assert job["image_name"] == "fuji_async"
+    assert job["status"] == "queued"
+
+    # Retried requests get the same job
+    assert post("fuji_async").json()["id"] == job["id"]
+    assert post("other_name").status_code == 409
+
+    # Until the job is done, the name is taken
+    response = client.post(
+        "/images/",
+        headers={"Authorization": "Bearer " + ADMIN_PW},
+        data={"image_name": "fuji_async"},
+        files={"file": ("Fujifilm_FinePix_E500.jpg", file)}
+    )
+    assert response.status_code == 400
+
+    with TestingSessionLocal() as db:
+        assert jobs.run_once(db, main.bucket) == 1
+
+    response = client.get(
+        f"/jobs/{job['id']}",
+        headers={"Authorization": "Bearer " + ADMIN_PW}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "succeeded"
+    assert client.get("/images/fuji_async").json()["exif_data"]["Make"] == (
+        "FUJIFILM"
+    )
+
+    client.delete(
+        "/images/fuji_async",
+        headers={"Authorization": "Bearer " + ADMIN_PW}
+    )
+
+def test_post_image_async_not_an_image():
+    """Test that uploads that aren't images aren't queued."""
+
+    response = client.post(
+        "/images/",
+        params={"mode": "async"},
+        headers={"Authorization": "Bearer " + ADMIN_PW},
+        data={"image_name": "not_an_image"},
+        files={"file": ("foo.jpg", b"foo")}
+    )
+
+    assert response.status_code == 400
+
+def test_get_job_not_found():
+    """Test getting a job that doesn't exist."""
+
+    response = client.get(
+        "/jobs/00000000-0000-0000-0000-000000000000",
+        headers={"Authorization": "Bearer " + ADMIN_PW}
+    )
+
+    assert response.status_code == 404
+    assert client.get(
+        "/jobs/00000000-0000-0000-0000-000000000000",
+        headers={"Authorization": "Bearer foo"}
+    ).status_code == 401
+
 def test_post_image_unauth():
     """Test adding an image with incorrect token."""
 
@@ -327,6 +825,254 @@ def test_delete_image_unauth():
     assert response.status_code == 401
     assert data == {"detail": "Unauthorized"}
 
+def test_bulk_upload_images():
+    """Test uploading several images at once."""
+
+    files = []
+    for fname in ["Fujifilm_FinePix_E500.jpg", "Nikon_D70.jpg"]:
+        with open(f"app/tests/images/{fname}", "rb") as image:
+            files.append(("files", (fname, image.read())))
+
+    response = client.post(
+        "/images/bulk",
+        headers={"Authorization": "Bearer " + ADMIN_PW},
+        files=files
+    )
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["created"] == 2
+    assert data["failed"] == 0
+    assert {item["name"] for item in data["items"]} == {
+        "Fujifilm_FinePix_E500", "Nikon_D70"
+    }
+
+    response = client.get("/images/Nikon_D70")
+    assert response.status_code == 200
+    assert response.json()["exif_data"]["Model"] == "NIKON D70"
+
+    for name in ["Fujifilm_FinePix_E500", "Nikon_D70"]:
+        client.delete(
+            f"/images/{name}",
+            headers={"Authorization": "Bearer " + ADMIN_PW}
+        )
+
+def test_bulk_upload_images_unauth():
+    """Test bulk uploading with the incorrect token"""
+
+    with open("app/tests/images/Nikon_D70.jpg", "rb") as image:
+        file = image.read()
+
+    response = client.post(
+        "/images/bulk",
+        headers={"Authorization": "Bearer foo"},
+        files=[("files", ("Nikon_D70.jpg", file))]
+    )
+
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Unauthorized"}
+
+def test_rebuild_vector_index_okay():
+    """Test rebuilding the vector index."""
+
+    response = client.post(
+        "/admin/vector-index/rebuild",
+        headers={"Authorization": "Bearer " + ADMIN_PW},
+    )
+
+    assert response.status_code == 202
+    assert response.json() == {"Message": "Rebuilding vector index."}
+
+def test_rebuild_vector_index_unauth():
+    """Test rebuilding the vector index with the incorrect token"""
+
+    response = client.post(
+        "/admin/vector-index/rebuild",
+        headers={"Authorization": "Bearer foo"},
+    )
+
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Unauthorized"}
+
+def test_get_image_etag():
+    """Test conditional GETs of an image."""
+
+    response = client.get("/images/nikon_test")
+    tag = response.headers["ETag"]
+
+    assert response.headers["Cache-Control"].startswith("public")
+
+    response = client.get(
+        "/images/nikon_test", headers={"If-None-Match": tag}
+    )
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == tag
+    assert not response.content
+
+    variants = {"thumb": main.bucket.url("variants/thumb/nikon_test")}
+    with TestingSessionLocal() as db:
+        crud.set_variants(db, "nikon_test", variants)
+
+    response = client.get(
+        "/images/nikon_test", headers={"If-None-Match": tag}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != tag
+    assert response.json()["variants"] == variants
+
+def test_get_images_etag(monkeypatch):
+    """Test that unchanged listings get a 304 without being queried."""
+
+    response = client.get("/images/", params={"limit": 1})
+    tag = response.headers["ETag"]
+    next_cursor = response.headers["X-Next-Cursor"]
+
+    monkeypatch.setattr(
+        crud, "get_images", lambda *args, **kwargs: pytest.fail("Queried")
+    )
+    response = client.get(
+        "/images/", params={"limit": 1}, headers={"If-None-Match": tag}
+    )
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == tag
+
+    # Other pages have their own ETags
+    monkeypatch.undo()
+    response = client.get(
+        "/images/",
+        params={"limit": 1, "cursor": next_cursor},
+        headers={"If-None-Match": tag}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != tag
+
+def test_get_metrics():
+    """Test the Prometheus metrics endpoint."""
+
+    client.get("/images/", params={"q": "a rose"})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE inference_batch_size histogram" in response.text
+    assert 'inference_queue_depth{batcher="text"}' in response.text
+    assert 'ingest_jobs{status="queued"}' in response.text
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/images/",'
+        'status="200"}'
+    ) in response.text
+    assert (
+        'operation_seconds_count{component="clip",'
+        'operation="get_text_embedding"}'
+    ) in response.text
+    assert 'db_pool_checked_out{engine="primary"}' in response.text
+
+def test_read_routes_use_read_db():
+    """Test that listing and getting images use read sessions."""
+
+    sessions = []
+
+    def override_get_read_db():
+        db = TestingSessionLocal()
+        sessions.append(db)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_read_db] = override_get_read_db
+    try:
+        assert client.get("/images/").status_code == 200
+        assert client.get("/images/nikon_test").status_code == 200
+    finally:
+        app.dependency_overrides[get_read_db] = override_get_db
+
+    assert len(sessions) == 2
+
+def test_server_timing(monkeypatch):
+    """Test that responses break down where their time went."""
+
+    monkeypatch.setattr(instrumentation, "SERVER_TIMING", True)
+
+    response = client.get("/images/nikon_test")
+
+    timing = response.headers["Server-Timing"]
+    assert "crud.get_image;dur=" in timing
+    assert timing.split(", ")[-1].startswith("total;dur=")
+
+    # Listing times running the query, not building it
+    response = client.get("/images/")
+    assert "crud.get_images;dur=" in response.headers["Server-Timing"]
+    assert not hasattr(crud.get_images, "instrumented")
+
+    response = client.get("/metrics")
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/images/{image_name}",status="200"}'
+    ) in response.text
+
+def test_profile_request():
+    """Test that admins can profile a request."""
+
+    response = client.get(
+        "/images/nikon_test",
+        headers={
+            "Authorization": "Bearer " + ADMIN_PW,
+            "X-Profile": "1"
+        }
+    )
+
+    assert response.status_code == 200
+    assert response.headers["X-Profiled-Status"] == "200"
+    assert "function calls" in response.text
+
+    # Anyone else gets the usual response
+    response = client.get(
+        "/images/nikon_test",
+        headers={"X-Profile": "1"}
+    )
+
+    assert "X-Profiled-Status" not in response.headers
+    assert response.json()["name"] == "nikon_test"
+
+def test_ready(monkeypatch):
+    """Test that readiness waits for the CLIP warm-up."""
+
+    monkeypatch.setattr(clip, "_ready", threading.Event())
+
+    response = client.get("/ready")
+
+    assert response.status_code == 503
+    assert response.json() == {"status": "warming up"}
+
+    clip.warm_up()
+    response = client.get("/ready")
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
+
+def test_post_image_wrong_role(monkeypatch):
+    """Test that a search-only server refuses to embed uploads."""
+
+    monkeypatch.setattr(clip, "CLIP_ROLE", "search")
+
+    with open("app/tests/images/Pentax_K10D.jpg", "rb") as file:
+        response = client.post(
+            "/images/",
+            headers={"Authorization": "Bearer " + ADMIN_PW},
+            data={"image_name": "role_test"},
+            files={
+                "file": ("Pentax_K10D.jpg", file)
+            }
+        )
+
+    assert response.status_code == 503
+
 def teardown():
     for name, fname in TEST_IMAGES.items():
         
@@ -344,4 +1090,4 @@ def _is_valid_datetime_string(date_string):
         return True
     except ValueError:
         # If parsing fails, it's not a valid datetime string
-        return False
\ No newline at end of file
+        return False
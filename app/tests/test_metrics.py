@@ -0,0 +1,44 @@
+import app.metrics as metrics
+
+
+def test_counter():
+    """Test incrementing a counter and rendering it."""
+
+    counter = metrics.counter("test_things_total", "Things counted")
+    counter.inc()
+    counter.inc(2)
+
+    assert counter.value == 3
+    assert "test_things_total 3\n" in metrics.render()
+
+def test_labelled_gauge_function():
+    """Test a labelled gauge computed at scrape time."""
+
+    gauge = metrics.gauge("test_depth", "Depth", ["queue"])
+    gauge.labels(queue="a").set_function(lambda: 7)
+
+    assert '# TYPE test_depth gauge' in metrics.render()
+    assert 'test_depth{queue="a"} 7\n' in metrics.render()
+
+def test_histogram():
+    """Test that histogram buckets are cumulative."""
+
+    histogram = metrics.histogram("test_seconds", "Seconds", buckets=(1, 5))
+    histogram.observe(0.5)
+    histogram.observe(3)
+    histogram.observe(10)
+
+    rendered = metrics.render()
+
+    assert 'test_seconds_bucket{le="1"} 1\n' in rendered
+    assert 'test_seconds_bucket{le="5"} 2\n' in rendered
+    assert 'test_seconds_bucket{le="+Inf"} 3\n' in rendered
+    assert 'test_seconds_sum 13.5\n' in rendered
+    assert 'test_seconds_count 3\n' in rendered
+
+def test_register_returns_existing():
+    """Test that registering the same name twice returns one metric."""
+
+    assert metrics.counter("test_dupe_total", "a") is metrics.counter(
+        "test_dupe_total", "a"
+    )
@@ -0,0 +1,54 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import app.pagination as pagination
+
+
+def test_recent_cursor_round_trip():
+    """Test that a recency cursor decodes to the last image's sort key."""
+
+    image = SimpleNamespace(
+        name="test1", uploaded_at=datetime(2024, 1, 2, 3, 4, 5, 678)
+    )
+
+    cursor = pagination.next_cursor(image, 10, 10)
+
+    assert pagination.decode_cursor(cursor) == {
+        "t": image.uploaded_at, "n": "test1"
+    }
+
+def test_search_cursor_round_trip():
+    """Test that a search cursor carries the score, name and depth."""
+
+    image = SimpleNamespace(name="test1", score=0.123456789)
+
+    cursor = pagination.next_cursor(image, 10, 10, search=True)
+    key = pagination.decode_cursor(cursor, search=True)
+
+    assert key == {"s": 0.123456789, "n": "test1", "d": 10}
+
+    cursor = pagination.next_cursor(image, 10, 10, search=True, cursor=key)
+
+    assert pagination.decode_cursor(cursor, search=True)["d"] == 20
+
+def test_no_cursor_after_last_page():
+    """Test that a short or empty page has no next cursor."""
+
+    image = SimpleNamespace(name="test1", score=0.5)
+
+    assert pagination.next_cursor(image, 9, 10, search=True) is None
+    assert pagination.next_cursor(None, 0, 10) is None
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    pagination.encode_cursor({"s": 0.5, "n": "test1", "d": 1}),
+    pagination.encode_cursor({"t": "yesterday", "n": "test1"}),
+    pagination.encode_cursor(["t", "n"]),
+])
+def test_decode_invalid_cursor(cursor):
+    """Test that malformed cursors and search cursors are rejected."""
+
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(cursor)
@@ -0,0 +1,146 @@
+import os
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, Session
+
+import app.crud as crud
+import app.image_utils as image_utils
+import app.variants as variants
+from app.bucket import Bucket
+from app.clip import EMBEDDING_SIZE
+from app.database import Base
+from app.models import Image as ImageModel
+
+# Env var overridden in pytest.ini
+SQLALCHEMY_TEST_DATABASE_URI = os.environ['SQLALCHEMY_DATABASE_URI']
+
+engine = create_engine(SQLALCHEMY_TEST_DATABASE_URI)
+
+TestingSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=engine
+)
+
+TEST_VARIANTS = {"medium": (1024, "WEBP"), "thumb": (64, "JPEG")}
+
+
+def test_parse_variants():
+    """Test parsing IMAGE_VARIANTS, largest first."""
+
+    assert variants.parse_variants("thumb:256:webp, medium:1024:jpeg,") == {
+        "medium": (1024, "JPEG"),
+        "thumb": (256, "WEBP"),
+    }
+
+    with pytest.raises(ValueError):
+        variants.parse_variants("thumb:256")
+
+    with pytest.raises(ValueError):
+        variants.parse_variants("thumb:256:nope")
+
+def test_make_variants():
+    """Test resizing an image into each variant's size and format."""
+
+    with open("app/tests/images/Pentax_K10D.jpg", "rb") as image:
+        original = Image.open(BytesIO(image.read()))
+        original.load()
+
+    made = variants.make_variants(original, TEST_VARIANTS)
+
+    assert set(made) == {"medium", "thumb"}
+
+    medium = Image.open(BytesIO(made["medium"][0]))
+    assert made["medium"][1] == "image/webp"
+    assert medium.format == "WEBP"
+    # Never upscaled
+    assert max(medium.size) == min(1024, max(original.size))
+
+    thumb = Image.open(BytesIO(made["thumb"][0]))
+    assert made["thumb"][1] == "image/jpeg"
+    assert max(thumb.size) == 64
+    assert thumb.size[0] / thumb.size[1] == pytest.approx(
+        original.size[0] / original.size[1], rel=0.05
+    )
+
+def test_make_variants_upright():
+    """Test that variants are rotated by the EXIF orientation."""
+
+    image = Image.new("RGB", (200, 100))
+    exif = image.getexif()
+    exif[0x0112] = 6 # Rotated 90 degrees
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", exif=exif)
+
+    made = variants.make_variants(buffer.getvalue(), {"thumb": (64, "JPEG")})
+
+    assert Image.open(BytesIO(made["thumb"][0])).size == (32, 64)
+
+
+class TestBackfill:
+    """Tests for backfilling variants of existing images."""
+
+    @pytest.fixture
+    def session(self, monkeypatch):
+        monkeypatch.setattr(variants, "VARIANTS", TEST_VARIANTS)
+        Base.metadata.create_all(bind=engine)
+        session = TestingSessionLocal()
+        self.bucket = Bucket()
+
+        for name, fname in (
+                ("fuji", "Fujifilm_FinePix_E500.jpg"),
+                ("nikon", "Nikon_D70.jpg")):
+            with open(f"app/tests/images/{fname}", "rb") as image:
+                src = self.bucket.upload_file(image.read(), name)
+            session.add(ImageModel(
+                name=name,
+                aws_image_src=src,
+                exif_data={},
+                embedding=np.random.random(EMBEDDING_SIZE).tolist()
+            ))
+        session.commit()
+
+        yield session
+
+        session.rollback()
+        for image in session.query(ImageModel):
+            self.bucket.delete_file(image.name)
+            for url in (image.variants or {}).values():
+                self.bucket.delete_file(self.bucket.key(url))
+
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def test_backfill(self, session: Session):
+        """Test that images without variants get them."""
+
+        crud.set_variants(session, "fuji", {"medium": "https://medium"})
+
+        assert variants.backfill(session, self.bucket, batch_size=1) == (2, 0)
+
+        for name in ("fuji", "nikon"):
+            image = crud.get_image(session, name)
+            assert set(image.variants) == {"medium", "thumb"}
+            # Stored under the content hash of the original
+            original = self.bucket.get_file(name)["Body"].read()
+            key = variants.variant_key(
+                image_utils.content_hash(original), "thumb", "image/jpeg"
+            )
+            assert image.variants["thumb"] == self.bucket.url(key)
+            assert self.bucket.get_file(key)["ContentType"] == "image/jpeg"
+
+        # Nothing left to do, unless forced
+        assert variants.backfill(session, self.bucket) == (0, 0)
+        assert variants.backfill(session, self.bucket, force=True) == (2, 0)
+
+    def test_backfill_failure(self, session: Session):
+        """Test that an image whose original is missing is reported."""
+
+        self.bucket.delete_file("nikon")
+
+        assert variants.backfill(session, self.bucket) == (1, 1)
+        assert crud.get_image(session, "nikon").variants is None
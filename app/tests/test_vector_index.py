@@ -0,0 +1,171 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import app.vector_index as vector_index
+from app.database import Base
+import app.models
+
+# Env var overridden in pytest.ini
+SQLALCHEMY_TEST_DATABASE_URI = os.environ['SQLALCHEMY_DATABASE_URI']
+
+engine = create_engine(SQLALCHEMY_TEST_DATABASE_URI)
+
+TestingSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=engine
+)
+
+
+def _pgvector_version():
+    with engine.connect() as conn:
+        version = conn.execute(text(
+            "SELECT extversion FROM pg_extension WHERE extname = 'vector'"
+        )).scalar()
+
+    return tuple(int(part) for part in version.split("."))
+
+def _get_column_type(column):
+    with engine.connect() as conn:
+        return conn.execute(
+            text(
+                "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+                "WHERE attrelid = 'images'::regclass AND attname = :column "
+                "AND NOT attisdropped"
+            ),
+            {"column": column}
+        ).scalar()
+
+def _get_index_def():
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT indexdef FROM pg_indexes WHERE indexname = :name"),
+            {"name": vector_index.INDEX_NAME}
+        ).scalar()
+
+
+class TestVectorIndex:
+    """Tests for managing the embedding ANN index."""
+
+    @pytest.fixture(autouse=True)
+    def tables(self):
+        Base.metadata.create_all(bind=engine)
+        yield
+        Base.metadata.drop_all(bind=engine)
+
+    def test_index_created_with_table(self):
+        """Test that creating the tables creates the configured index."""
+
+        index_def = _get_index_def()
+
+        column, ops = vector_index.indexed_column()
+
+        assert f"USING {vector_index.VECTOR_INDEX_TYPE}" in index_def
+        assert f"({column} {ops})" in index_def
+
+    def test_create_index_idempotent(self):
+        """Test that creating an existing index is a no-op."""
+
+        vector_index.create_index(engine)
+
+        assert _get_index_def() is not None
+
+    def test_rebuild_index(self):
+        """Test rebuilding the index swaps in a fresh one with the same name."""
+
+        vector_index.rebuild_index(engine)
+
+        assert f"USING {vector_index.VECTOR_INDEX_TYPE}" in _get_index_def()
+
+        with engine.connect() as conn:
+            leftover = conn.execute(
+                text("SELECT count(*) FROM pg_indexes WHERE indexname = :n"),
+                {"n": f"{vector_index.INDEX_NAME}_new"}
+            ).scalar()
+
+        assert leftover == 0
+
+    def test_set_search_params(self):
+        """Test that search params apply to the current transaction only."""
+
+        session = TestingSessionLocal()
+
+        vector_index.set_search_params(session, ef_search=123, probes=7)
+
+        if vector_index.VECTOR_INDEX_TYPE == "hnsw":
+            setting, expected = "hnsw.ef_search", "123"
+        else:
+            setting, expected = "ivfflat.probes", "7"
+
+        assert session.execute(
+            text("SELECT current_setting(:s)"), {"s": setting}
+        ).scalar() == expected
+
+        session.rollback()
+
+        assert session.execute(
+            text("SELECT current_setting(:s)"), {"s": setting}
+        ).scalar() != expected
+
+        session.close()
+
+    def test_migrate_unchanged(self):
+        """Test that migrating to the current configuration keeps the data."""
+
+        size = app.models.EMBEDDING_SIZE
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO images (name, aws_image_src, embedding, "
+                    "uploaded_at) VALUES ('a', '', :embedding, now())"
+                ),
+                {"embedding": str([1.0] * size)}
+            )
+
+        vector_index.migrate(engine)
+
+        assert _get_column_type("embedding") == (
+            f"{vector_index.EMBEDDING_TYPE}({size})"
+        )
+        assert _get_index_def() is not None
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM images")).scalar() == 1
+
+    @pytest.mark.skipif(
+        _pgvector_version() < (0, 7),
+        reason="halfvec and binary_quantize need pgvector >= 0.7"
+    )
+    def test_migrate(self, monkeypatch):
+        """Test converting the embeddings and adding the binary column."""
+
+        size = app.models.EMBEDDING_SIZE
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO images (name, aws_image_src, embedding, "
+                    "uploaded_at) VALUES ('a', '', :embedding, now())"
+                ),
+                {"embedding": str([1.0, -1.0] * (size // 2))}
+            )
+
+        monkeypatch.setattr(vector_index, "EMBEDDING_TYPE", "halfvec")
+        monkeypatch.setattr(vector_index, "BINARY_QUANTIZATION", True)
+        vector_index.migrate(engine)
+
+        assert _get_column_type("embedding") == f"halfvec({size})"
+        assert "(embedding_bits bit_hamming_ops)" in _get_index_def()
+        with engine.connect() as conn:
+            assert conn.execute(
+                text("SELECT embedding_bits::text FROM images")
+            ).scalar() == "10" * (size // 2)
+
+        monkeypatch.setattr(vector_index, "EMBEDDING_TYPE", "vector")
+        monkeypatch.setattr(vector_index, "BINARY_QUANTIZATION", False)
+        vector_index.migrate(engine)
+
+        assert _get_column_type("embedding") == f"vector({size})"
+        assert _get_column_type("embedding_bits") is None
+        assert "(embedding vector_ip_ops)" in _get_index_def()
@@ -0,0 +1,165 @@
+import numpy as np
+import pytest
+
+import app.vector_store as vector_store
+from app.vector_store import VectorStore
+
+DIM = 8
+
+
+def _unit_vectors(n, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, DIM))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class TestVectorStore:
+    """Tests for the memory-mapped vector store."""
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        store = VectorStore(str(tmp_path), DIM)
+        self.vectors = _unit_vectors(20)
+
+        for i, vector in enumerate(self.vectors):
+            store.append(f"image{i}", vector)
+
+        return store
+
+    def test_search_matches_brute_force(self, store: VectorStore):
+        """Test that search ranks rows by inner product."""
+
+        query = _unit_vectors(1, seed=1)[0]
+        expected = np.argsort(-(self.vectors @ query))[:5]
+
+        results = store.search(query, 5)
+
+        assert [name for name, _ in results] == [f"image{i}" for i in expected]
+        assert np.allclose(
+            [score for _, score in results],
+            (self.vectors @ query)[expected],
+            atol=1e-6
+        )
+
+    def test_search_limit_larger_than_store(self, store: VectorStore):
+        """Test asking for more results than there are rows."""
+
+        assert len(store.search(self.vectors[0], 100)) == 20
+
+    def test_search_score_filter(self, store: VectorStore):
+        """Test that the score filter drops rows before ranking."""
+
+        results = store.search(
+            self.vectors[0], 20, score_filter=lambda scores: scores > 0.5
+        )
+
+        assert results[0][0] == "image0"
+        assert all(score > 0.5 for _, score in results)
+
+    def test_search_many(self, store: VectorStore):
+        """Test that searching several embeddings at once matches search."""
+
+        queries = _unit_vectors(3, seed=2)
+
+        results = store.search_many(
+            queries, [5, 1, 3], [None, None, lambda scores: scores > 0]
+        )
+
+        expected = [
+            store.search(queries[0], 5),
+            store.search(queries[1], 1),
+            store.search(queries[2], 3, score_filter=lambda s: s > 0),
+        ]
+
+        for result, single in zip(results, expected):
+            assert [name for name, _ in result] == [name for name, _ in single]
+            assert np.allclose(
+                [score for _, score in result],
+                [score for _, score in single],
+                atol=1e-6
+            )
+
+    def test_delete_tombstones_row(self, store: VectorStore):
+        """Test that deleted images are no longer returned."""
+
+        store.delete("image3")
+
+        assert len(store) == 19
+        assert "image3" not in [
+            name for name, _ in store.search(self.vectors[3], 20)
+        ]
+
+    def test_append_many(self, store: VectorStore, monkeypatch):
+        """Test adding several rows with one manifest write."""
+
+        writes = []
+        write_manifest = store._write_manifest
+        monkeypatch.setattr(
+            store, "_write_manifest",
+            lambda manifest: writes.append(manifest) or write_manifest(manifest)
+        )
+
+        store.append_many(
+            [(f"new{i}", -vector) for i, vector in enumerate(self.vectors[:3])]
+        )
+        store.append_many([])
+
+        assert len(writes) == 1
+        assert len(store) == 23
+        for i in range(3):
+            assert store.search(-self.vectors[i], 1)[0][0] == f"new{i}"
+
+    def test_compaction(self, store: VectorStore, monkeypatch):
+        """Test that compaction drops tombstoned rows and keeps the rest."""
+
+        monkeypatch.setattr(vector_store, "VECTOR_STORE_COMPACT_RATIO", 0.1)
+
+        store.delete("image1")
+        assert store._read_manifest()["generation"] == 0
+
+        store.delete("image2")
+        manifest = store._read_manifest()
+
+        assert manifest["generation"] == 1
+        assert manifest["rows"] == 18
+        assert manifest["deleted"] == 0
+        assert store.search(self.vectors[5], 1)[0][0] == "image5"
+
+    def test_other_process_sees_writes(self, store: VectorStore, tmp_path):
+        """Test that a second handle on the same files sees every change."""
+
+        other = VectorStore(str(tmp_path), DIM)
+        assert len(other) == 20
+
+        store.append("new", self.vectors[0])
+        store.delete("image0")
+        assert other.search(self.vectors[0], 1)[0][0] == "new"
+
+        store.compact()
+        assert len(other) == 20
+        assert other.search(self.vectors[0], 1)[0][0] == "new"
+
+    def test_rebuild(self, store: VectorStore):
+        """Test replacing the contents of the store."""
+
+        store.rebuild([("only", self.vectors[4])])
+
+        assert len(store) == 1
+        assert store.search(self.vectors[0], 5)[0][0] == "only"
+
+    def test_float16(self, tmp_path):
+        """Test storing half precision vectors."""
+
+        store = VectorStore(str(tmp_path), DIM, dtype="float16")
+        vectors = _unit_vectors(5)
+        for i, vector in enumerate(vectors):
+            store.append(f"image{i}", vector)
+
+        name, score = store.search(vectors[2], 1)[0]
+
+        assert name == "image2"
+        assert np.isclose(score, 1, atol=1e-2)
+
+    def test_empty_store(self, tmp_path):
+        """Test searching a store with no rows."""
+
+        assert VectorStore(str(tmp_path), DIM).search(np.ones(DIM), 5) == []
@@ -0,0 +1,189 @@
+import os
+import sys
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+import app.crud as crud
+import app.image_utils as image_utils
+
+load_dotenv()
+
+# Resized copies stored next to each original, as name:max_px:format
+# entries. AVIF needs a Pillow build (or plugin) that can write it.
+IMAGE_VARIANTS = os.environ.get(
+    "IMAGE_VARIANTS", "thumb:256:webp,medium:1024:webp"
+)
+VARIANT_QUALITY = int(os.environ.get("VARIANT_QUALITY", 80))
+VARIANT_BACKFILL_WORKERS = int(
+    os.environ.get("VARIANT_BACKFILL_WORKERS", os.cpu_count() or 4)
+)
+VARIANT_BACKFILL_BATCH_SIZE = int(
+    os.environ.get("VARIANT_BACKFILL_BATCH_SIZE", 32)
+)
+
+KEY_PREFIX = "variants"
+
+
+def parse_variants(spec):
+    """
+    Parse an IMAGE_VARIANTS spec into { name: (max_px, format) }, largest
+    first.
+    """
+
+    Image.init()
+
+    variants = {}
+    for entry in filter(None, (entry.strip() for entry in spec.split(","))):
+        try:
+            name, size, image_format = entry.split(":")
+            size = int(size)
+        except ValueError:
+            raise ValueError(
+                f"IMAGE_VARIANTS entries must be name:max_px:format, "
+                f"got {entry!r}"
+            )
+
+        image_format = image_format.upper()
+        if image_format not in Image.SAVE:
+            raise ValueError(f"Pillow can't write {image_format} images")
+
+        variants[name] = (size, image_format)
+
+    return dict(
+        sorted(variants.items(), key=lambda item: item[1][0], reverse=True)
+    )
+
+VARIANTS = parse_variants(IMAGE_VARIANTS)
+
+
+def max_size(variants=None):
+    """Longest side of the largest variant, or 0 if there are none."""
+
+    variants = VARIANTS if variants is None else variants
+    return max((size for size, _ in variants.values()), default=0)
+
+def variant_key(content_hash, variant, content_type):
+    """
+    S3 key of one variant of the original with content_hash. Like the
+    originals' keys, content addressed, with the format as extension.
+    """
+
+    extension = content_type.partition("/")[2]
+    return f"{KEY_PREFIX}/{variant}/{content_hash}.{extension}"
+
+def make_variants(image, variants=None):
+    """
+    Takes JPG bytes, a file-like object or a decoded PIL image, e.g. the one
+    EXIF was scraped from. Returns { variant: (bytes, content_type) }.
+
+    Variants are upright, never upscaled, and each is resized from the next
+    larger one rather than from the original.
+    """
+
+    variants = VARIANTS if variants is None else variants
+    if not variants:
+        return {}
+
+    # A JPEG that isn't decoded yet is decoded only as large as needed
+    source = ImageOps.exif_transpose(
+        image_utils.load_reduced(image, 0, max_size(variants))
+    )
+    if source.mode not in ("RGB", "RGBA"):
+        source = source.convert("RGBA" if "A" in source.getbands() else "RGB")
+
+    results = {}
+    for name, (size, image_format) in variants.items():
+        resized = source.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        source = resized
+
+        if image_format == "JPEG" and resized.mode == "RGBA":
+            resized = resized.convert("RGB")
+
+        buffer = BytesIO()
+        resized.save(buffer, image_format, quality=VARIANT_QUALITY)
+        results[name] = (buffer.getvalue(), Image.MIME[image_format])
+
+    return results
+
+def upload_variants(bucket, content_hash, variants):
+    """
+    Upload the output of make_variants for the original with content_hash.
+    Returns { variant: url }, or raises RuntimeError if any upload failed.
+    """
+
+    urls = {}
+    for variant, (data, content_type) in variants.items():
+        url = bucket.upload_file(
+            data, variant_key(content_hash, variant, content_type),
+            content_type
+        )
+        if url is None:
+            raise RuntimeError(f"S3 upload of {variant} variant failed")
+        urls[variant] = url
+
+    return urls
+
+def backfill(db, bucket, force=False, batch_size=VARIANT_BACKFILL_BATCH_SIZE):
+    """
+    Generate variants for images that don't have every configured one, or
+    for all images if force. Originals are read back from S3, and images
+    are processed in batches on a pool of VARIANT_BACKFILL_WORKERS threads.
+    Returns (updated, failed) counts.
+    """
+
+    updated, failed, after = 0, 0, None
+
+    with ThreadPoolExecutor(VARIANT_BACKFILL_WORKERS) as pool:
+        while images := crud.get_images_missing_variants(
+                db, list(VARIANTS), after=after, limit=batch_size,
+                force=force):
+            after = images[-1][0]
+
+            for (name, _), result in zip(
+                    images,
+                    pool.map(lambda image: _backfill_one(bucket, *image),
+                             images)):
+                if isinstance(result, Exception):
+                    logging.error(f"Failed to make variants of {name}: {result}")
+                    failed += 1
+                else:
+                    crud.set_variants(db, name, result)
+                    updated += 1
+
+    return updated, failed
+
+def _backfill_one(bucket, image_name, aws_image_src):
+    try:
+        # Duplicates share the original of the first image uploaded
+        original = bucket.get_file(bucket.key(aws_image_src))["Body"].read()
+        return upload_variants(
+            bucket, image_utils.content_hash(original), make_variants(original)
+        )
+    except Exception as e:
+        return e
+
+def main(argv):
+    """CLI: python -m app.variants backfill [--force]"""
+
+    if not argv or argv[0] != "backfill" or set(argv[1:]) - {"--force"}:
+        print("usage: python -m app.variants backfill [--force]")
+        return 1
+
+    from app.database import SessionLocal
+    from app.bucket import Bucket
+
+    with SessionLocal() as db:
+        updated, failed = backfill(db, Bucket(), force="--force" in argv)
+
+    print(f"Made variants of {updated} images, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
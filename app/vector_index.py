@@ -0,0 +1,258 @@
+import os
+import sys
+import logging
+
+from dotenv import load_dotenv
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Index, cast, func, text
+
+from app.config import EMBEDDING_SIZE, EMBEDDING_TYPE
+
+load_dotenv()
+
+# "hnsw", "ivfflat" or "none" for exact search only
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "hnsw").lower()
+
+# Build parameters
+HNSW_M = int(os.environ.get("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 64))
+IVFFLAT_LISTS = int(os.environ.get("IVFFLAT_LISTS", 100))
+
+# Query parameters
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 40))
+IVFFLAT_PROBES = int(os.environ.get("IVFFLAT_PROBES", 1))
+# pgvector's upper bound for hnsw.ef_search
+MAX_EF_SEARCH = 1000
+# "off", "strict_order" or "relaxed_order". Lets filtered HNSW scans keep
+# going past ef_search until enough rows pass the filter. Needs
+# pgvector >= 0.8; relaxed_order can misorder results across pages.
+HNSW_ITERATIVE_SCAN = os.environ.get("HNSW_ITERATIVE_SCAN", "off").lower()
+
+# Build the index on a binary-quantized copy of each embedding, one bit per
+# dimension, instead of on the embeddings. Searches take RERANK_CANDIDATES
+# candidates by Hamming distance off it and re-rank them exactly on the
+# full embeddings. Needs pgvector >= 0.7.
+BINARY_QUANTIZATION = (
+    os.environ.get("BINARY_QUANTIZATION", "false").lower() == "true"
+)
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", 400))
+
+INDEX_TYPES = ("hnsw", "ivfflat", "none")
+EMBEDDING_TYPES = ("vector", "halfvec")
+TABLE_NAME = "images"
+COLUMN_NAME = "embedding"
+INDEX_NAME = "images_embedding_idx"
+BITS_COLUMN_NAME = "embedding_bits"
+# Generates embedding_bits
+BITS_EXPRESSION = f"binary_quantize({COLUMN_NAME})::bit({EMBEDDING_SIZE})"
+
+if VECTOR_INDEX_TYPE not in INDEX_TYPES:
+    raise ValueError(
+        f"VECTOR_INDEX_TYPE must be one of {INDEX_TYPES}, "
+        f"got {VECTOR_INDEX_TYPE!r}"
+    )
+
+if EMBEDDING_TYPE not in EMBEDDING_TYPES:
+    raise ValueError(
+        f"EMBEDDING_TYPE must be one of {EMBEDDING_TYPES}, "
+        f"got {EMBEDDING_TYPE!r}"
+    )
+
+
+def build_params(index_type=VECTOR_INDEX_TYPE):
+    """Return the WITH (...) storage parameters for an index type."""
+
+    if index_type == "hnsw":
+        return {"m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}
+    if index_type == "ivfflat":
+        return {"lists": IVFFLAT_LISTS}
+    return {}
+
+def indexed_column():
+    """
+    (column, operator class) the index is built on. Inner product ops match
+    crud's max_inner_product ordering.
+    """
+
+    if BINARY_QUANTIZATION:
+        return BITS_COLUMN_NAME, "bit_hamming_ops"
+
+    return COLUMN_NAME, f"{EMBEDDING_TYPE}_ip_ops"
+
+def embedding_indexes(index_type=VECTOR_INDEX_TYPE):
+    """
+    Return the approximate nearest neighbour indexes to declare on the
+    images table.
+    """
+
+    if index_type == "none":
+        return []
+
+    column, ops = indexed_column()
+
+    return [
+        Index(
+            INDEX_NAME,
+            column,
+            postgresql_using=index_type,
+            postgresql_with=build_params(index_type),
+            postgresql_ops={column: ops}
+        )
+    ]
+
+def quantize(embedding):
+    """SQL expression binary-quantizing a query embedding like BITS_EXPRESSION."""
+
+    return func.binary_quantize(cast(embedding, Vector(EMBEDDING_SIZE)))
+
+def set_search_params(
+        db, ef_search=None, probes=None, min_results=0, filtered=False):
+    """
+    Set ANN query parameters for the rest of the current transaction.
+    Higher values give better recall at the cost of latency.
+    An HNSW scan returns at most ef_search rows, so it's raised to
+    min_results when a query needs to reach that deep. filtered turns on
+    HNSW_ITERATIVE_SCAN, if configured.
+    """
+
+    if VECTOR_INDEX_TYPE == "hnsw":
+        _set_local(
+            db,
+            "hnsw.ef_search",
+            int(min(max(ef_search or HNSW_EF_SEARCH, min_results),
+                    MAX_EF_SEARCH))
+        )
+        if filtered and HNSW_ITERATIVE_SCAN != "off":
+            _set_local(db, "hnsw.iterative_scan", HNSW_ITERATIVE_SCAN)
+    elif VECTOR_INDEX_TYPE == "ivfflat":
+        _set_local(db, "ivfflat.probes", int(probes or IVFFLAT_PROBES))
+
+def _set_local(db, setting, value):
+    db.execute(
+        text("SELECT set_config(:setting, :value, true)"),
+        {"setting": setting, "value": str(value)}
+    )
+
+def _create_sql(index_name, index_type=VECTOR_INDEX_TYPE):
+    params = ", ".join(
+        f"{key} = {int(value)}"
+        for key, value in build_params(index_type).items()
+    )
+    column, ops = indexed_column()
+
+    return (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} "
+        f"ON {TABLE_NAME} USING {index_type} ({column} {ops}) "
+        f"WITH ({params})"
+    )
+
+def create_index(engine):
+    """Create the configured index if it doesn't exist, without locking writes."""
+
+    if VECTOR_INDEX_TYPE == "none":
+        return
+
+    with engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(_create_sql(INDEX_NAME)))
+
+def rebuild_index(engine):
+    """
+    Rebuild the embedding index with the current build parameters.
+    The new index is built concurrently next to the old one and swapped in,
+    so searches and uploads keep working while it builds.
+    """
+
+    new_index_name = f"{INDEX_NAME}_new"
+
+    with engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT") as conn:
+
+        # Clear out a half-built index from an interrupted rebuild
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {new_index_name}"))
+
+        if VECTOR_INDEX_TYPE != "none":
+            conn.execute(text(_create_sql(new_index_name)))
+
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}"))
+
+        if VECTOR_INDEX_TYPE != "none":
+            conn.execute(
+                text(f"ALTER INDEX {new_index_name} RENAME TO {INDEX_NAME}")
+            )
+
+    logging.info(f"Rebuilt {INDEX_NAME} as {VECTOR_INDEX_TYPE}")
+
+def migrate(engine):
+    """
+    Bring an existing images table in line with EMBEDDING_TYPE and
+    BINARY_QUANTIZATION: convert the embeddings, add or drop embedding_bits,
+    then rebuild the index. Converting the embeddings and adding
+    embedding_bits rewrite the table, locking it while they do.
+    """
+
+    column_type = f"{EMBEDDING_TYPE}({EMBEDDING_SIZE})"
+
+    with engine.begin() as conn:
+        current_type = conn.execute(
+            text(
+                "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+                "WHERE attrelid = CAST(:table AS regclass) "
+                "AND attname = :column"
+            ),
+            {"table": TABLE_NAME, "column": COLUMN_NAME}
+        ).scalar()
+
+        if current_type != column_type:
+            # Both depend on the embeddings' type
+            conn.execute(text(
+                f"ALTER TABLE {TABLE_NAME} "
+                f"DROP COLUMN IF EXISTS {BITS_COLUMN_NAME}"
+            ))
+            conn.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+            conn.execute(text(
+                f"ALTER TABLE {TABLE_NAME} ALTER COLUMN {COLUMN_NAME} "
+                f"TYPE {column_type} USING {COLUMN_NAME}::{column_type}"
+            ))
+
+        if BINARY_QUANTIZATION:
+            conn.execute(text(
+                f"ALTER TABLE {TABLE_NAME} ADD COLUMN IF NOT EXISTS "
+                f"{BITS_COLUMN_NAME} bit({EMBEDDING_SIZE}) "
+                f"GENERATED ALWAYS AS ({BITS_EXPRESSION}) STORED"
+            ))
+        else:
+            conn.execute(text(
+                f"ALTER TABLE {TABLE_NAME} "
+                f"DROP COLUMN IF EXISTS {BITS_COLUMN_NAME}"
+            ))
+
+    rebuild_index(engine)
+
+    logging.info(
+        f"Migrated {TABLE_NAME}.{COLUMN_NAME} to {column_type}, "
+        f"binary quantization {'on' if BINARY_QUANTIZATION else 'off'}"
+    )
+
+def main(argv):
+    """CLI: python -m app.vector_index [create|rebuild|migrate]"""
+
+    from app.database import engine
+
+    commands = {
+        "create": create_index,
+        "rebuild": rebuild_index,
+        "migrate": migrate,
+    }
+
+    if len(argv) != 1 or argv[0] not in commands:
+        print("usage: python -m app.vector_index [create|rebuild|migrate]")
+        return 1
+
+    commands[argv[0]](engine)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,448 @@
+import os
+import sys
+import json
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from itertools import islice
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+import app.metrics as metrics
+from app.config import EMBEDDING_SIZE
+from app.models import Image
+
+load_dotenv()
+
+# "postgres" searches with pgvector, "mmap" with the in-process store below
+VECTOR_SEARCH_BACKEND = os.environ.get("VECTOR_SEARCH_BACKEND", "postgres")
+VECTOR_STORE_DIR = os.environ.get("VECTOR_STORE_DIR", "vector_store")
+VECTOR_STORE_DTYPE = os.environ.get("VECTOR_STORE_DTYPE", "float32")
+# Compact once this fraction of rows are tombstoned
+VECTOR_STORE_COMPACT_RATIO = float(
+    os.environ.get("VECTOR_STORE_COMPACT_RATIO", 0.25)
+)
+
+# Image.name is String(50); utf-8 needs at most 4 bytes per character
+NAME_DTYPE = np.dtype("S200")
+# Rows scored per matmul, bounding the float32 upcast of float16 storage
+SEARCH_CHUNK_ROWS = 65536
+
+STORE_ROWS = metrics.gauge(
+    "vector_store_rows",
+    "Rows in the memory-mapped vector store, including tombstoned ones"
+)
+STORE_DELETED = metrics.gauge(
+    "vector_store_tombstones",
+    "Tombstoned rows waiting for compaction"
+)
+SEARCH_SECONDS = metrics.histogram(
+    "vector_store_search_seconds",
+    "Time taken to score and rank the memory-mapped vector store"
+)
+
+
+class VectorStore:
+    """
+    Image embeddings kept in a contiguous matrix memory-mapped from disk.
+
+    Each generation of the store is three fixed-width row files: the
+    vectors, the image names and a one byte tombstone flag per row.
+    Writers append rows and flip tombstones in place under an exclusive
+    file lock, then atomically replace manifest.json. Readers in any
+    process map the files read-only and remap when the manifest changes,
+    so uvicorn workers share one copy of the matrix through the page cache.
+    Compaction writes a new generation without the tombstoned rows.
+
+    Postgres stays the system of record; the store can always be rebuilt
+    from the images table.
+    """
+
+    def __init__(self, path, dim, dtype="float32"):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = self.dim * self.dtype.itemsize
+
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Held open so its inode can't be reused by a later manifest
+        self._manifest_file = None
+        self._manifest = None
+        # (vectors, names, deleted) arrays, swapped as one on remap
+        self._view = None
+
+        with self._write_lock():
+            if self._read_manifest() is None:
+                self._write_generation(0, [])
+
+    # Files
+
+    def _file(self, kind, generation):
+        return os.path.join(self.path, f"{kind}.{generation}.bin")
+
+    def _manifest_path(self):
+        return os.path.join(self.path, "manifest.json")
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, manifest):
+        tmp_path = self._manifest_path() + ".tmp"
+
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self._manifest_path())
+
+    @contextmanager
+    def _write_lock(self):
+        """Exclusive lock shared by every process writing to the store."""
+
+        with open(os.path.join(self.path, "lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_generation(self, generation, chunks):
+        """
+        Write a complete generation of files from (names, vectors) chunks
+        and point the manifest at it.
+        """
+
+        rows = 0
+
+        with open(self._file("vectors", generation), "wb") as vectors_file, \
+                open(self._file("names", generation), "wb") as names_file:
+            for names, vectors in chunks:
+                vectors = np.asarray(vectors, dtype=self.dtype)
+                vectors_file.write(vectors.reshape(-1, self.dim).tobytes())
+                names_file.write(_encode_names(names).tobytes())
+                rows += len(names)
+
+        with open(self._file("deleted", generation), "wb") as f:
+            f.write(bytes(rows))
+
+        old_manifest = self._read_manifest()
+
+        self._write_manifest({
+            "generation": generation,
+            "rows": rows,
+            "deleted": 0,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+        })
+
+        if old_manifest and old_manifest["generation"] != generation:
+            for kind in ("vectors", "names", "deleted"):
+                try:
+                    os.remove(self._file(kind, old_manifest["generation"]))
+                except FileNotFoundError:
+                    pass
+
+    # Reading
+
+    def _refresh(self):
+        """Remap the files if another writer changed the manifest."""
+
+        if (self._manifest_file is not None
+                and os.stat(self._manifest_path()).st_ino
+                == os.fstat(self._manifest_file.fileno()).st_ino):
+            return
+
+        with self._lock:
+            manifest_file = open(self._manifest_path())
+            manifest = json.load(manifest_file)
+            generation, rows = manifest["generation"], manifest["rows"]
+
+            if manifest["dim"] != self.dim or manifest["dtype"] != self.dtype.name:
+                manifest_file.close()
+                raise ValueError(
+                    f"Vector store at {self.path} holds {manifest['dtype']} "
+                    f"vectors of size {manifest['dim']}"
+                )
+
+            old = self._manifest
+            if (old is None or old["generation"] != generation
+                    or old["rows"] != rows):
+                self._view = (
+                    self._map("vectors", generation, rows, self.dtype,
+                              (rows, self.dim)),
+                    self._map("names", generation, rows, NAME_DTYPE, (rows,)),
+                    self._map("deleted", generation, rows, np.uint8, (rows,)),
+                )
+
+            if self._manifest_file is not None:
+                self._manifest_file.close()
+
+            self._manifest = manifest
+            self._manifest_file = manifest_file
+
+            STORE_ROWS.set(rows)
+            STORE_DELETED.set(manifest["deleted"])
+
+    def _map(self, kind, generation, rows, dtype, shape):
+        if rows == 0:
+            return np.zeros(shape, dtype=dtype)
+
+        return np.memmap(
+            self._file(kind, generation), dtype=dtype, mode="r", shape=shape
+        )
+
+    def __len__(self):
+        """Number of live rows."""
+
+        self._refresh()
+        return self._manifest["rows"] - self._manifest["deleted"]
+
+    def search(self, embedding, limit, score_filter=None):
+        """
+        Return up to limit (name, inner product score) pairs, best first.
+        score_filter optionally takes the score array and returns a boolean
+        mask of rows that may be returned.
+        """
+
+        return self.search_many([embedding], [limit], [score_filter])[0]
+
+    def search_many(self, embeddings, limits, score_filters=None):
+        """
+        search for several embeddings at once, scoring them all in one pass
+        over the vectors. Returns a list of results per embedding.
+        """
+
+        self._refresh()
+
+        score_filters = score_filters or [None] * len(embeddings)
+
+        with metrics.Timer(SEARCH_SECONDS):
+            vectors, names, deleted = self._view
+            rows = len(names)
+            if rows == 0:
+                return [[] for _ in embeddings]
+
+            queries = np.asarray(embeddings, dtype=np.float32).reshape(
+                len(embeddings), self.dim
+            )
+            scores = np.empty((len(embeddings), rows), dtype=np.float32)
+
+            for start, end in _row_ranges(rows):
+                scores[:, start:end] = queries @ vectors[start:end].T
+
+            return [
+                self._top(names, deleted, query_scores, limit, score_filter)
+                for query_scores, limit, score_filter
+                in zip(scores, limits, score_filters)
+            ]
+
+    def _top(self, names, deleted, scores, limit, score_filter):
+        if limit <= 0:
+            return []
+
+        keep = deleted == 0
+        if score_filter is not None:
+            keep &= score_filter(scores)
+
+        candidates = np.flatnonzero(keep)
+        if len(candidates) == 0:
+            return []
+
+        k = min(limit, len(candidates))
+        candidate_scores = scores[candidates]
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+        top = top[np.argsort(-candidate_scores[top], kind="stable")]
+
+        return [
+            (names[i].decode(), float(scores[i]))
+            for i in candidates[top]
+        ]
+
+    # Writing
+
+    def append(self, name, embedding):
+        """Add one image's embedding."""
+
+        self.append_many([(name, embedding)])
+
+    def append_many(self, pairs):
+        """
+        Add (name, embedding) pairs of newly created images, writing their
+        rows and the manifest once. Names are the images table's primary
+        key, so no live row can already hold one and none are looked up.
+        """
+
+        pairs = list(pairs)
+        if not pairs:
+            return
+
+        names, vectors = zip(*pairs)
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(
+            len(pairs), self.dim
+        )
+
+        with self._write_lock():
+            manifest = self._read_manifest()
+            generation, rows = manifest["generation"], manifest["rows"]
+
+            # Truncate first so half-written rows from a crash are dropped
+            self._append_rows("vectors", generation, rows, vectors.tobytes(),
+                              self.row_bytes)
+            self._append_rows("names", generation, rows,
+                              _encode_names(names).tobytes(),
+                              NAME_DTYPE.itemsize)
+            self._append_rows("deleted", generation, rows, bytes(len(pairs)),
+                              1)
+
+            manifest["rows"] = rows + len(pairs)
+            self._write_manifest(manifest)
+
+    def _append_rows(self, kind, generation, rows, data, row_bytes):
+        with open(self._file(kind, generation), "r+b") as f:
+            f.truncate(rows * row_bytes)
+            f.seek(rows * row_bytes)
+            f.write(data)
+
+    def delete(self, name):
+        """Tombstone an image's row, compacting if enough rows are dead."""
+
+        with self._write_lock():
+            manifest = self._read_manifest()
+            manifest["deleted"] += self._tombstone_rows(manifest, name)
+            self._write_manifest(manifest)
+
+            if (manifest["rows"] and manifest["deleted"] / manifest["rows"]
+                    >= VECTOR_STORE_COMPACT_RATIO):
+                self._compact(manifest)
+
+    def _tombstone_rows(self, manifest, name):
+        """Flag every live row holding name. Returns how many were flagged."""
+
+        generation, rows = manifest["generation"], manifest["rows"]
+        if rows == 0:
+            return 0
+
+        names = np.memmap(self._file("names", generation), dtype=NAME_DTYPE,
+                          mode="r", shape=(rows,))
+        deleted = np.memmap(self._file("deleted", generation), dtype=np.uint8,
+                            mode="r+", shape=(rows,))
+
+        matches = np.flatnonzero((names == name.encode()) & (deleted == 0))
+        deleted[matches] = 1
+        deleted.flush()
+
+        return len(matches)
+
+    def compact(self):
+        """Rewrite the store without tombstoned rows."""
+
+        with self._write_lock():
+            self._compact(self._read_manifest())
+
+    def _compact(self, manifest):
+        generation, rows = manifest["generation"], manifest["rows"]
+
+        vectors = self._map("vectors", generation, rows, self.dtype,
+                            (rows, self.dim))
+        names = self._map("names", generation, rows, NAME_DTYPE, (rows,))
+        live = self._map("deleted", generation, rows, np.uint8, (rows,)) == 0
+
+        self._write_generation(
+            generation + 1,
+            (
+                (names[start:end][live[start:end]],
+                 vectors[start:end][live[start:end]])
+                for start, end in _row_ranges(rows)
+            )
+        )
+
+        logging.info(f"Compacted vector store to {int(live.sum())} rows")
+
+    def rebuild(self, rows):
+        """Replace the store's contents with (name, embedding) pairs."""
+
+        with self._write_lock():
+            generation = self._read_manifest()["generation"] + 1
+            self._write_generation(generation, _chunks(rows))
+
+
+def _encode_names(names):
+    return np.array(
+        [n.encode() if isinstance(n, str) else n for n in names],
+        dtype=NAME_DTYPE
+    )
+
+def _row_ranges(rows, size=SEARCH_CHUNK_ROWS):
+    for start in range(0, rows, size):
+        yield start, min(start + size, rows)
+
+def _chunks(rows, size=SEARCH_CHUNK_ROWS):
+    """Group (name, embedding) pairs into (names, vectors) chunks."""
+
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        names, vectors = zip(*chunk)
+        yield names, np.array(vectors)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return this process's handle on the configured vector store."""
+
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = VectorStore(
+                    VECTOR_STORE_DIR, EMBEDDING_SIZE, VECTOR_STORE_DTYPE
+                )
+
+    return _store
+
+def is_enabled():
+    return VECTOR_SEARCH_BACKEND == "mmap"
+
+def rebuild_from_db(db):
+    """Rebuild the store from the images table, the system of record."""
+
+    rows = db.execute(
+        select(Image.name, Image.embedding)
+        .execution_options(yield_per=1000)
+    )
+
+    get_store().rebuild((name, embedding) for name, embedding in rows)
+
+def main(argv):
+    """CLI: python -m app.vector_store [rebuild|compact]"""
+
+    if argv == ["rebuild"]:
+        from app.database import SessionLocal
+
+        with SessionLocal() as db:
+            rebuild_from_db(db)
+    elif argv == ["compact"]:
+        get_store().compact()
+    else:
+        print("usage: python -m app.vector_store [rebuild|compact]")
+        return 1
+
+    print(f"{len(get_store())} images in {VECTOR_STORE_DIR}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,98 @@
+"""
+Latency of a batch of N searches against N single searches, run one after
+another or in parallel the way a page of carousels would request them.
+
+Loads a synthetic library into the app's tables in a scratch schema, then
+times crud.search_images_batch against crud.get_images per query, with
+query embeddings computed by CLIP ("cold") or already cached ("warm").
+
+    python -m benchmarks.bench_batch_search --queries 8 --rows 10000
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.orm import sessionmaker
+
+import app.clip as clip
+import app.crud as crud
+import app.schemas as schemas
+from benchmarks.common import (
+    PROMPTS,
+    drop_schema,
+    load_images,
+    scratch_engine,
+    summarize,
+    time_calls,
+    write_results
+)
+
+SCHEMA = "bench_batch_search"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="Keep the schema")
+    args = parser.parse_args()
+
+    engine = scratch_engine(SCHEMA)
+    load_images(engine, args.rows, exif=lambda i: {"Make": "Canon"})
+    Session = sessionmaker(bind=engine)
+
+    clip.warm_up()
+
+    terms = (PROMPTS * (args.queries // len(PROMPTS) + 1))[:args.queries]
+    terms = [f"{term} {i}" for i, term in enumerate(terms)]
+    searches = [schemas.SearchQuery(q=term, limit=args.limit) for term in terms]
+
+    def single(term):
+        with Session() as db:
+            return list(crud.get_images(db, limit=args.limit, search_term=term))
+
+    def sequential():
+        return [single(term) for term in terms]
+
+    pool = ThreadPoolExecutor(max_workers=args.queries)
+
+    def parallel():
+        return list(pool.map(single, terms))
+
+    def batch():
+        with Session() as db:
+            return crud.search_images_batch(db, searches)
+
+    variants = {"sequential": sequential, "parallel": parallel, "batch": batch}
+
+    results = {
+        "rows": args.rows,
+        "queries": args.queries,
+        "limit": args.limit,
+        "clip_backend": clip.CLIP_BACKEND,
+    }
+
+    for cache in ("cold", "warm"):
+        for variant, function in variants.items():
+            def run():
+                if cache == "cold":
+                    crud.query_embedding_cache.clear()
+                return function()
+
+            # Fill the cache for warm runs
+            run()
+            _, latencies = time_calls(run, [()] * args.requests)
+            results[f"{cache}_{variant}"] = summarize(latencies)
+
+    pool.shutdown()
+
+    if not args.keep:
+        drop_schema(engine, SCHEMA)
+
+    write_results("batch_search", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Latency and throughput of each CLIP inference backend on CPU, along with its
+agreement with the eager fp32 reference.
+
+Measures single-query text latency (the search path), and batched text and
+image throughput (the micro-batcher and ingestion paths).
+
+    python -m benchmarks.bench_clip_backends --backends eager int8 onnx
+"""
+
+import argparse
+import tempfile
+from time import perf_counter
+
+import torch
+from PIL import Image
+from transformers import CLIPModel, CLIPProcessor
+
+import app.clip as clip
+import app.clip_backends as clip_backends
+from app.config import CLIP_MODEL_NAME
+from benchmarks.common import summarize, time_calls, write_results
+
+QUERIES = [
+    "a dog",
+    "sunset over the ocean",
+    "a photo of a red car parked on a street at night",
+    "two people hiking up a snowy mountain with backpacks",
+]
+
+
+def encode_text(encoder, processor, texts):
+    inputs = processor(text=texts, return_tensors="pt", padding=True)
+    with torch.inference_mode():
+        return clip._normalize(
+            encoder(inputs["input_ids"], inputs["attention_mask"])
+        )
+
+def encode_images(encoder, pixel_values):
+    with torch.inference_mode():
+        return clip._normalize(encoder(pixel_values))
+
+def throughput(function, args, items, repeats):
+    start = perf_counter()
+    for _ in range(repeats):
+        function(*args)
+    return items * repeats / (perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backends", nargs="+", default=list(clip_backends.BACKENDS)
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    texts = [QUERIES[i % len(QUERIES)] for i in range(args.batch_size)]
+    pixel_values = processor(
+        images=[Image.new("RGB", (640, 480), (i, i, i))
+                for i in range(args.batch_size)],
+        return_tensors="pt"
+    )["pixel_values"]
+
+    reference = None
+    results = {"threads": torch.get_num_threads()}
+    # Exports go to a scratch directory so the timing includes them
+    clip_backends.CLIP_ONNX_DIR = tempfile.mkdtemp()
+
+    for backend in ["eager"] + [b for b in args.backends if b != "eager"]:
+        model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).eval()
+
+        start = perf_counter()
+        try:
+            text_encoder, image_encoder = clip_backends.load(
+                backend, model, processor, CLIP_MODEL_NAME
+            )
+        except ImportError as e:
+            print(f"Skipping {backend}: {e}")
+            continue
+        load_seconds = perf_counter() - start
+
+        # The first call includes any lazy compilation
+        start = perf_counter()
+        text_embeds = encode_text(text_encoder, processor, texts)
+        image_embeds = encode_images(image_encoder, pixel_values)
+        first_call_seconds = perf_counter() - start
+
+        if reference is None:
+            reference = (text_embeds, image_embeds)
+
+        _, latencies = time_calls(
+            encode_text,
+            [(text_encoder, processor, [QUERIES[i % len(QUERIES)]])
+             for i in range(args.queries)]
+        )
+
+        results[backend] = {
+            "load_seconds": load_seconds,
+            "first_call_seconds": first_call_seconds,
+            "text_query": summarize(latencies),
+            "text_per_second": throughput(
+                encode_text, (text_encoder, processor, texts),
+                len(texts), args.repeats
+            ),
+            "images_per_second": throughput(
+                encode_images, (image_encoder, pixel_values),
+                len(pixel_values), args.repeats
+            ),
+            "min_text_cosine": float(
+                (text_embeds * reference[0]).sum(dim=-1).min()
+            ),
+            "min_image_cosine": float(
+                (image_embeds * reference[1]).sum(dim=-1).min()
+            ),
+        }
+
+    write_results("clip_backends", results)
+
+
+if __name__ == "__main__":
+    main()
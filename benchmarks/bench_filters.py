@@ -0,0 +1,119 @@
+"""
+Recall and latency of filtered semantic search with each FILTER_STRATEGY.
+
+Loads a synthetic library into the app's tables in a scratch schema, with
+camera makes ranging from common to rare, builds the HNSW index, then runs
+searches filtered on each make. Pre-filtering ranks every matching row
+exactly, so its results are the ground truth for recall.
+
+    python -m benchmarks.bench_filters --rows 100000 --k 10
+"""
+
+import argparse
+
+from sqlalchemy.orm import sessionmaker
+
+import app.crud as crud
+import app.schemas as schemas
+from app.cache import normalize_query
+from app.config import EMBEDDING_SIZE
+from benchmarks.common import (
+    drop_schema,
+    load_images,
+    random_unit_vectors,
+    recall_at_k,
+    scratch_engine,
+    summarize,
+    time_calls,
+    write_results
+)
+
+SCHEMA = "bench_filters"
+# Make: share of the library
+MAKES = {
+    "Canon": 0.6,
+    "NIKON CORPORATION": 0.3,
+    "FUJIFILM": 0.09,
+    "LEICA": 0.01,
+}
+STRATEGIES = ("pre", "post", "auto")
+
+
+def synthetic_make(i):
+    position = (i * 7919 % 10_000) / 10_000
+    for make, share in MAKES.items():
+        if position < share:
+            return make
+        position -= share
+    return make
+
+def synthetic_exif(i):
+    return {
+        "Make": synthetic_make(i),
+        "FocalLength": float(10 + i % 190),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--keep", action="store_true", help="Keep the schema")
+    args = parser.parse_args()
+
+    engine = scratch_engine(SCHEMA)
+    load_images(engine, args.rows, exif=synthetic_exif)
+    Session = sessionmaker(bind=engine)
+
+    # Seed the query cache so no model is needed
+    terms = [f"query {i}" for i in range(args.queries)]
+    for term, embedding in zip(
+            terms, random_unit_vectors(args.queries, EMBEDDING_SIZE, seed=1)):
+        crud.query_embedding_cache.set(normalize_query(term), embedding.tolist())
+
+    results = {
+        "rows": args.rows,
+        "k": args.k,
+        "filter_exact_max_rows": crud.FILTER_EXACT_MAX_ROWS,
+        "filter_oversample": crud.FILTER_OVERSAMPLE,
+        "filters": {},
+    }
+
+    with Session() as db:
+        def search(term, filters):
+            names = [
+                image.name for image in crud.get_images(
+                    db, limit=args.k, search_term=term, filters=filters
+                )
+            ]
+            # Resets the transaction-local search params
+            db.rollback()
+            return names
+
+        for make, share in MAKES.items():
+            filters = schemas.ImageFilters(make=make)
+            by_strategy = {}
+
+            for strategy in STRATEGIES:
+                crud.FILTER_STRATEGY = strategy
+                by_strategy[strategy] = time_calls(
+                    search, [(term, filters) for term in terms]
+                )
+
+            exact, _ = by_strategy["pre"]
+            results["filters"][make] = {"share": share}
+            for strategy, (names, latencies) in by_strategy.items():
+                recalls = [recall_at_k(n, e) for n, e in zip(names, exact)]
+                results["filters"][make][strategy] = {
+                    f"recall@{args.k}": sum(recalls) / len(recalls),
+                    **summarize(latencies),
+                }
+
+    if not args.keep:
+        drop_schema(engine, SCHEMA)
+
+    write_results("filters", results)
+
+
+if __name__ == "__main__":
+    main()
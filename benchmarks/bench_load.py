@@ -0,0 +1,249 @@
+"""
+Concurrent HTTP load against the API: latency percentiles, throughput and
+errors of each scenario at each concurrency level.
+
+By default it loads a synthetic library into a scratch schema and starts the
+app on it with uvicorn, with S3 served by an in-process moto server if
+--s3 local. With --url it loads an already running server instead and does
+no setup. The upload scenario writes to the bucket the server uses, so it is
+only run when asked for.
+
+    python -m benchmarks.bench_load --rows 100000 --concurrency 1 8 32
+    python -m benchmarks.bench_load --url http://localhost:8000 \\
+        --scenarios search similar
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import uuid
+from collections import Counter
+from contextlib import nullcontext
+from time import perf_counter, sleep
+
+import httpx
+from sqlalchemy.engine import make_url
+
+from benchmarks.common import (
+    IMAGES_DIR,
+    PROMPTS,
+    database_uri,
+    drop_schema,
+    load_images,
+    local_s3,
+    scratch_engine,
+    summarize,
+    write_results
+)
+
+SCHEMA = "bench_load"
+READY_TIMEOUT = 600
+
+
+class Scenarios:
+    """A request to make for each scenario, given the request's number."""
+
+    def __init__(self, rows, limit, admin_pw):
+        self.rows = rows
+        self.limit = limit
+        self.admin_pw = admin_pw
+        with open(os.path.join(IMAGES_DIR, "Nikon_D70.jpg"), "rb") as image:
+            self.upload_data = image.read()
+
+    def search(self, client, i):
+        return client.get(
+            "/images/",
+            params={"q": PROMPTS[i % len(PROMPTS)], "limit": self.limit}
+        )
+
+    def recent(self, client, i):
+        return client.get("/images/", params={"limit": self.limit})
+
+    def image(self, client, i):
+        return client.get(f"/images/image{random.randrange(self.rows)}")
+
+    def similar(self, client, i):
+        return client.get(
+            f"/images/image{random.randrange(self.rows)}/similar",
+            params={"limit": self.limit}
+        )
+
+    def upload(self, client, i):
+        # Trailing bytes make each file unique, so none is deduplicated
+        data = self.upload_data + uuid.uuid4().bytes
+        return client.post(
+            "/images/",
+            headers={"Authorization": "Bearer " + self.admin_pw},
+            data={"image_name": f"load-{uuid.uuid4().hex[:16]}"},
+            files={"file": ("Nikon_D70.jpg", data)}
+        )
+
+
+SCENARIOS = ("search", "recent", "image", "similar", "upload")
+DEFAULT_SCENARIOS = ("search", "recent", "image", "similar")
+
+
+async def run_load(url, request, concurrency, duration):
+    """
+    Make requests from concurrency clients for duration seconds.
+    Returns (latencies of successful requests, status counts, seconds taken).
+    """
+
+    latencies = []
+    statuses = Counter()
+    count = 0
+
+    async with httpx.AsyncClient(
+            base_url=url,
+            timeout=60,
+            limits=httpx.Limits(max_connections=concurrency)) as client:
+        start = perf_counter()
+        deadline = start + duration
+
+        async def worker():
+            nonlocal count
+            while perf_counter() < deadline:
+                count += 1
+                request_start = perf_counter()
+                try:
+                    response = await request(client, count)
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                    continue
+                statuses[response.status_code] += 1
+                if response.is_success:
+                    latencies.append(perf_counter() - request_start)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    return latencies, statuses, perf_counter() - start
+
+def start_server(port, workers):
+    """Start the app on the scratch schema with uvicorn."""
+
+    url = make_url(database_uri()).update_query_dict(
+        {"options": f"-csearch_path={SCHEMA},public"}
+    )
+    env = {
+        **os.environ,
+        "SQLALCHEMY_DATABASE_URI": url.render_as_string(hide_password=False),
+    }
+
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--port", str(port),
+            "--workers", str(workers),
+            "--log-level", "warning",
+        ],
+        env=env
+    )
+
+def wait_until_ready(url, server):
+    deadline = perf_counter() + READY_TIMEOUT
+
+    while perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited while starting")
+        try:
+            if httpx.get(f"{url}/ready").is_success:
+                return
+        except httpx.HTTPError:
+            pass
+        sleep(0.5)
+
+    raise RuntimeError(f"The server wasn't ready after {READY_TIMEOUT}s")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", help="Load a running server instead")
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=10_000,
+        help="Synthetic images, named image0 to image<rows - 1>"
+    )
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        choices=SCENARIOS,
+        default=list(DEFAULT_SCENARIOS)
+    )
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 8, 32]
+    )
+    parser.add_argument(
+        "--duration", type=float, default=20, help="Seconds per run"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=3, help="Unmeasured seconds per run"
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--s3", choices=("local",), help="Serve S3 from a moto server"
+    )
+    parser.add_argument("--keep", action="store_true", help="Keep the schema")
+    args = parser.parse_args()
+
+    scenarios = Scenarios(args.rows, args.limit, os.environ.get("ADMIN_PW", ""))
+    results = {
+        "rows": None if args.url else args.rows,
+        "limit": args.limit,
+        "workers": None if args.url else args.workers,
+        "duration_s": args.duration,
+        "s3": args.s3,
+    }
+
+    server = engine = None
+    with local_s3() if args.s3 and not args.url else nullcontext():
+        try:
+            if args.url:
+                url = args.url.rstrip("/")
+            else:
+                engine = scratch_engine(SCHEMA)
+                load_images(engine, args.rows)
+                url = f"http://127.0.0.1:{args.port}"
+                server = start_server(args.port, args.workers)
+                wait_until_ready(url, server)
+
+            for scenario in args.scenarios:
+                request = getattr(scenarios, scenario)
+                results[scenario] = {}
+
+                for concurrency in args.concurrency:
+                    asyncio.run(
+                        run_load(url, request, concurrency, args.warmup)
+                    )
+                    latencies, statuses, seconds = asyncio.run(
+                        run_load(url, request, concurrency, args.duration)
+                    )
+
+                    results[scenario][f"concurrency_{concurrency}"] = {
+                        "throughput_rps": len(latencies) / seconds,
+                        "errors": sum(
+                            n for status, n in statuses.items()
+                            if status not in range(200, 300)
+                        ),
+                        "statuses": {str(s): n for s, n in statuses.items()},
+                        **(summarize(latencies) if latencies else {"n": 0}),
+                    }
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+            if engine and not args.keep:
+                drop_schema(engine, SCHEMA)
+
+    write_results("load", results)
+
+
+if __name__ == "__main__":
+    main()
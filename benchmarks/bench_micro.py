@@ -0,0 +1,154 @@
+"""
+Latency of the building blocks of a request, each called on its own:
+clip.get_text_embedding, clip.get_image_embedding (from bytes, and from a
+URL with --s3), image_utils.scrape_exif and crud.get_images.
+
+crud.get_images runs against a synthetic library in a scratch schema, with
+query embeddings already cached so only the database is timed. With
+--s3 local the URL is served by an in-process moto server, with
+--s3 configured by the configured bucket.
+
+    python -m benchmarks.bench_micro --rows 100000 --requests 100
+"""
+
+import argparse
+import os
+from contextlib import nullcontext
+
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import (
+    IMAGES_DIR,
+    PROMPTS,
+    drop_schema,
+    load_images,
+    local_s3,
+    random_unit_vectors,
+    scratch_engine,
+    summarize,
+    time_calls,
+    write_results
+)
+
+SCHEMA = "bench_micro"
+IMAGES = ("Nikon_D70.jpg", "Pentax_K10D.jpg", "Fujifilm_FinePix_E500.jpg")
+S3_KEY = "bench_micro"
+
+
+def read_images():
+    images = []
+    for name in IMAGES:
+        with open(os.path.join(IMAGES_DIR, name), "rb") as image:
+            images.append(image.read())
+    return images
+
+def repeat(items, n):
+    return [(items[i % len(items)],) for i in range(n)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument(
+        "--s3",
+        choices=("local", "configured"),
+        help="Also time get_image_embedding from an S3 URL"
+    )
+    parser.add_argument("--keep", action="store_true", help="Keep the schema")
+    args = parser.parse_args()
+
+    with local_s3() if args.s3 == "local" else nullcontext():
+        # Imported here so app.bucket sees the local endpoint
+        import app.clip as clip
+        import app.crud as crud
+        import app.image_utils as image_utils
+        import app.schemas as schemas
+        from app.cache import normalize_query
+        from app.config import EMBEDDING_SIZE
+
+        images = read_images()
+        results = {
+            "rows": args.rows,
+            "limit": args.limit,
+            "clip_backend": clip.CLIP_BACKEND,
+            "s3": args.s3,
+        }
+
+        clip.warm_up()
+
+        # Distinct terms, as get_text_embedding itself doesn't cache
+        terms = [
+            (f"{PROMPTS[i % len(PROMPTS)]} {i}",) for i in range(args.requests)
+        ]
+        _, latencies = time_calls(clip.get_text_embedding, terms)
+        results["get_text_embedding"] = summarize(latencies)
+
+        _, latencies = time_calls(
+            clip.get_image_embedding_from_data, repeat(images, args.requests)
+        )
+        results["get_image_embedding_from_data"] = summarize(latencies)
+
+        if args.s3:
+            from app.bucket import Bucket
+
+            bucket = Bucket()
+            url = bucket.upload_file(images[0], S3_KEY)
+            _, latencies = time_calls(
+                clip.get_image_embedding, [(url,)] * args.requests
+            )
+            results["get_image_embedding"] = summarize(latencies)
+            bucket.delete_file(S3_KEY)
+
+        _, latencies = time_calls(
+            image_utils.scrape_exif, repeat(images, args.requests)
+        )
+        results["scrape_exif"] = summarize(latencies)
+
+        engine = scratch_engine(SCHEMA)
+        load_images(engine, args.rows, exif=lambda i: {
+            "Make": ("Canon", "NIKON CORPORATION", "FUJIFILM")[i % 3],
+        })
+        Session = sessionmaker(bind=engine)
+
+        # Seed the query cache so no model is needed
+        queries = [f"{term} cached" for term in PROMPTS]
+        embeddings = random_unit_vectors(len(queries), EMBEDDING_SIZE, seed=1)
+        for query, embedding in zip(queries, embeddings):
+            crud.query_embedding_cache.set(
+                normalize_query(query), embedding.tolist()
+            )
+
+        listings = {
+            "recent": {},
+            "search": {},
+            "filtered_search": {
+                "filters": schemas.ImageFilters(make="Canon")
+            },
+        }
+
+        with Session() as db:
+            for listing, kwargs in listings.items():
+                def get_images(query):
+                    images = list(crud.get_images(
+                        db,
+                        limit=args.limit,
+                        search_term=None if listing == "recent" else query,
+                        **kwargs
+                    ))
+                    db.rollback()
+                    return images
+
+                _, latencies = time_calls(
+                    get_images, repeat(queries, args.requests)
+                )
+                results[f"get_images_{listing}"] = summarize(latencies)
+
+        if not args.keep:
+            drop_schema(engine, SCHEMA)
+
+    write_results("micro", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Bytes transferred and latency of image listings with full rows (embedding
+and all EXIF data) against the slim projections crud now uses.
+
+Loads a synthetic library into the app's tables in a scratch schema, then
+times the newest-first listing and a semantic search page, each with full
+rows, without the embedding, and with only some EXIF keys.
+
+    python -m benchmarks.bench_projection --rows 10000 --limit 50
+"""
+
+import argparse
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import sessionmaker
+
+import app.crud as crud
+from app.cache import normalize_query
+from app.config import EMBEDDING_SIZE
+from app.models import Image
+from benchmarks.common import (
+    drop_schema,
+    load_images,
+    random_unit_vectors,
+    scratch_engine,
+    summarize,
+    time_calls,
+    write_results
+)
+
+SCHEMA = "bench_projection"
+SEARCH_TERM = "a photo of a dog"
+EXIF_FIELDS = ["Make", "Model"]
+
+
+def synthetic_exif(i):
+    """About the number and size of tags scrape_exif finds in a camera JPG."""
+
+    exif = {
+        "Make": "NIKON CORPORATION",
+        "Model": "NIKON D70",
+        "DateTime": f"2005:01:{i % 28 + 1:02} 12:00:00",
+        "ExposureTime": "1/250",
+        "FNumber": "8.0",
+        "ISOSpeedRatings": "200",
+        "FocalLength": "50.0",
+        "Software": "Ver.2.00",
+    }
+    exif.update({f"Tag{tag}": f"value {tag} {i}" * 3 for tag in range(40)})
+    return exif
+
+def response_bytes(engine, db, function):
+    """
+    Size of the rows the SELECTs run by function return, as sent in the
+    text protocol. Re-runs the exact SQL that was executed, so it only
+    counts the columns that were actually loaded.
+    """
+
+    executed = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            executed.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        function()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    total = 0
+    cursor = db.connection().connection.cursor()
+    for statement, parameters in executed:
+        cursor.execute(
+            f"SELECT coalesce(sum(octet_length(t::text)), 0) "
+            f"FROM ({statement}) t",
+            parameters
+        )
+        total += cursor.fetchone()[0]
+
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--keep", action="store_true", help="Keep the schema")
+    args = parser.parse_args()
+
+    engine = scratch_engine(SCHEMA)
+    load_images(engine, args.rows, exif=synthetic_exif)
+    Session = sessionmaker(bind=engine)
+
+    # Seed the query cache so no model is needed
+    embedding = random_unit_vectors(1, EMBEDDING_SIZE, seed=1)[0].tolist()
+    crud.query_embedding_cache.set(normalize_query(SEARCH_TERM), embedding)
+    distance = Image.embedding.max_inner_product(embedding)
+
+    full_statements = {
+        "recent": select(Image)
+        .order_by(Image.uploaded_at.desc(), Image.name.desc())
+        .limit(args.limit),
+        "search": select(Image, distance)
+        .order_by(distance)
+        .limit(args.limit),
+    }
+
+    results = {"rows": args.rows, "limit": args.limit}
+
+    with Session() as db:
+        for listing, search_term in (("recent", None), ("search", SEARCH_TERM)):
+            variants = {
+                "full": lambda: db.execute(full_statements[listing]).all(),
+                "no_embedding": lambda: list(crud.get_images(
+                    db, limit=args.limit, search_term=search_term
+                )),
+                "exif_fields": lambda: list(crud.get_images(
+                    db,
+                    limit=args.limit,
+                    search_term=search_term,
+                    exif_fields=EXIF_FIELDS
+                )),
+            }
+            for variant, function in variants.items():
+                _, latencies = time_calls(
+                    lambda: (function(), db.expunge_all()),
+                    [()] * args.requests
+                )
+                results[f"{listing}_{variant}"] = {
+                    "bytes_per_page": response_bytes(engine, db, function),
+                    **summarize(latencies),
+                }
+                db.rollback()
+
+    if not args.keep:
+        drop_schema(engine, SCHEMA)
+
+    write_results("projection", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Footprint, QPS and recall of compact embedding storage against exact search
+on full float32 vectors: vector and halfvec columns with an HNSW index on
+them, or with an HNSW index on their binary quantization whose candidates
+are re-ranked exactly, as EMBEDDING_TYPE and BINARY_QUANTIZATION set up.
+
+Loads a synthetic corpus of unit vectors, or with --real the embeddings in
+the app's images table, into a scratch table, then copies it into a table
+per configuration. Uniformly random vectors are harder on the quantized
+index than real CLIP embeddings, so recall is a lower bound unless --real.
+Needs pgvector >= 0.7.
+
+    python -m benchmarks.bench_quantization --rows 100000
+    python -m benchmarks.bench_quantization --real --candidates 100 400
+"""
+
+import argparse
+from time import perf_counter
+
+from sqlalchemy import create_engine, text
+
+import app.vector_index as vector_index
+from benchmarks.bench_vector_index import TABLE_NAME, load_corpus
+from benchmarks.common import (
+    database_uri,
+    random_unit_vectors,
+    recall_at_k,
+    summarize,
+    time_calls,
+    write_results
+)
+
+# Name: (storage type, index on the binary quantization)
+CONFIGS = {
+    "vector_hnsw": ("vector", False),
+    "halfvec_hnsw": ("halfvec", False),
+    "vector_binary": ("vector", True),
+    "halfvec_binary": ("halfvec", True),
+}
+CONFIG_TABLE = "bench_quantization"
+
+
+def load_real(engine, rows):
+    """Copy up to rows of the app's embeddings into the corpus table."""
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE_NAME}"))
+        conn.execute(
+            text(
+                f"CREATE TABLE {TABLE_NAME} AS "
+                "SELECT CAST(row_number() OVER (ORDER BY name) AS integer) "
+                "AS id, CAST(embedding AS vector) AS embedding FROM images "
+                "WHERE embedding IS NOT NULL ORDER BY name LIMIT :rows"
+            ),
+            {"rows": rows}
+        )
+        conn.execute(text(f"ALTER TABLE {TABLE_NAME} ADD PRIMARY KEY (id)"))
+        conn.execute(text(f"ANALYZE {TABLE_NAME}"))
+
+        return conn.execute(text(
+            f"SELECT count(*), max(vector_dims(embedding)) FROM {TABLE_NAME}"
+        )).one()
+
+def sample_queries(engine, n):
+    """Embeddings of n random images of the corpus, as similar searches."""
+
+    with engine.connect() as conn:
+        return conn.execute(
+            text(
+                f"SELECT CAST(embedding AS text) FROM {TABLE_NAME} "
+                "ORDER BY random() LIMIT :n"
+            ),
+            {"n": n}
+        ).scalars().all()
+
+def create_table(engine, storage, dim, binary):
+    """Copy the corpus into CONFIG_TABLE with the given storage."""
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {CONFIG_TABLE}"))
+        conn.execute(text(
+            f"CREATE TABLE {CONFIG_TABLE} AS SELECT id, "
+            f"CAST(embedding AS {storage}({dim})) AS embedding "
+            f"FROM {TABLE_NAME}"
+        ))
+        conn.execute(text(f"ALTER TABLE {CONFIG_TABLE} ADD PRIMARY KEY (id)"))
+        if binary:
+            conn.execute(text(
+                f"ALTER TABLE {CONFIG_TABLE} ADD COLUMN embedding_bits "
+                f"bit({dim}) GENERATED ALWAYS AS "
+                f"(binary_quantize(embedding)::bit({dim})) STORED"
+            ))
+        conn.execute(text(f"ANALYZE {CONFIG_TABLE}"))
+
+def build_index(engine, storage, binary):
+    params = ", ".join(
+        f"{key} = {value}"
+        for key, value in vector_index.build_params("hnsw").items()
+    )
+    column, ops = (
+        ("embedding_bits", "bit_hamming_ops") if binary
+        else ("embedding", f"{storage}_ip_ops")
+    )
+
+    start = perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE INDEX ON {CONFIG_TABLE} USING hnsw "
+            f"({column} {ops}) WITH ({params})"
+        ))
+    return perf_counter() - start
+
+def footprint(engine):
+    """Sizes of CONFIG_TABLE and its ANN index in MB."""
+
+    with engine.connect() as conn:
+        table_bytes, index_bytes = conn.execute(text(
+            f"SELECT pg_table_size('{CONFIG_TABLE}'), "
+            "coalesce(sum(pg_relation_size(indexrelid)), 0) "
+            "FROM pg_index JOIN pg_class ON pg_class.oid = indexrelid "
+            f"WHERE indrelid = '{CONFIG_TABLE}'::regclass "
+            "AND NOT indisprimary"
+        )).one()
+
+    return {
+        "table_mb": table_bytes / 1024 / 1024,
+        "index_mb": int(index_bytes) / 1024 / 1024,
+    }
+
+def search(conn, table, query, k, storage="vector"):
+    return conn.execute(
+        text(
+            f"SELECT id FROM {table} "
+            f"ORDER BY embedding <#> CAST(:q AS {storage}) LIMIT :k"
+        ),
+        {"q": query, "k": k}
+    ).scalars().all()
+
+def search_reranked(conn, query, k, candidates, storage, dim):
+    """The query crud runs with BINARY_QUANTIZATION."""
+
+    return conn.execute(
+        text(
+            "WITH candidates AS MATERIALIZED ("
+            f"SELECT id FROM {CONFIG_TABLE} "
+            "ORDER BY embedding_bits <~> "
+            f"binary_quantize(CAST(:q AS vector({dim}))) LIMIT :candidates) "
+            f"SELECT id FROM {CONFIG_TABLE} JOIN candidates USING (id) "
+            f"ORDER BY embedding <#> CAST(:q AS {storage}({dim})) LIMIT :k"
+        ),
+        {"q": query, "k": k, "candidates": candidates}
+    ).scalars().all()
+
+def measure(function, queries, exact, k):
+    results, latencies = time_calls(function, [(q,) for q in queries])
+    recalls = [recall_at_k(a, e) for a, e in zip(results, exact)]
+
+    return {
+        f"recall@{k}": sum(recalls) / len(recalls),
+        "qps": len(latencies) / sum(latencies),
+        **summarize(latencies),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--real", action="store_true", help="Use the app's embeddings"
+    )
+    parser.add_argument(
+        "--configs", nargs="+", choices=CONFIGS, default=list(CONFIGS)
+    )
+    parser.add_argument(
+        "--ef-search", type=int, default=vector_index.HNSW_EF_SEARCH
+    )
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        nargs="+",
+        default=[100, 200, 400, 800],
+        help="Re-ranked candidates for the binary index"
+    )
+    parser.add_argument("--keep", action="store_true", help="Keep the tables")
+    args = parser.parse_args()
+
+    engine = create_engine(database_uri())
+
+    if args.real:
+        rows, dim = load_real(engine, args.rows)
+        queries = sample_queries(engine, args.queries)
+    else:
+        rows, dim = args.rows, args.dim
+        load_corpus(engine, random_unit_vectors(rows, dim, seed=0))
+        queries = [
+            str(query.tolist())
+            for query in random_unit_vectors(args.queries, dim, seed=1)
+        ]
+
+    results = {
+        "rows": rows,
+        "dim": dim,
+        "k": args.k,
+        "real": args.real,
+        "build_params": vector_index.build_params("hnsw"),
+        "ef_search": args.ef_search,
+    }
+
+    # Ground truth: exact search on float32 vectors, without an index
+    create_table(engine, "vector", dim, False)
+    results["exact"] = footprint(engine)
+    with engine.connect() as conn:
+        exact, latencies = time_calls(
+            lambda q: search(conn, CONFIG_TABLE, q, args.k),
+            [(q,) for q in queries]
+        )
+    results["exact"].update({
+        "qps": len(latencies) / sum(latencies),
+        **summarize(latencies),
+    })
+
+    for name in args.configs:
+        storage, binary = CONFIGS[name]
+
+        create_table(engine, storage, dim, binary)
+        build_seconds = build_index(engine, storage, binary)
+        results[name] = {"build_seconds": build_seconds, **footprint(engine)}
+
+        if not binary:
+            with engine.connect() as conn:
+                conn.execute(text(f"SET hnsw.ef_search = {args.ef_search}"))
+                results[name].update(measure(
+                    lambda q: search(conn, CONFIG_TABLE, q, args.k, storage),
+                    queries, exact, args.k
+                ))
+            continue
+
+        results[name]["candidates"] = {}
+        for candidates in args.candidates:
+            # As vector_index.set_search_params does
+            ef_search = min(
+                max(args.ef_search, candidates), vector_index.MAX_EF_SEARCH
+            )
+            with engine.connect() as conn:
+                conn.execute(text(f"SET hnsw.ef_search = {ef_search}"))
+                results[name]["candidates"][candidates] = measure(
+                    lambda q: search_reranked(
+                        conn, q, args.k, candidates, storage, dim
+                    ),
+                    queries, exact, args.k
+                )
+
+    if not args.keep:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE {CONFIG_TABLE}"))
+            conn.execute(text(f"DROP TABLE {TABLE_NAME}"))
+
+    write_results("quantization", results)
+
+
+if __name__ == "__main__":
+    main()
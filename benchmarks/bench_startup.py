@@ -0,0 +1,101 @@
+"""
+Startup cost of the CLIP model: how long importing the app's modules takes,
+how long the model takes to load, the latency of the first search and upload
+embedding with and without the warm-up, and peak resident memory, for each
+CLIP_ROLE.
+
+Each run happens in a fresh interpreter so nothing is already imported or
+cached.
+
+    python -m benchmarks.bench_startup --runs 5 --roles all search ingest
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.common import summarize, write_results
+
+# Runs in the child interpreter and prints its timings as JSON
+CHILD = """
+import json
+import resource
+from time import perf_counter
+
+timings = {}
+
+start = perf_counter()
+import app.models
+timings["import_models"] = perf_counter() - start
+
+start = perf_counter()
+import app.clip as clip
+timings["import_clip"] = perf_counter() - start
+
+from PIL import Image
+image = Image.new("RGB", (640, 480))
+
+if WARM_UP:
+    start = perf_counter()
+    clip.warm_up()
+    timings["warm_up"] = perf_counter() - start
+else:
+    start = perf_counter()
+    clip.load_model()
+    timings["load_model"] = perf_counter() - start
+
+if clip.can_embed("text"):
+    start = perf_counter()
+    clip.get_text_embedding("a photo of a dog")
+    timings["first_text_embedding"] = perf_counter() - start
+
+    start = perf_counter()
+    clip.get_text_embedding("a photo of a cat")
+    timings["second_text_embedding"] = perf_counter() - start
+
+if clip.can_embed("image"):
+    start = perf_counter()
+    clip.get_image_embedding_from_data(image)
+    timings["first_image_embedding"] = perf_counter() - start
+
+max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({"timings": timings, "max_rss_mb": max_rss_mb}))
+"""
+
+
+def run_child(role, warm_up):
+    output = subprocess.check_output(
+        [sys.executable, "-c", f"WARM_UP = {warm_up}\n" + CHILD],
+        env={**os.environ, "CLIP_ROLE": role},
+        text=True
+    )
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--roles", nargs="+", default=["all", "search", "ingest"]
+    )
+    args = parser.parse_args()
+
+    results = {}
+
+    for role in args.roles:
+        for warm_up in (False, True):
+            runs = [run_child(role, warm_up) for _ in range(args.runs)]
+            results[f"{role}_{'warm_up' if warm_up else 'cold'}"] = {
+                "max_rss_mb": max(run["max_rss_mb"] for run in runs),
+                **{
+                    stage: summarize([run["timings"][stage] for run in runs])
+                    for stage in runs[0]["timings"]
+                }
+            }
+
+    write_results("startup", results)
+
+
+if __name__ == "__main__":
+    main()
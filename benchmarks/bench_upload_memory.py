@@ -0,0 +1,158 @@
+"""
+Peak memory and latency of processing a large upload: decoding it in full
+the way uploads used to, against decoding it at a reduced scale with
+image_utils.load_reduced. Each run scrapes EXIF, preprocesses for CLIP and
+makes the variants and perceptual hash, as the upload route does.
+
+Fixtures are large synthetic JPEGs, written to a temporary directory. Each
+run happens in a fresh interpreter, and its peak resident memory is
+measured above what the interpreter used before opening the image, which
+needs Linux's /proc/self/clear_refs. With --s3, the original is
+also uploaded to the configured bucket, with put_object from memory or
+streamed with upload_fileobj.
+
+    python -m benchmarks.bench_upload_memory --runs 3 --s3
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.common import summarize, write_results
+
+# Name: (width, height)
+FIXTURES = {
+    "photo_24mp": (6000, 4000),
+    "photo_50mp": (8660, 5773),
+    "panorama": (16000, 3000),
+}
+
+# Runs in the child interpreter and prints its measurements as JSON
+CHILD = """
+import json
+from time import perf_counter
+
+import app.clip as clip
+import app.image_utils as image_utils
+import app.variants as variants
+from app.config import CLIP_IMAGE_SIZE
+
+clip.get_image_processor()
+
+def rss_mb(field):
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+
+# Reset the peak to the current usage, as importing torch peaks higher
+# than decoding a reduced image does
+with open("/proc/self/clear_refs", "w") as clear_refs:
+    clear_refs.write("5")
+baseline = rss_mb("VmRSS")
+start = perf_counter()
+
+with open(PATH, "rb") as file:
+    image = image_utils.open_image(file)
+    image_utils.scrape_exif(image)
+    if MODE == "reduced":
+        image_utils.load_reduced(image, CLIP_IMAGE_SIZE, variants.max_size())
+    else:
+        image.load()
+    clip.preprocess_image(image)
+    variants.make_variants(image)
+    image_utils.perceptual_hash(image)
+    decoded_size = image.size
+
+    if S3:
+        from app.bucket import Bucket
+
+        file.seek(0)
+        if MODE == "reduced":
+            Bucket().upload_fileobj(file, "bench_upload_memory")
+        else:
+            Bucket().upload_file(file.read(), "bench_upload_memory")
+        Bucket().delete_file("bench_upload_memory")
+
+print(json.dumps({
+    "seconds": perf_counter() - start,
+    "peak_mb": rss_mb("VmHWM") - baseline,
+    "decoded_size": decoded_size,
+}))
+"""
+
+
+def make_fixture(directory, name, size, seed=0):
+    """A JPEG with enough detail that it doesn't compress to nothing."""
+
+    width, height = size
+    rng = np.random.default_rng(seed)
+
+    # Smooth colour fields plus noise, built at a low resolution and scaled
+    # up so the fixture itself is cheap to make
+    small = rng.integers(0, 256, (height // 50, width // 50, 3), np.uint8)
+    image = Image.fromarray(small).resize(size, Image.Resampling.BILINEAR)
+    noise = rng.integers(0, 32, (height, width // 8, 3), np.uint8)
+    image = Image.blend(
+        image,
+        Image.fromarray(noise).resize(size, Image.Resampling.NEAREST),
+        0.2
+    )
+
+    path = os.path.join(directory, f"{name}.jpg")
+    image.save(path, "JPEG", quality=90)
+    return path
+
+def run_child(path, mode, s3):
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            f"PATH = {path!r}\nMODE = {mode!r}\nS3 = {s3}\n" + CHILD
+        ],
+        text=True
+    )
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--fixtures", nargs="+", choices=FIXTURES, default=list(FIXTURES)
+    )
+    parser.add_argument(
+        "--s3", action="store_true", help="Upload to the configured bucket"
+    )
+    args = parser.parse_args()
+
+    results = {"s3": args.s3}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.fixtures:
+            path = make_fixture(directory, name, FIXTURES[name])
+            results[name] = {
+                "size": FIXTURES[name],
+                "file_mb": os.path.getsize(path) / 1024 / 1024,
+            }
+
+            for mode in ("full", "reduced"):
+                runs = [
+                    run_child(path, mode, args.s3) for _ in range(args.runs)
+                ]
+                results[name][mode] = {
+                    "peak_mb": max(run["peak_mb"] for run in runs),
+                    "decoded_size": runs[0]["decoded_size"],
+                    **summarize([run["seconds"] for run in runs]),
+                }
+
+    write_results("upload_memory", results)
+
+
+if __name__ == "__main__":
+    main()
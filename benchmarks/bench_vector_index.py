@@ -0,0 +1,152 @@
+"""
+Recall vs latency of the pgvector ANN index against exact search.
+
+Loads a synthetic corpus of unit vectors into a scratch table, measures exact
+(sequential scan) top-k, then builds the configured HNSW or IVFFlat index and
+sweeps hnsw.ef_search / ivfflat.probes.
+
+    python -m benchmarks.bench_vector_index --rows 100000 --index hnsw
+"""
+
+import argparse
+import io
+from time import perf_counter
+
+from sqlalchemy import create_engine, text
+
+import app.vector_index as vector_index
+from benchmarks.common import (
+    database_uri,
+    random_unit_vectors,
+    recall_at_k,
+    summarize,
+    time_calls,
+    write_results
+)
+
+TABLE_NAME = "bench_embeddings"
+
+
+def load_corpus(engine, vectors):
+    """Create the scratch table and COPY the corpus into it."""
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE_NAME}"))
+        conn.execute(text(
+            f"CREATE TABLE {TABLE_NAME} "
+            f"(id integer PRIMARY KEY, embedding vector({vectors.shape[1]}))"
+        ))
+
+    buffer = io.StringIO()
+    for i, vector in enumerate(vectors):
+        buffer.write(f"{i}\t[{','.join(map(str, vector.tolist()))}]\n")
+    buffer.seek(0)
+
+    raw = engine.raw_connection()
+    try:
+        raw.cursor().copy_expert(
+            f"COPY {TABLE_NAME} (id, embedding) FROM STDIN", buffer
+        )
+        raw.commit()
+    finally:
+        raw.close()
+
+    with engine.begin() as conn:
+        conn.execute(text(f"ANALYZE {TABLE_NAME}"))
+
+def build_index(engine, index_type):
+    params = ", ".join(
+        f"{key} = {value}"
+        for key, value in vector_index.build_params(index_type).items()
+    )
+
+    start = perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE INDEX ON {TABLE_NAME} USING {index_type} "
+            f"(embedding vector_ip_ops) WITH ({params})"
+        ))
+    return perf_counter() - start
+
+def search(conn, query, k):
+    return conn.execute(
+        text(
+            f"SELECT id FROM {TABLE_NAME} "
+            "ORDER BY embedding <#> CAST(:q AS vector) LIMIT :k"
+        ),
+        {"q": str(query.tolist()), "k": k}
+    ).scalars().all()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--index",
+        choices=["hnsw", "ivfflat"],
+        default=vector_index.VECTOR_INDEX_TYPE
+        if vector_index.VECTOR_INDEX_TYPE != "none" else "hnsw"
+    )
+    parser.add_argument(
+        "--sweep",
+        default=None,
+        help="Comma separated ef_search (hnsw) or probes (ivfflat) values"
+    )
+    parser.add_argument("--keep", action="store_true", help="Keep the table")
+    args = parser.parse_args()
+
+    sweep = args.sweep or (
+        "10,20,40,80,160" if args.index == "hnsw" else "1,5,10,20,50"
+    )
+    setting = "hnsw.ef_search" if args.index == "hnsw" else "ivfflat.probes"
+
+    engine = create_engine(database_uri())
+
+    corpus = random_unit_vectors(args.rows, args.dim, seed=0)
+    queries = random_unit_vectors(args.queries, args.dim, seed=1)
+
+    load_corpus(engine, corpus)
+
+    results = {
+        "rows": args.rows,
+        "dim": args.dim,
+        "k": args.k,
+        "index": args.index,
+        "build_params": vector_index.build_params(args.index),
+    }
+
+    with engine.connect() as conn:
+        exact, latencies = time_calls(
+            lambda q: search(conn, q, args.k), [(q,) for q in queries]
+        )
+    results["exact"] = summarize(latencies)
+
+    results["build_seconds"] = build_index(engine, args.index)
+    results["sweep"] = []
+
+    for value in [int(v) for v in sweep.split(",")]:
+        with engine.connect() as conn:
+            conn.execute(text(f"SET {setting} = {value}"))
+            approximate, latencies = time_calls(
+                lambda q: search(conn, q, args.k), [(q,) for q in queries]
+            )
+
+        recalls = [recall_at_k(a, e) for a, e in zip(approximate, exact)]
+
+        results["sweep"].append({
+            setting: value,
+            f"recall@{args.k}": sum(recalls) / len(recalls),
+            **summarize(latencies),
+        })
+
+    if not args.keep:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE {TABLE_NAME}"))
+
+    write_results(f"vector_index_{args.index}", results)
+
+
+if __name__ == "__main__":
+    main()
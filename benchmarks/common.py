@@ -0,0 +1,271 @@
+import csv
+import io
+import json
+import os
+import platform
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from statistics import mean
+from time import perf_counter
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RESULTS_DIR = os.environ.get(
+    "BENCHMARK_RESULTS_DIR",
+    os.path.join(os.path.dirname(__file__), "results")
+)
+# Camera JPGs with EXIF data
+IMAGES_DIR = os.path.join(
+    os.path.dirname(__file__), os.pardir, "app", "tests", "images"
+)
+# Search terms for benchmarks that need realistic queries
+PROMPTS = [
+    "a dog on a beach",
+    "a city skyline at night",
+    "a bowl of ramen",
+    "mountains covered in snow",
+    "a portrait of an old man",
+    "a red sports car",
+    "flowers in a garden",
+    "a cat sleeping on a sofa",
+    "a sunset over the ocean",
+    "people at a concert",
+    "a forest path in autumn",
+    "a plate of pasta",
+    "an airplane in the sky",
+    "a child playing football",
+    "a lighthouse on a cliff",
+    "a cup of coffee",
+]
+
+
+def database_uri():
+    """Database to benchmark against, defaulting to the app's database."""
+
+    return os.environ.get(
+        "BENCHMARK_DATABASE_URI",
+        os.environ.get("SQLALCHEMY_DATABASE_URI")
+    )
+
+def scratch_engine(schema):
+    """
+    Engine whose connections default to a scratch schema, so benchmarks can
+    create the app's own tables without touching its data. public stays on
+    the search path for the vector type.
+    """
+
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(database_uri())
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+    engine.dispose()
+
+    return create_engine(
+        database_uri(),
+        connect_args={"options": f"-csearch_path={schema},public"}
+    )
+
+def drop_schema(engine, schema):
+    from sqlalchemy import text
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+
+def load_images(engine, rows, exif=None, seed=0, chunk_size=100_000):
+    """
+    Fill the app's images table with a synthetic library of rows images with
+    random unit embeddings, uploaded a minute apart. exif(i) gives image i's
+    EXIF data. Rows are generated and COPYed chunk_size at a time, and the
+    embedding index is built once they're all in, so tens of millions of
+    rows load in bounded memory.
+    """
+
+    import app.models as models
+    import app.vector_index as vector_index
+    from sqlalchemy import text
+    from app.config import EMBEDDING_SIZE
+
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE images"))
+        conn.execute(text(f"DROP INDEX IF EXISTS {vector_index.INDEX_NAME}"))
+
+    start = datetime(2024, 1, 1)
+    rng = np.random.default_rng(seed)
+
+    for offset in range(0, rows, chunk_size):
+        count = min(chunk_size, rows - offset)
+        vectors = rng.standard_normal((count, EMBEDDING_SIZE), np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        embeddings = io.StringIO()
+        np.savetxt(embeddings, vectors, fmt="%.7g", delimiter=",")
+        embeddings.seek(0)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for i, embedding in enumerate(embeddings, start=offset):
+            writer.writerow([
+                f"image{i}",
+                f"https://bucket.s3.amazonaws.com/image{i}",
+                json.dumps(exif(i)) if exif else "",
+                f"[{embedding.strip()}]",
+                start + timedelta(minutes=i),
+            ])
+        buffer.seek(0)
+
+        raw = engine.raw_connection()
+        try:
+            raw.cursor().copy_expert(
+                "COPY images (name, aws_image_src, exif_data, embedding, "
+                "uploaded_at) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+            raw.commit()
+        finally:
+            raw.close()
+
+    vector_index.create_index(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE images"))
+
+@contextmanager
+def local_s3(bucket_name=None):
+    """
+    Run an in-process moto S3 server with an empty bucket, and point the app
+    at it through S3_ENDPOINT_URL, which app.bucket reads when imported.
+    Needs `pip install "moto[server]"`. Yields the endpoint URL.
+    """
+
+    from moto.server import ThreadedMotoServer
+    import boto3
+
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    endpoint_url = f"http://{host}:{port}"
+
+    bucket_name = bucket_name or os.environ.get("BUCKET_NAME", "benchmark")
+    client = boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        region_name="us-east-1",
+        aws_access_key_id="benchmark",
+        aws_secret_access_key="benchmark"
+    )
+    client.create_bucket(Bucket=bucket_name)
+    # Image URLs are fetched anonymously, like the app's public bucket
+    client.put_bucket_policy(Bucket=bucket_name, Policy=json.dumps({
+        "Version": "2012-10-17",
+        "Statement": [{
+            "Effect": "Allow",
+            "Principal": "*",
+            "Action": "s3:GetObject",
+            "Resource": f"arn:aws:s3:::{bucket_name}/*",
+        }],
+    }))
+
+    saved = {
+        name: os.environ.get(name)
+        for name in ("S3_ENDPOINT_URL", "AWS_ACCESS_KEY",
+                     "AWS_SECRET_ACCESS_KEY", "REGION")
+    }
+    os.environ.update({
+        "S3_ENDPOINT_URL": endpoint_url,
+        "AWS_ACCESS_KEY": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        "REGION": "us-east-1",
+    })
+
+    try:
+        yield endpoint_url
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        server.stop()
+
+def time_calls(function, args_list):
+    """
+    Call function once per args tuple in args_list.
+    Returns (results, per-call latencies in seconds).
+    """
+
+    results = []
+    latencies = []
+
+    for args in args_list:
+        start = perf_counter()
+        results.append(function(*args))
+        latencies.append(perf_counter() - start)
+
+    return results, latencies
+
+def summarize(latencies):
+    """Summarize per-call latencies in milliseconds."""
+
+    latencies_ms = np.array(latencies) * 1000
+
+    return {
+        "n": len(latencies),
+        "mean_ms": float(mean(latencies_ms)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+def random_unit_vectors(n, dim, seed=0):
+    """Generate n random float32 vectors of unit length."""
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def recall_at_k(approximate, exact):
+    """Fraction of the exact top-k found by the approximate search."""
+
+    return len(set(approximate) & set(exact)) / max(len(exact), 1)
+
+def write_results(name, results):
+    """
+    Write benchmark results to RESULTS_DIR/<name>.json along with the
+    commit and machine they were measured on.
+    """
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+
+    payload = {
+        "benchmark": name,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "machine": platform.platform(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+
+    path = os.path.join(RESULTS_DIR, f"{name}.json")
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+
+    print(json.dumps(results, indent=2))
+    print(f"Wrote {path}")
+    return path
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None